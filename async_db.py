@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Размер пула потоков для запросов к базе
+DB_THREADS = int(os.getenv('DB_THREADS', '4'))
+
+# Сколько заданий может ждать в очереди пула, дальше вызывающий ждёт свободного места
+DB_MAX_PENDING = int(os.getenv('DB_MAX_PENDING', '256'))
+
+
+class DBExecutor:
+    """Выполняет запросы к базе в отдельном ограниченном пуле потоков.
+
+    Одинаковые чтения (та же функция с теми же аргументами), пришедшие
+    в одной итерации цикла событий, выполняются один раз; разные чтения
+    расходятся по потокам пула параллельно.
+    """
+
+    def __init__(self, threads=DB_THREADS, max_pending=DB_MAX_PENDING):
+        self.threads = threads
+        self.max_pending = max_pending
+        self._pool = None
+        self._slots = None
+        self._loop = None
+        # Чтения текущей итерации цикла: (функция, аргументы) -> future
+        self._batch = {}
+        self._lock = threading.Lock()
+        # Статистика
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.jobs = 0
+        self.coalesced_reads = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='db')
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_pending)
+        return loop
+
+    def _record_wait(self, enqueued_at):
+        waited = time.perf_counter() - enqueued_at
+        metrics.DB_QUEUE_WAIT_SECONDS.observe(waited)
+        with self._lock:
+            self.queue_depth -= 1
+            self.in_flight += 1
+            self.jobs += 1
+            self.wait_time_total += waited
+            if waited > self.wait_time_max:
+                self.wait_time_max = waited
+
+    def _job_done(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def _submit(self, fn, *args):
+        """Поставить задание в пул с учётом ограничения очереди"""
+        loop = self._ensure_started()
+        async with self._slots:
+            enqueued_at = time.perf_counter()
+            with self._lock:
+                self.queue_depth += 1
+
+            def job():
+                self._record_wait(enqueued_at)
+                try:
+                    return _timed_call(fn, args)
+                finally:
+                    self._job_done()
+
+            return await loop.run_in_executor(self._pool, job)
+
+    async def write(self, fn, *args):
+        """Выполнить функцию записи в пуле"""
+        return await self._submit(fn, *args)
+
+    async def read(self, fn, *args):
+        """Выполнить функцию чтения в пуле, объединяя одновременные чтения"""
+        loop = self._ensure_started()
+        key = (fn, args)
+        try:
+            hash(key)
+        except TypeError:
+            # Нехэшируемые аргументы - выполняем без объединения
+            return await self._submit(fn, *args)
+
+        pending = self._batch.get(key)
+        if pending is not None:
+            self.coalesced_reads += 1
+            return await asyncio.shield(pending)
+
+        future = loop.create_future()
+        if not self._batch:
+            # Первое чтение в этой итерации - отправим чтения на следующем шаге цикла
+            loop.call_soon(self._flush_batch)
+        self._batch[key] = future
+        return await asyncio.shield(future)
+
+    def _flush_batch(self):
+        """Отправить каждое различное чтение итерации отдельным заданием пула"""
+        batch = self._batch
+        self._batch = {}
+        for (fn, args), future in batch.items():
+            task = asyncio.ensure_future(self._submit(fn, *args))
+            task.add_done_callback(lambda t, future=future: _copy_outcome(t, future))
+
+    def stats(self):
+        """Глубина очереди, время ожидания и счётчики заданий"""
+        with self._lock:
+            jobs = self.jobs
+            return {
+                'threads': self.threads,
+                'queue_depth': self.queue_depth,
+                'in_flight': self.in_flight,
+                'jobs': jobs,
+                'coalesced_reads': self.coalesced_reads,
+                'wait_time_avg_ms': (self.wait_time_total / jobs * 1000) if jobs else 0.0,
+                'wait_time_max_ms': self.wait_time_max * 1000,
+            }
+
+    def shutdown(self):
+        """Остановить пул потоков"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+def _timed_call(fn, args):
+    """Вызвать функцию и записать её время в метрики"""
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        metrics.DB_CALL_SECONDS.observe(
+            time.perf_counter() - started, getattr(fn, '__qualname__', repr(fn)))
+
+
+def _copy_outcome(task, future):
+    """Передать результат задания пула ожидающим чтения"""
+    if future.done():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+# Общий исполнитель для обоих ботов
+executor = DBExecutor()
+
+
+async def read(fn, *args):
+    """Выполнить чтение из базы, не блокируя цикл событий"""
+    return await executor.read(fn, *args)
+
+
+async def write(fn, *args):
+    """Выполнить запись в базу, не блокируя цикл событий"""
+    return await executor.write(fn, *args)
+
+
+def stats():
+    """Статистика пула запросов к базе"""
+    return executor.stats()
+
+
+def shutdown():
+    """Остановить пул запросов к базе"""
+    executor.shutdown()
@@ -0,0 +1,427 @@
+"""Бенчмарки поиска и диспетчерских операций на синтетической базе.
+
+Для каждого размера справочника создаётся база (bench_data.py) и в
+отдельном процессе замеряются функции работы с базой и обработчики
+bot.py - через настоящий Application и имитацию Bot API (fake_telegram.py).
+
+    python bench.py --sizes 10000,100000,1000000 --output bench_results.json
+    python bench.py --sizes 100000 --output new.json --compare bench_results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import asyncio
+import argparse
+import platform
+import sqlite3
+import subprocess
+from datetime import datetime
+
+import bench_data
+
+# Сколько раз выполнять каждую операцию
+BENCH_ITERATIONS = 500
+
+# Сколько обновлений обрабатывать одновременно в замере пропускной способности
+BENCH_CONCURRENCY = 32
+
+# Вызовов в синтетическом журнале для замера отчётов и за сколько дней
+BENCH_DISPATCHES = 100000
+BENCH_HISTORY_DAYS = 365
+
+# Рост p95 больше чем на эту долю считается регрессией в --compare
+REGRESSION_THRESHOLD = 0.2
+
+
+def percentile(sorted_values, p):
+    """Перцентиль p (0-100) отсортированного списка"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(timings, wall_time):
+    """Пропускная способность и задержки по замерам (секунды) в миллисекундах"""
+    timings = sorted(timings)
+    return {
+        'count': len(timings),
+        'throughput_per_s': len(timings) / wall_time if wall_time else 0.0,
+        'mean_ms': sum(timings) / len(timings) * 1000 if timings else 0.0,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'max_ms': timings[-1] * 1000 if timings else 0.0,
+    }
+
+
+def measure(fn, args_list):
+    """Вызвать fn для каждого набора аргументов, вернуть сводку"""
+    timings = []
+    started = time.perf_counter()
+    for args in args_list:
+        call_started = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - call_started)
+    return summarize(timings, time.perf_counter() - started)
+
+
+async def measure_async(coro_fn, args_list, concurrency=1):
+    """То же для корутин, не больше concurrency одновременно"""
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def timed(args):
+        async with semaphore:
+            call_started = time.perf_counter()
+            await coro_fn(*args)
+            timings.append(time.perf_counter() - call_started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(args) for args in args_list))
+    return summarize(timings, time.perf_counter() - started)
+
+
+class UpdateFactory:
+    """Обновления Telegram в том виде, в каком их присылает Bot API"""
+
+    def __init__(self, dispatcher_id):
+        self.dispatcher_id = dispatcher_id
+        self._update_id = 0
+
+    def _next_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': 'Бенчмарк'}
+
+    def message(self, text, user_id=None):
+        user_id = user_id or self.dispatcher_id
+        update_id = self._next_id()
+        data = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            data['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return {'update_id': update_id, 'message': data}
+
+    def location(self, lat, lon, user_id=None, live=False):
+        """Геопозиция; live=True - обновление трансляции (edited_message)"""
+        user_id = user_id or self.dispatcher_id
+        update_id = self._next_id()
+        data = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'location': {'latitude': lat, 'longitude': lon},
+        }
+        if live:
+            data['edit_date'] = data['date']
+            data['location']['live_period'] = 3600
+            return {'update_id': update_id, 'edited_message': data}
+        return {'update_id': update_id, 'message': data}
+
+    def callback(self, data, user_id=None):
+        user_id = user_id or self.dispatcher_id
+        update_id = self._next_id()
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': '1',
+                'data': data,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'text': 'Найдено объектов',
+                },
+            },
+        }
+
+
+def place_crews(conn, rng):
+    """Раздать экипажам координаты вокруг центра города"""
+    crew_ids = [row[0] for row in conn.execute('SELECT id FROM gbr_crews')]
+    conn.executemany('UPDATE gbr_crews SET lat = ?, lon = ?, location_at = ? WHERE id = ?', [
+        (bench_data.CENTER_LAT + rng.uniform(-bench_data.SPREAD, bench_data.SPREAD),
+         bench_data.CENTER_LON + rng.uniform(-bench_data.SPREAD, bench_data.SPREAD) * 1.8,
+         time.time(), crew_id)
+        for crew_id in crew_ids
+    ])
+    conn.commit()
+
+
+async def bench_handlers(bot, iterations, concurrency, queries, object_ids, crews, rng):
+    """Обработчики bot.py через Application с имитацией Bot API"""
+    import config
+    import geocoder
+    from fake_telegram import FAKE_TOKEN, FakeTelegramRequest
+    from stub_dadata import StubDaData
+    from telegram import Update
+
+    request = FakeTelegramRequest()
+    application = bot.build_application(token=FAKE_TOKEN, request=request)
+
+    # DaData - локальная заглушка, чтобы замерять сам бот, а не сеть
+    stub = StubDaData()
+    port = await stub.start()
+    bot.dadata_client = geocoder.DaDataGeocoder('bench', url=f'http://127.0.0.1:{port}/suggest')
+
+    factory = UpdateFactory(config.DISPATCHER_ID)
+
+    async def process(data):
+        await application.process_update(Update.de_json(data, application.bot))
+
+    await application.initialize()
+    await application.post_init(application)
+    results = {}
+    try:
+        results['handler_find'] = await measure_async(process, [
+            (factory.message(f'/find {query}'),) for query in rng.choices(queries, k=iterations)])
+        results['handler_find_concurrent'] = await measure_async(process, [
+            (factory.message(f'/find {query}'),) for query in rng.choices(queries, k=iterations)
+        ], concurrency)
+        results['handler_select'] = await measure_async(process, [
+            (factory.callback(f'select_{obj_id}'),) for obj_id in rng.choices(object_ids, k=iterations)])
+        results['handler_send_alarm'] = await measure_async(process, [
+            (factory.callback(f'send_{crew[0]}_{obj_id}'),)
+            for crew, obj_id in zip(rng.choices(crews, k=iterations), rng.choices(object_ids, k=iterations))
+        ])
+        results['handler_status'] = await measure_async(process, [
+            (factory.message('/status'),) for _ in range(iterations)])
+        results['handler_crew_status'] = await measure_async(process, [
+            (factory.message(rng.choice(('/busy', '/arrived', '/free')), int(crew[3])),)
+            for crew in rng.choices(crews, k=iterations)
+        ])
+        results['handler_address'] = await measure_async(process, [
+            (factory.message(f"{rng.choice(bench_data.STREETS)} {rng.randint(1, 150)}"),)
+            for _ in range(iterations)
+        ])
+    finally:
+        await application.post_shutdown(application)
+        await application.shutdown()
+        await stub.stop()
+
+    results['telegram_calls'] = dict(request.calls)
+    return results
+
+
+def bench_reports(crew_rows, object_ids, dispatches, days, iterations, rng):
+    """Запись журнала вызовов пачками и отчёты по его свёрткам"""
+    import db
+    import dispatch_log
+    import report
+
+    written = 0
+    started = time.perf_counter()
+    # С --reuse журнал уже записан прошлым запуском
+    if db.fetch_one("SELECT count(*) FROM dispatch_events WHERE kind = 'dispatch'")[0] < dispatches:
+        crew_ids = [crew[0] for crew in crew_rows]
+        for events in bench_data.dispatch_history(rng, crew_ids, object_ids, dispatches, days):
+            written += dispatch_log.write_events(events)
+    write_time = time.perf_counter() - started
+
+    # Отчёт тяжелее остальных операций - хватит меньшего числа повторов
+    repeats = max(1, iterations // 10)
+    return {
+        'dispatch_log_events': written,
+        'dispatch_log_events_per_s': (written / write_time) if written else None,
+        'report_7_days': measure(report.build_report, [(7,)] * repeats),
+        f'report_{days}_days': measure(report.build_report, [(days,)] * repeats),
+    }
+
+
+def run_size(size, crews, iterations, concurrency, db_dir, seed, reuse=False,
+             dispatches=BENCH_DISPATCHES, history_days=BENCH_HISTORY_DAYS):
+    """Замеры на одной базе (выполняется в отдельном процессе)"""
+    path = os.path.join(db_dir, f'bench_{size}.db')
+    generate_time = None
+    if not (reuse and os.path.exists(path)):
+        generate_time = bench_data.generate_catalog(path, size, crews, seed)
+
+    # Настройки читаются модулями при импорте
+    os.environ['DB_PATH'] = path
+    os.environ.setdefault('DADATA_API_KEY', 'bench')
+    import async_db
+    import bot
+    import crews as crew_ops
+    import db
+
+    # Журнал каждого запроса исказил бы замеры
+    logging.getLogger().setLevel(logging.WARNING)
+
+    started = time.perf_counter()
+    db.init_db()
+    init_time = time.perf_counter() - started
+
+    # Ключи нечёткого поиска строятся в фоне бота; здесь - сразу и с замером
+    import fuzzy_search
+    started = time.perf_counter()
+    fuzzy_search.refresh_all()
+    fuzzy_keys_time = time.perf_counter() - started
+
+    # Справочник адресов тоже наполняется в фоне бота
+    import gazetteer
+    started = time.perf_counter()
+    gazetteer.refresh_all()
+    gazetteer_keys_time = time.perf_counter() - started
+
+    rng = random.Random(seed)
+    with sqlite3.connect(path) as conn:
+        place_crews(conn, rng)
+    object_ids = [row[0] for row in db.fetch_all('SELECT id FROM objects')]
+    crew_rows = crew_ops.get_crew_status()
+    queries = bench_data.sample_queries(rng, 200)
+    typo_queries = bench_data.sample_typo_queries(rng, 200)
+    # Первый поиск загружает словарь - в замеры его не включаем
+    bot.search_objects(typo_queries[0])
+
+    results = {
+        'search_objects': measure(bot.search_objects, [(q,) for q in rng.choices(queries, k=iterations)]),
+        'search_typos': measure(bot.search_objects, [(q,) for q in rng.choices(typo_queries, k=iterations)]),
+        'search_first_page': measure(bot.start_search, [(q,) for q in rng.choices(queries, k=iterations)]),
+        # Страница в глубине выдачи: курсор - случайный id объекта со средней оценкой bm25
+        'search_page_deep': measure(bot.search_page, [
+            (q, (rng.uniform(-7, -5), obj_id))
+            for q, obj_id in zip(rng.choices(queries, k=iterations), rng.choices(object_ids, k=iterations))]),
+        'gazetteer_lookup': measure(gazetteer.lookup, [
+            (f"{rng.choice(bench_data.STREETS)} {rng.randint(1, 150)}",) for _ in range(iterations)]),
+        'get_object_by_id': measure(bot.get_object_by_id, [(i,) for i in rng.choices(object_ids, k=iterations)]),
+        'get_crew_status_all': measure(crew_ops.get_crew_status, [()] * iterations),
+        'get_crew_status_one': measure(crew_ops.get_crew_status, [
+            (crew[0],) for crew in rng.choices(crew_rows, k=iterations)]),
+        'update_crew_status': measure(crew_ops.update_crew_status, [
+            (crew[0], rng.choice(('free', 'busy', 'arrived'))) for crew in rng.choices(crew_rows, k=iterations)]),
+    }
+    results.update(asyncio.run(
+        bench_handlers(bot, iterations, concurrency, queries, object_ids, crew_rows, rng)))
+    if dispatches:
+        results.update(bench_reports(crew_rows, object_ids, dispatches, history_days, iterations, rng))
+    results['async_db'] = async_db.stats()
+
+    async_db.shutdown()
+    db.close_all()
+    return {
+        'objects': size,
+        'crews': crews,
+        'generate_s': generate_time,
+        'init_db_s': init_time,
+        'fuzzy_keys_s': fuzzy_keys_time,
+        'gazetteer_keys_s': gazetteer_keys_time,
+        'db_size_mb': os.path.getsize(path) / 1024 / 1024,
+        'results': results,
+    }
+
+
+def compare(current, previous, threshold=REGRESSION_THRESHOLD):
+    """Сравнить p95 с прошлым прогоном, вернуть список регрессий"""
+    regressions = []
+    for size, run in current['runs'].items():
+        old_run = previous.get('runs', {}).get(size)
+        if not old_run:
+            continue
+        for name, stats in run['results'].items():
+            old = old_run['results'].get(name)
+            if not isinstance(stats, dict) or not old or 'p95_ms' not in stats or not old.get('p95_ms'):
+                continue
+            change = stats['p95_ms'] / old['p95_ms'] - 1
+            marker = ' <-- регрессия' if change > threshold else ''
+            print(f"{size:>8} {name:<26} p95 {old['p95_ms']:8.2f} -> {stats['p95_ms']:8.2f} мс "
+                  f"({change:+.0%}){marker}")
+            if marker:
+                regressions.append((size, name, change))
+    return regressions
+
+
+def print_run(run):
+    print(f"\nОбъектов: {run['objects']}, экипажей: {run['crews']}, "
+          f"база {run['db_size_mb']:.1f} МБ, init_db {run['init_db_s']:.2f} с, "
+          f"ключи нечёткого поиска {run.get('fuzzy_keys_s', 0):.1f} с")
+    print(f"{'операция':<26} {'оп/с':>10} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}")
+    for name, stats in run['results'].items():
+        if isinstance(stats, dict) and 'p50_ms' in stats:
+            print(f"{name:<26} {stats['throughput_per_s']:10.1f} {stats['p50_ms']:9.2f} "
+                  f"{stats['p95_ms']:9.2f} {stats['p99_ms']:9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки поиска и диспетчерских операций')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='размеры справочника через запятую')
+    parser.add_argument('--crews', type=int, default=300)
+    parser.add_argument('--iterations', type=int, default=BENCH_ITERATIONS)
+    parser.add_argument('--concurrency', type=int, default=BENCH_CONCURRENCY)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db-dir', default='bench_dbs', help='каталог для баз бенчмарка')
+    parser.add_argument('--reuse', action='store_true', help='не пересоздавать существующие базы')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='соблюдать лимиты отправки Telegram (по умолчанию отключены)')
+    parser.add_argument('--dispatches', type=int, default=BENCH_DISPATCHES,
+                        help='вызовов в журнале для замера отчётов (0 - без отчётов)')
+    parser.add_argument('--history-days', type=int, default=BENCH_HISTORY_DAYS)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='прошлый результат для сравнения')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if not args.telegram_limits:
+            for name in ('TELEGRAM_GLOBAL_RATE', 'TELEGRAM_PER_CHAT_RATE', 'TELEGRAM_PER_CHAT_BURST'):
+                os.environ[name] = '1000000'
+        run = run_size(args.child, args.crews, args.iterations, args.concurrency,
+                       args.db_dir, args.seed, args.reuse, args.dispatches, args.history_days)
+        json.dump(run, sys.stdout)
+        return
+
+    os.makedirs(args.db_dir, exist_ok=True)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'iterations': args.iterations,
+        'concurrency': args.concurrency,
+        'runs': {},
+    }
+    for size in (int(size) for size in args.sizes.split(',')):
+        # Каждый размер - в своём процессе: чистые кэши и соединения
+        command = [
+            sys.executable, __file__, '--child', str(size), '--crews', str(args.crews),
+            '--iterations', str(args.iterations), '--concurrency', str(args.concurrency),
+            '--seed', str(args.seed), '--db-dir', args.db_dir,
+            '--dispatches', str(args.dispatches), '--history-days', str(args.history_days),
+        ]
+        if args.reuse:
+            command.append('--reuse')
+        if args.telegram_limits:
+            command.append('--telegram-limits')
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+        run = json.loads(output)
+        report['runs'][str(size)] = run
+        print_run(run)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        regressions = compare(report, previous)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Генерация синтетической базы объектов и экипажей для бенчмарков.
+
+    python bench_data.py bench_100k.db --objects 100000 --crews 300
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+
+# Схемы таблиц как в create_db.py и add_gbr_table.py
+OBJECTS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    address TEXT NOT NULL,
+    category TEXT,
+    notes TEXT,
+    lat REAL,
+    lon REAL
+)
+'''
+
+CREWS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS gbr_crews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    telegram_id TEXT UNIQUE,
+    status TEXT DEFAULT 'free',
+    last_active TIMESTAMP,
+    notes TEXT
+)
+'''
+
+# Центр города и разброс координат объектов, градусы (~±20 км)
+CENTER_LAT = 55.7558
+CENTER_LON = 37.6173
+SPREAD = 0.18
+
+STREETS = (
+    'Ленина', 'Советская', 'Мира', 'Победы', 'Гагарина', 'Пушкина', 'Лермонтова',
+    'Садовая', 'Заводская', 'Школьная', 'Молодёжная', 'Центральная', 'Лесная',
+    'Новая', 'Набережная', 'Октябрьская', 'Комсомольская', 'Первомайская',
+    'Кирова', 'Чехова', 'Горького', 'Строителей', 'Полевая', 'Рабочая',
+    'Маяковского', 'Свердлова', 'Дзержинского', 'Юбилейная', 'Спортивная', 'Тверская',
+)
+STREET_TYPES = ('ул.', 'ул.', 'ул.', 'пр-т', 'пер.', 'ш.', 'б-р', '')
+
+CATEGORIES = {
+    'магазин': ('Магазин Продукты', 'Магазин 24 часа', 'Магазин Эконом', 'Супермаркет', 'Минимаркет'),
+    'офис': ('Офис СтройСервис', 'Офис МегаСтрой', 'Бизнес-центр', 'Офис ТехноПром', 'Офис Логистик'),
+    'квартира': ('Квартира Иванова', 'Квартира Петрова', 'Квартира Сидорова', 'Квартира Смирновой'),
+    'склад': ('Склад №', 'Склад Стройматериалы', 'Склад Логистика', 'Склад Продукты'),
+    'аптека': ('Аптека', 'Аптека Здоровье', 'Аптека 36,6'),
+    'кафе': ('Кафе Уют', 'Кафе Встреча', 'Столовая', 'Пекарня'),
+    'банк': ('Банкомат', 'Отделение банка', 'Касса'),
+}
+
+NOTES = (
+    'код {code}, вход со двора', 'круглосуточно', 'домофон {flat}, {floor} этаж',
+    'код подъезда {code}', 'ворота кодовые {code}', 'вход с торца', 'проходная',
+    'ключи у охраны', 'сигнализация на втором этаже', '',
+)
+
+CREW_STATUSES = ('free', 'free', 'free', 'busy', 'arrived')
+
+
+def make_object(rng):
+    """Случайный правдоподобный объект: (name, address, category, notes, lat, lon)"""
+    category = rng.choice(tuple(CATEGORIES))
+    name = rng.choice(CATEGORIES[category])
+    if name.endswith('№'):
+        name += str(rng.randint(1, 99))
+
+    street_type = rng.choice(STREET_TYPES)
+    street = f"{street_type} {rng.choice(STREETS)}".strip()
+    house = rng.randint(1, 150)
+    if category == 'квартира':
+        address = f"{street}, {house}, кв {rng.randint(1, 300)}"
+    elif rng.random() < 0.3:
+        address = f"{street}, д. {house}"
+    else:
+        address = f"{street}, {house}"
+
+    notes = rng.choice(NOTES).format(
+        code=rng.randint(1000, 9999), flat=rng.randint(1, 300), floor=rng.randint(1, 16))
+
+    lat = CENTER_LAT + rng.uniform(-SPREAD, SPREAD)
+    lon = CENTER_LON + rng.uniform(-SPREAD, SPREAD) * 1.8
+    # Небольшая доля объектов без координат, как в реальном справочнике
+    if rng.random() < 0.02:
+        lat = lon = None
+    return name, address, category, notes, lat, lon
+
+
+def generate_catalog(path, objects=10000, crews=300, seed=1, chunk_size=20000):
+    """Создать базу path с objects объектами и crews экипажами.
+
+    Существующий файл заменяется. Возвращает время генерации, секунды.
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute(OBJECTS_SCHEMA)
+    conn.execute(CREWS_SCHEMA)
+
+    remaining = objects
+    while remaining > 0:
+        count = min(chunk_size, remaining)
+        conn.executemany('''
+            INSERT INTO objects (name, address, category, notes, lat, lon)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (make_object(rng) for _ in range(count)))
+        conn.commit()
+        remaining -= count
+
+    conn.executemany('''
+        INSERT INTO gbr_crews (name, telegram_id, status, notes)
+        VALUES (?, ?, ?, ?)
+    ''', ((f'ГБР-{i}', str(7000000000 + i), rng.choice(CREW_STATUSES), '')
+          for i in range(1, crews + 1)))
+    conn.commit()
+    conn.close()
+    return time.perf_counter() - started
+
+
+def sample_queries(rng, count):
+    """Запросы для поиска: названия, улицы, заметки, короткие слова, промахи"""
+    words = [name.split()[-1] for names in CATEGORIES.values() for name in names]
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.35:
+            queries.append(rng.choice(STREETS))
+        elif kind < 0.6:
+            queries.append(rng.choice(words))
+        elif kind < 0.8:
+            queries.append(f"{rng.choice(STREETS)} {rng.randint(1, 150)}")
+        elif kind < 0.9:
+            queries.append(rng.choice(STREETS)[:4].lower())
+        else:
+            queries.append(rng.choice(('Несуществующая', 'zzz', 'Бульвар Фантазий')))
+    return queries
+
+
+def make_typo(rng, word):
+    """Слово с одной опечаткой: замена, пропуск, лишняя буква или перестановка"""
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.randrange(4)
+    letter = rng.choice('аеиоуынстлкрв')
+    if kind == 0:
+        return word[:i] + letter + word[i + 1:]
+    if kind == 1:
+        return word[:i] + word[i + 1:]
+    if kind == 2:
+        return word[:i] + letter + word[i:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+
+def sample_typo_queries(rng, count):
+    """Запросы, как их набирают в спешке: опечатки, без "ул.", "№", нижний регистр"""
+    names = [name for names in CATEGORIES.values() for name in names]
+    queries = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.5:
+            queries.append(f"{make_typo(rng, rng.choice(STREETS).lower())} {rng.randint(1, 150)}")
+        elif kind < 0.75:
+            queries.append(make_typo(rng, rng.choice(STREETS).lower()))
+        elif kind < 0.9:
+            words = rng.choice(names).replace('№', '').split()
+            queries.append(' '.join(make_typo(rng, word.lower()) for word in words))
+        else:
+            queries.append(f"склад {rng.randint(1, 99)}")
+    return queries
+
+
+def dispatch_history(rng, crew_ids, object_ids, dispatches, days, end=None, chunk_size=20000):
+    """Журнал вызовов за days дней до end: пачки событий (время, вид, экипаж, объект).
+
+    На каждый вызов - "Занят", "Прибыл" и "Свободен" через правдоподобные
+    интервалы. Вызовы чаще днём и вечером; часть объектов вызывает ГБР
+    намного чаще остальных.
+    """
+    end = end or time.time()
+    start = end - days * 86400
+    frequent = rng.sample(object_ids, max(1, len(object_ids) // 100))
+    remaining = dispatches
+    chunk_start = start
+    while remaining > 0:
+        count = min(chunk_size, remaining)
+        chunk_end = chunk_start + (end - start) * count / dispatches
+        events = []
+        for _ in range(count):
+            at = rng.uniform(chunk_start, chunk_end)
+            # Ночью вызовов втрое меньше
+            if time.localtime(at).tm_hour < 7 and rng.random() < 0.66:
+                at = rng.uniform(chunk_start, chunk_end)
+            crew_id = rng.choice(crew_ids)
+            object_id = rng.choice(frequent) if rng.random() < 0.2 else rng.choice(object_ids)
+            busy = at + rng.lognormvariate(4.5, 0.6)
+            arrived = busy + rng.lognormvariate(6.3, 0.5)
+            free = arrived + rng.lognormvariate(7, 0.6)
+            events += [(at, 'dispatch', crew_id, object_id), (busy, 'busy', crew_id, None),
+                       (arrived, 'arrived', crew_id, None), (free, 'free', crew_id, None)]
+        yield events
+        remaining -= count
+        chunk_start = chunk_end
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Синтетическая база для бенчмарков')
+    parser.add_argument('path', help='файл базы (будет перезаписан)')
+    parser.add_argument('--objects', type=int, default=10000)
+    parser.add_argument('--crews', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    elapsed = generate_catalog(args.path, args.objects, args.crews, args.seed)
+    print(f"База {args.path}: {args.objects} объектов, {args.crews} экипажей за {elapsed:.1f} с")
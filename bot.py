@@ -1,11 +1,34 @@
 import os
+import time
+import asyncio
 import logging
-import sqlite3
-from datetime import datetime
+from urllib.parse import quote
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-import requests
+
+import async_db
+import config
+import crew_locations
+import db
+import dispatch_log
+import fuzzy_search
+import gazetteer
+import outbox
+import profiler
+import recorder
+import report
+import geocoder
+import geocode_worker
+import metrics
+from geocode_cache import GeocodeCache
+import search_index
+import sessions
+import status_feed
+from crews import (
+    get_crew_status_async, get_crew_by_telegram_id_async, update_crew_status_async,
+)
+import webhook
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -20,87 +43,192 @@ logger = logging.getLogger(__name__)
 # Получение токенов из переменных окружения
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 DADATA_API_KEY = os.getenv('DADATA_API_KEY')
+DADATA_URL = os.getenv('DADATA_URL', geocoder.DADATA_URL)
 
 # Путь к базе данных
-DB_PATH = 'objects.db'
+DB_PATH = config.DB_PATH
 
 # ID диспетчера (ваш)
-DISPATCHER_ID = 5986066094
+DISPATCHER_ID = config.DISPATCHER_ID
 
-# Хранилище состояний поиска
-user_search_state = {}
+# Асинхронный клиент DaData (общий пул соединений)
+dadata_client = geocoder.DaDataGeocoder(DADATA_API_KEY, url=DADATA_URL)
 
+# Кэш геокодирования: память + таблица geocode_cache
+geocode_cache = GeocodeCache()
 
-def get_crew_status(crew_id=None):
-    """Получить статус экипажа(ей)"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    if crew_id:
-        cursor.execute('SELECT id, name, status, telegram_id FROM gbr_crews WHERE id = ?', (crew_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result
-    else:
-        cursor.execute('SELECT id, name, status, telegram_id FROM gbr_crews ORDER BY id')
-        results = cursor.fetchall()
-        conn.close()
-        return results
-
-
-def update_crew_status(crew_id, status, telegram_id=None):
-    """Обновить статус экипажа"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    if telegram_id:
-        cursor.execute('''
-            UPDATE gbr_crews 
-            SET status = ?, last_active = ?, telegram_id = ?
-            WHERE id = ?
-        ''', (status, datetime.now(), telegram_id, crew_id))
-    else:
-        cursor.execute('''
-            UPDATE gbr_crews 
-            SET status = ?, last_active = ?
-            WHERE id = ?
-        ''', (status, datetime.now(), crew_id))
-    
-    conn.commit()
-    conn.close()
+# Фоновое геокодирование объектов без координат (GEOCODE_WORKER=1)
+background_geocoder = geocode_worker.GeocodeWorker(dadata_client, geocode_cache)
 
+# Последние координаты экипажей (пишет бот ГБР; при раздельном запуске - через базу)
+crew_positions = crew_locations.positions
 
-def search_objects(query):
-    """Поиск объектов в базе данных"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Получаем ВСЕ объекты
-    cursor.execute('SELECT id, name, address, category, notes, lat, lon FROM objects')
-    all_objects = cursor.fetchall()
-    conn.close()
-    
-    # Ищем в Python
-    query_lower = query.lower()
-    results = []
-    
-    for obj in all_objects:
-        obj_id, name, address, category, notes, lat, lon = obj
-        if query_lower in name.lower() or query_lower in address.lower():
-            results.append(obj)
+# Сколько экипажей показывать при выборе, кому отправить вызов
+CREW_KEYBOARD_SIZE = 15
+
+# Сколько ближайших свободных ГБР получают массовый вызов
+ALARM_FANOUT_SIZE = int(os.getenv('ALARM_FANOUT_SIZE', '3'))
+
+# Старшие смены: получают копию каждого массового вызова (ID через запятую)
+SUPERVISOR_IDS = [chat_id.strip() for chat_id in os.getenv('SUPERVISOR_IDS', '').split(',') if chat_id.strip()]
+
+# Очередь исходящих тревог (таблица outbox) и параметры сообщений
+alarm_outbox = outbox.OutboxWorker()
+ALARM_OPTIONS = {'parse_mode': 'HTML', 'disable_web_page_preview': True}
+
+# Сколько ждать доставки, прежде чем ответить диспетчеру "в очереди", секунды
+ALARM_ACK_WAIT = 5
+
+# Результатов поиска на странице /find и предел подсчёта найденных
+SEARCH_PAGE_SIZE = 5
+SEARCH_COUNT_CAP = 1000
+
+# Сколько помнить запросы для кнопок листания, секунды
+SEARCH_QUERY_TTL = 7 * 24 * 3600
+
+db.register_schema(search_index.ensure_search_queries)
+
+# Готовые счётчики модулей - в метрики
+metrics.register_stats('db_pool', async_db.stats)
+metrics.register_stats('dadata', lambda: dadata_client.stats())
+metrics.register_stats('geocode_cache', geocode_cache.stats)
+metrics.register_stats('outbox', alarm_outbox.stats)
+metrics.register_stats('status_feed', status_feed.feed.stats)
+metrics.register_stats('geocode_worker', background_geocoder.stats)
+metrics.register_stats('fuzzy_search', fuzzy_search.engine.stats)
+metrics.register_stats('sessions', sessions.store.stats)
+metrics.register_stats('dispatch_log', dispatch_log.log.stats)
+metrics.register_stats('gazetteer', gazetteer.index.stats)
+
+
+def search_objects(query, limit=10):
+    """Поиск объектов в базе данных с учётом опечаток, лучшие совпадения первыми"""
+    results = fuzzy_search.search(db.get_reader(), query, limit)
     
     logger.info(f"Поиск '{query}': найдено {len(results)} объектов")
-    return results[:10]
+    return results
 
 
 def get_object_by_id(obj_id):
     """Получить объект по ID"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, address, category, notes, lat, lon FROM objects WHERE id = ?', (obj_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    return db.fetch_one('SELECT id, name, address, category, notes, lat, lon FROM objects WHERE id = ?', (obj_id,))
+
+
+async def search_objects_async(query, limit=10):
+    """Поиск объектов, не блокируя бота"""
+    return await async_db.read(search_objects, query, limit)
+
+
+def start_search(query):
+    """Первая страница поиска и число найденных (не больше SEARCH_COUNT_CAP)"""
+    conn = db.get_reader()
+    rows = search_index.search_page(conn, query, None, SEARCH_PAGE_SIZE)
+    total = search_index.count_matches(conn, query, SEARCH_COUNT_CAP) if rows else 0
+    logger.info(f"Поиск '{query}': найдено {total} объектов")
+    return rows, total
+
+
+def search_page(query, cursor, backward=False):
+    """Соседняя страница поиска: после крайнего объекта cursor = (rank, id) или перед ним"""
+    return search_index.search_page(db.get_reader(), query, cursor, SEARCH_PAGE_SIZE, backward)
+
+
+def save_search_query(query, total):
+    """Номер запроса для кнопок листания; заодно забыть давно не нужные"""
+    now = time.time()
+    with db.write_transaction() as conn:
+        search_index.purge_queries(conn, now - SEARCH_QUERY_TTL)
+        return search_index.save_query(conn, query, total, now)
+
+
+def load_search_query(token):
+    return search_index.load_query(db.get_reader(), token)
+
+
+def build_results_page(rows, total, page, token=None, backward=False):
+    """Текст и клавиатура страницы результатов поиска.
+
+    rows - результат search_page (на строку больше страницы, если в
+    направлении листания есть ещё объекты; rank - последней колонкой)
+    """
+    if backward:
+        rows = rows[-SEARCH_PAGE_SIZE:]
+        has_next = True
+    else:
+        has_next = len(rows) > SEARCH_PAGE_SIZE
+        rows = rows[:SEARCH_PAGE_SIZE]
+    has_prev = page > 1
+
+    keyboard = []
+    first_number = (page - 1) * SEARCH_PAGE_SIZE + 1
+    for i, obj in enumerate(rows, first_number):
+        obj_id, name, address = obj[:3]
+        button_text = f"{i}. {name} ({address})"
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"select_{obj_id}")])
+
+    # Кнопки листания несут номер запроса, страницу и (rank, id) крайнего объекта
+    navigation = []
+    if token is not None and has_prev:
+        navigation.append(InlineKeyboardButton(
+            "◀️ Назад", callback_data=f"page_{token}_{page - 1}_p_{rows[0][-1]!r}_{rows[0][0]}"))
+    if token is not None and has_next:
+        navigation.append(InlineKeyboardButton(
+            "Далее ▶️", callback_data=f"page_{token}_{page + 1}_n_{rows[-1][-1]!r}_{rows[-1][0]}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    found = f"{total}+" if total >= SEARCH_COUNT_CAP else str(total)
+    text = f"Найдено объектов: {found}. Выберите:"
+    if has_prev or has_next:
+        text = f"Найдено объектов: {found}, страница {page}. Выберите:"
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def get_object_by_id_async(obj_id):
+    """Получить объект по ID, не блокируя бота"""
+    return await async_db.read(get_object_by_id, obj_id)
+
+
+def rank_crews_near(crews, lat, lon, limit):
+    """Свежие координаты из базы и экипажи по близости к точке (в пуле базы, не в цикле событий)"""
+    crew_positions.refresh_from_db()
+    return crew_locations.rank_crews(crews, crew_positions, lat, lon, limit=limit)
+
+
+def alarm_key(query, chat_id):
+    """Ключ идемпотентности вызова: повторное нажатие той же кнопки не дублирует тревогу"""
+    return f"{query.message.chat_id}:{query.message.message_id}:{query.data}:{chat_id}"
+
+
+def has_coordinates(lat, lon):
+    return lat is not None and lon is not None
+
+
+def route_links(address, lat, lon):
+    """Ссылки (Навигатор, Карты): маршрут по координатам, без них - поиск по адресу"""
+    if has_coordinates(lat, lon):
+        return (f"yandexnavi://build_route_on_map?lat_to={lat}&lon_to={lon}",
+                f"https://yandex.ru/maps/?rtext=~{lat},{lon}&rtab=auto")
+    text = quote(address)
+    return (f"yandexnavi://map_search?text={text}",
+            f"https://yandex.ru/maps/?text={text}")
+
+
+def build_alarm_message(obj):
+    """Текст тревоги для ГБР по объекту"""
+    obj_id, name, address, category, notes, lat, lon = obj
+    navi_url, maps_url = route_links(address, lat, lon)
+    warning = "" if has_coordinates(lat, lon) else "⚠️ Координаты не определены, поиск по адресу\n"
+    
+    return (
+        f"🚨 Срабатывание: ТРЕВОГА\n"
+        f"🏠 {name}\n"
+        f"📍 {address}\n"
+        f"📝 {notes}\n\n"
+        f"{warning}"
+        f"🚗 <a href='{navi_url}'>Открыть в Навигаторе</a>\n"
+        f"🗺️ <a href='{maps_url}'>Открыть в Картах</a>"
+    )
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -113,20 +241,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             "Команды:\n"
             "/find [название] - найти объект в базе\n"
             "/status - показать статусы ГБР\n"
+            "/profile [секунды] - профиль работы бота\n"
+            "/report [дней] [csv] - отчёт по вызовам\n"
             "Или просто отправьте адрес для поиска в DaData"
         )
     else:
         # Это ГБР, проверяем, есть ли в базе
-        crews = get_crew_status()
-        crew_found = False
-        
-        for crew in crews:
-            if crew[3] == str(user_id):
-                crew_found = True
-                update_crew_status(crew[0], 'free', str(user_id))
-                break
+        crew = await get_crew_by_telegram_id_async(user_id)
         
-        if crew_found:
+        if crew:
+            await update_crew_status_async(crew[0], 'free', str(user_id))
+            
             welcome_message = (
                 "👋 Привет, ГБР!\n\n"
                 "Твой статус: 🟢 Свободен\n\n"
@@ -151,36 +276,22 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
     
     if user_id == DISPATCHER_ID:
-        # Диспетчер видит все статусы
-        crews = get_crew_status()
-        status_text = "📊 **СТАТУСЫ ГБР:**\n\n"
-        
-        status_emoji = {
-            'free': '🟢 Свободен',
-            'busy': '🔴 Занят',
-            'arrived': '🏁 На месте'
-        }
-        
-        for crew in crews:
-            crew_id, name, status, telegram_id = crew
-            status_text += f"{name}: {status_emoji.get(status, '⚪ Неизвестно')}\n"
-        
-        await update.message.reply_text(status_text)
+        # Диспетчер получает живое табло: дальше оно правится при каждой смене статуса
+        await status_feed.feed.show(update.effective_chat.id)
     
     else:
         # ГБР видит свой статус
-        crews = get_crew_status()
-        for crew in crews:
-            if crew[3] == str(user_id):
-                status_emoji = {
-                    'free': '🟢 Свободен',
-                    'busy': '🔴 Занят',
-                    'arrived': '🏁 На месте'
-                }
-                await update.message.reply_text(
-                    f"Твой статус: {status_emoji.get(crew[2], '⚪ Неизвестно')}"
-                )
-                return
+        crew = await get_crew_by_telegram_id_async(user_id)
+        if crew:
+            status_emoji = {
+                'free': '🟢 Свободен',
+                'busy': '🔴 Занят',
+                'arrived': '🏁 На месте'
+            }
+            await update.message.reply_text(
+                f"Твой статус: {status_emoji.get(crew[2], '⚪ Неизвестно')}"
+            )
+            return
         
         await update.message.reply_text("❌ Ты не зарегистрирован как ГБР.")
 
@@ -188,13 +299,12 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def busy_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """ГБР занят"""
     user_id = update.effective_user.id
-    crews = get_crew_status()
+    crew = await get_crew_by_telegram_id_async(user_id)
     
-    for crew in crews:
-        if crew[3] == str(user_id):
-            update_crew_status(crew[0], 'busy')
-            await update.message.reply_text("✅ Статус изменён: 🔴 Занят")
-            return
+    if crew:
+        await update_crew_status_async(crew[0], 'busy')
+        await update.message.reply_text("✅ Статус изменён: 🔴 Занят")
+        return
     
     await update.message.reply_text("❌ Ты не зарегистрирован как ГБР.")
 
@@ -202,13 +312,12 @@ async def busy_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def arrived_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """ГБР прибыл"""
     user_id = update.effective_user.id
-    crews = get_crew_status()
+    crew = await get_crew_by_telegram_id_async(user_id)
     
-    for crew in crews:
-        if crew[3] == str(user_id):
-            update_crew_status(crew[0], 'arrived')
-            await update.message.reply_text("✅ Статус изменён: 🏁 Прибыл на место")
-            return
+    if crew:
+        await update_crew_status_async(crew[0], 'arrived')
+        await update.message.reply_text("✅ Статус изменён: 🏁 Прибыл на место")
+        return
     
     await update.message.reply_text("❌ Ты не зарегистрирован как ГБР.")
 
@@ -216,13 +325,12 @@ async def arrived_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def free_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """ГБР свободен"""
     user_id = update.effective_user.id
-    crews = get_crew_status()
+    crew = await get_crew_by_telegram_id_async(user_id)
     
-    for crew in crews:
-        if crew[3] == str(user_id):
-            update_crew_status(crew[0], 'free')
-            await update.message.reply_text("✅ Статус изменён: 🟢 Свободен")
-            return
+    if crew:
+        await update_crew_status_async(crew[0], 'free')
+        await update.message.reply_text("✅ Статус изменён: 🟢 Свободен")
+        return
     
     await update.message.reply_text("❌ Ты не зарегистрирован как ГБР.")
 
@@ -247,37 +355,108 @@ async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     query = ' '.join(context.args) if context.args else ''
     
     if not query:
-        await update.message.reply_text("Укажите название для поиска, например: /find магазин")
+        # Подсказываем прошлый запрос (он хранится и после перезапуска бота)
+        last_query = (await sessions.store.get(user_id)).get('last_query')
+        hint = f"\nПрошлый запрос: /find {last_query}" if last_query else ''
+        await update.message.reply_text("Укажите название для поиска, например: /find магазин" + hint)
         return
+    await sessions.store.update(user_id, last_query=query)
     
-    # Ищем в базе
-    results = search_objects(query)
+    # Ищем в базе: только первая страница, следующие - по кнопкам
+    rows, total = await async_db.read(start_search, query)
     
-    if not results:
-        await update.message.reply_text(f"По запросу '{query}' ничего не найдено.")
+    if not rows:
+        # Точных совпадений нет - возможно, опечатка
+        rows = await search_objects_async(query, SEARCH_PAGE_SIZE)
+        if not rows:
+            await update.message.reply_text(f"По запросу '{query}' ничего не найдено.")
+            return
+        text, reply_markup = build_results_page(rows, len(rows), 1)
+        await update.message.reply_text(
+            f"Точных совпадений по запросу '{query}' нет. Похожие объекты:",
+            reply_markup=reply_markup
+        )
         return
     
-    # Сохраняем результаты
-    user_search_state[user_id] = results
+    # Запрос запоминаем в базе, только если есть что листать
+    token = None
+    if len(rows) > SEARCH_PAGE_SIZE:
+        token = await async_db.write(save_search_query, query, total)
     
-    # Формируем клавиатуру
-    keyboard = []
-    for i, obj in enumerate(results[:5]):
-        obj_id, name, address, category, notes, lat, lon = obj
-        button_text = f"{i+1}. {name} ({address})"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"select_{obj_id}")])
+    text, reply_markup = build_results_page(rows, total, 1, token)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Профилирование бота на лету (только для диспетчера)"""
+    if update.effective_user.id != DISPATCHER_ID:
+        await update.message.reply_text("❌ Эта команда только для диспетчера.")
+        return
+    
+    if profiler.is_active():
+        await update.message.reply_text("⏳ Профилирование уже идёт.")
+        return
     
-    if len(results) > 5:
-        keyboard.append([InlineKeyboardButton("Показать все", callback_data="show_all")])
+    try:
+        seconds = int(context.args[0]) if context.args else profiler.PROFILE_SECONDS
+    except ValueError:
+        await update.message.reply_text("Укажите длительность в секундах, например: /profile 30")
+        return
+    seconds = max(1, min(seconds, profiler.PROFILE_MAX_SECONDS))
+    
+    await update.message.reply_text(f"🔬 Профилирую {seconds} с...")
+    # Профилируем в фоне: обработчик не должен задерживать другие обновления
+    context.application.create_task(
+        send_profile(update.effective_chat.id, seconds, context), update=update
+    )
+
+
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отчёт по вызовам за последние дни (только для диспетчера)"""
+    if update.effective_user.id != DISPATCHER_ID:
+        await update.message.reply_text("❌ Эта команда только для диспетчера.")
+        return
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    days, as_csv = report.REPORT_DAYS, False
+    for arg in context.args or []:
+        if arg.lower() == 'csv':
+            as_csv = True
+        elif arg.isdigit() and int(arg) > 0:
+            days = int(arg)
+        else:
+            await update.message.reply_text("Укажите период в днях, например: /report 30 или /report 365 csv")
+            return
     
-    await update.message.reply_text(
-        f"Найдено объектов: {len(results)}. Выберите:",
-        reply_markup=reply_markup
+    data = await async_db.read(report.build_report, days)
+    if not as_csv:
+        await update.message.reply_text(report.format_text(data)[:4000])
+        return
+    await update.message.reply_document(
+        document=report.format_csv(data).encode('utf-8-sig'),
+        filename=f"report_{data['first_day']}_{data['last_day']}.csv",
+        caption=f"📊 Отчёт за {data['days']} дн., вызовов: {data['dispatches']}"
     )
 
 
+async def send_profile(chat_id, seconds, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Снять профиль и отправить сводку и стеки диспетчеру"""
+    try:
+        result, paths = await profiler.profile(seconds, profiler.running_handler_codes(context.application))
+    except RuntimeError as e:
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ {e}")
+        return
+    
+    summary = result.summary()
+    await context.bot.send_message(chat_id=chat_id, text=summary[:4000])
+    if not os.path.getsize(paths[1]):
+        return
+    with open(paths[1], 'rb') as f:
+        await context.bot.send_document(
+            chat_id=chat_id, document=f, filename=os.path.basename(paths[1]),
+            caption="Стеки для flamegraph.pl / speedscope"
+        )
+
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик нажатий на кнопки"""
     query = update.callback_query
@@ -293,34 +472,48 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     if data.startswith("select_"):
         obj_id = int(data.split("_")[1])
-        obj = get_object_by_id(obj_id)
+        obj = await get_object_by_id_async(obj_id)
         
         if obj:
             obj_id, name, address, category, notes, lat, lon = obj
-            context.user_data['selected_object'] = obj
             
-            # Получаем список ГБР со статусами
-            crews = get_crew_status()
+            # Получаем список ГБР со статусами и их последние координаты
+            crews = await get_crew_status_async()
+            
+            # Свободные и ближайшие к объекту экипажи - первыми
+            ranked = await async_db.read(rank_crews_near, crews, lat, lon, CREW_KEYBOARD_SIZE)
             
             # Формируем кнопки для выбора ГБР
             keyboard = []
-            for crew in crews:
+            for crew, distance in ranked:
                 crew_id, crew_name, status, telegram_id = crew
                 
                 # Статус эмодзи
                 status_emoji = '🟢' if status == 'free' else '🔴' if status == 'busy' else '🏁'
                 
                 button_text = f"{status_emoji} {crew_name}"
+                if distance is not None:
+                    button_text += f" · {distance:.1f} км"
                 callback_data = f"send_{crew_id}_{obj_id}"
                 keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
             
+            # Массовый вызов ближайших свободных ГБР
+            if any(crew[2] == 'free' for crew, distance in ranked):
+                keyboard.insert(0, [InlineKeyboardButton(
+                    f"🚨 Всем ближайшим свободным (до {ALARM_FANOUT_SIZE})",
+                    callback_data=f"all_{obj_id}"
+                )])
+            
             reply_markup = InlineKeyboardMarkup(keyboard)
+            coordinates_note = "" if has_coordinates(lat, lon) else (
+                "⚠️ Координаты не определены - расстояние до ГБР неизвестно.\n\n")
             
             await query.edit_message_text(
                 f"Выбран объект:\n\n"
                 f"🏠 {name}\n"
                 f"📍 {address}\n"
                 f"📝 {notes}\n\n"
+                f"{coordinates_note}"
                 f"Кому отправить? (🟢 свободен, 🔴 занят, 🏁 на месте)",
                 reply_markup=reply_markup
             )
@@ -330,8 +523,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         crew_id = int(parts[1])
         obj_id = int(parts[2])
         
-        obj = get_object_by_id(obj_id)
-        crew_info = get_crew_status(crew_id)
+        obj = await get_object_by_id_async(obj_id)
+        crew_info = await get_crew_status_async(crew_id)
         
         if obj and crew_info:
             obj_id, name, address, category, notes, lat, lon = obj
@@ -345,52 +538,136 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 return
             
             # Формируем сообщение для ГБР
-            navi_url = f"yandexnavi://build_route_on_map?lat_to={lat}&lon_to={lon}"
-            maps_url = f"https://yandex.ru/maps/?rtext=~{lat},{lon}&rtab=auto"
+            message = build_alarm_message(obj)
             
-            message = (
-                f"🚨 Срабатывание: ТРЕВОГА\n"
-                f"🏠 {name}\n"
-                f"📍 {address}\n"
-                f"📝 {notes}\n\n"
-                f"🚗 <a href='{navi_url}'>Открыть в Навигаторе</a>\n"
-                f"🗺️ <a href='{maps_url}'>Открыть в Картах</a>"
+            # Отправляем ГБР через очередь: доставка с повторами, статус busy
+            # ставится в той же транзакции, что и отметка о доставке
+            # Вызов попадает в журнал вызовов вместе с сообщением в очереди
+            result = await alarm_outbox.send(
+                alarm_key(query, crew_telegram_id), crew_telegram_id, message, ALARM_OPTIONS,
+                crew_id=crew_id, wait=ALARM_ACK_WAIT, object_id=obj_id
             )
             
-            # Отправляем ГБР
-            try:
-                await context.bot.send_message(
-                    chat_id=crew_telegram_id,
-                    text=message,
-                    parse_mode='HTML',
-                    disable_web_page_preview=True
+            if result is None:
+                await query.edit_message_text(
+                    f"⏳ Вызов для {crew_name} поставлен в очередь и будет доставлен автоматически.\n\n{message}",
+                    parse_mode='HTML'
                 )
-                
-                # Обновляем статус ГБР на busy
-                update_crew_status(crew_id, 'busy')
-                
+            elif result.get('duplicate'):
+                state = 'уже отправлен' if result['ok'] else 'уже в очереди'
+                await query.edit_message_text(f"ℹ️ Этот вызов для {crew_name} {state}.")
+            elif result['ok']:
                 await query.edit_message_text(
                     f"✅ Вызов отправлен {crew_name}!\n\n{message}",
                     parse_mode='HTML'
                 )
-            except Exception as e:
-                logger.error(f"Ошибка отправки ГБР: {e}")
+            else:
                 await query.edit_message_text(
-                    f"❌ Не удалось отправить вызов. Ошибка: {str(e)}"
+                    f"❌ Не удалось отправить вызов. Ошибка: {result['error']}"
                 )
+    
+    elif data.startswith("all_"):
+        obj_id = int(data.split("_")[1])
+        obj = await get_object_by_id_async(obj_id)
+        
+        if obj:
+            await send_alarm_to_all(query, context, obj)
+    
+    elif data.startswith("page_"):
+        parts = data.split("_")
+        # Кнопки со старым форматом курсора (только id) считаем устаревшими
+        saved = None
+        if len(parts) == 6:
+            _, token, page, direction, rank, cursor = parts
+            saved = await async_db.read(load_search_query, int(token))
+        if saved is None:
+            await query.edit_message_text("Результаты поиска устарели. Повторите /find.")
+            return
+        
+        search_query, total = saved
+        backward = direction == 'p'
+        rows = await async_db.read(search_page, search_query, (float(rank), int(cursor)), backward)
+        if not rows:
+            await query.edit_message_text("Больше ничего не найдено. Повторите /find.")
+            return
+        
+        text, reply_markup = build_results_page(rows, total, int(page), int(token), backward)
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    
+    elif data == "show_all":
+        # Кнопка из сообщений, отправленных до постраничной выдачи
+        await query.edit_message_text("Результаты поиска устарели. Повторите /find.")
+
+
+async def send_alarm_to_all(query, context: ContextTypes.DEFAULT_TYPE, obj) -> None:
+    """Отправить тревогу ближайшим свободным ГБР и старшим смены одновременно"""
+    obj_id, name, address, category, notes, lat, lon = obj
+    
+    # Ближайшие свободные экипажи с Telegram ID
+    crews = await get_crew_status_async()
+    crews = [crew for crew in crews if crew[2] == 'free' and crew[3]]
+    ranked = await async_db.read(rank_crews_near, crews, lat, lon, ALARM_FANOUT_SIZE)
+    targets = [crew for crew, distance in ranked]
+    
+    if not targets:
+        await query.edit_message_text("❌ Нет свободных ГБР с указанным Telegram ID.")
+        return
+    
+    message = build_alarm_message(obj)
+    names = {crew[3]: crew[1] for crew in targets}
+    for supervisor_id in SUPERVISOR_IDS:
+        names.setdefault(supervisor_id, f"Старший смены {supervisor_id}")
+    
+    crew_ids = {crew[3]: crew[0] for crew in targets}
+    results = await asyncio.gather(*(
+        alarm_outbox.send(
+            alarm_key(query, chat_id), chat_id, message, ALARM_OPTIONS,
+            crew_id=crew_ids.get(chat_id), wait=ALARM_ACK_WAIT, object_id=obj_id
+        )
+        for chat_id in names
+    ))
+    
+    # Статусы получивших вызов ГБР и журнал вызовов ведёт очередь - одной транзакцией на пачку
+    delivered = [result for result in results if result and result['ok']]
+    
+    report = f"🚨 Вызов на {name} разослан ({len(delivered)} из {len(results)}):\n\n"
+    for chat_id, result in zip(names, results):
+        if result is None:
+            report += f"⏳ {names[chat_id]} - в очереди\n"
+        elif result.get('duplicate'):
+            report += f"ℹ️ {names[chat_id]} - {'уже отправлено' if result['ok'] else 'уже в очереди'}\n"
+        elif result['ok']:
+            report += f"✅ {names[chat_id]} - {result['latency'] * 1000:.0f} мс\n"
+        else:
+            report += f"❌ {names[chat_id]} - {result['error']}\n"
+    
+    logger.info(f"Вызов на объект {obj_id}: доставлено {len(delivered)} из {len(results)}")
+    await query.edit_message_text(report)
 
 
 async def handle_address(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик текстовых сообщений с адресом"""
     address = update.message.text
-    
-    # Отправляем сообщение о начале обработки
-    await update.message.reply_text("🔍 Ищу адрес в DaData...")
-    
+
     try:
-        # Получаем координаты через DaData API
-        coordinates = get_coordinates_from_dadata(address)
-        
+        # Сначала локальный справочник адресов: без сети, доли миллисекунды
+        coordinates = await async_db.read(gazetteer.index.lookup, address)
+        source = "в справочнике"
+        if not coordinates:
+            # Отправляем сообщение о начале обработки (если DaData не отключена)
+            if dadata_client.available():
+                await update.message.reply_text("🔍 Ищу адрес в DaData...")
+
+            # Получаем координаты через DaData API
+            coordinates, answered = await get_coordinates_from_dadata(address)
+            source = "в DaData" if answered else "в кэше (DaData не отвечает)"
+            if not answered and not coordinates:
+                await update.message.reply_text(
+                    "⚠️ DaData сейчас не отвечает, а в справочнике адреса нет.\n"
+                    "Попробуйте позже или найдите объект через /find."
+                )
+                return
+
         if coordinates and coordinates.get('lat'):
             lat, lon = coordinates['lat'], coordinates['lon']
             
@@ -402,7 +679,7 @@ async def handle_address(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             
             # Формируем ответ
             response_message = (
-                f"📍 Адрес найден в DaData!\n\n"
+                f"📍 Адрес найден {source}!\n\n"
                 f"🏠 {coordinates['address']}\n\n"
                 f"🚗 <a href='{navi_url}'>Открыть в Навигаторе</a>\n"
                 f"🗺️ <a href='{maps_url}'>Открыть в Картах</a>\n\n"
@@ -428,48 +705,92 @@ async def handle_address(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
 
 
-def get_coordinates_from_dadata(address):
-    """Получение координат адреса через DaData API"""
-    url = "https://suggestions.dadata.ru/suggestions/api/4_1/rs/suggest/address"
+async def get_coordinates_from_dadata(address):
+    """Координаты адреса через DaData API (с кэшем): (результат или None, ответила ли DaData).
+
+    Если DaData не ответила в срок или отключена автоматом защиты, отдаём
+    устаревшую запись кэша, если она есть.
+    """
+    # Память отвечает за микросекунды, в базу идём только при промахе
+    found, coordinates = geocode_cache.get_memory(address)
+    if not found:
+        found, coordinates = await async_db.read(geocode_cache.get, address)
+    if found:
+        return coordinates, True
+    
+    coordinates, answered = await dadata_client.lookup(address)
+    if coordinates:
+        await async_db.write(geocode_cache.put, address, coordinates)
+    elif not answered:
+        found, coordinates = await async_db.read(geocode_cache.get_stale, address)
+    return coordinates, answered
+
+
+async def on_startup(application: Application) -> None:
+    """Запуск фоновых задач: доставка тревог, табло статусов ГБР"""
+    await alarm_outbox.start(application.bot)
+    status_feed.feed.chat_ids = [str(DISPATCHER_ID)]
+    await status_feed.feed.start(application.bot)
+    await metrics.start_server(metrics.config_from_env())
+    profiler.install_signal_handler(application)
+    await fuzzy_search.engine.start()
+    await sessions.store.start()
+    await dispatch_log.log.start()
+    await gazetteer.index.start()
+    if geocode_worker.GEOCODE_WORKER and DADATA_API_KEY:
+        await background_geocoder.start()
+
+
+async def on_shutdown(application: Application) -> None:
+    """Освобождение ресурсов при остановке бота"""
+    await status_feed.feed.stop()
+    await background_geocoder.stop()
+    await fuzzy_search.engine.stop()
+    await gazetteer.index.stop()
+    await sessions.store.stop()
+    await alarm_outbox.stop()
+    await dispatch_log.log.stop()
+    await dadata_client.close()
+    await metrics.stop_server(metrics.config_from_env())
+    recorder.close(application)
+
+
+def build_application(token=None, request=None):
+    """Создать приложение диспетчерского бота со всеми обработчиками.
+
+    request - свой транспорт Bot API (например, fake_telegram для бенчмарков)
+    """
+    # Создаем приложение
+    builder = (
+        Application.builder()
+        .token(token or TELEGRAM_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
     
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-        "Authorization": f"Token {DADATA_API_KEY}"
-    }
+    # Добавляем обработчики
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("status", status_command))
+    application.add_handler(CommandHandler("busy", busy_command))
+    application.add_handler(CommandHandler("arrived", arrived_command))
+    application.add_handler(CommandHandler("free", free_command))
+    application.add_handler(CommandHandler("myid", myid_command))
+    application.add_handler(CommandHandler("find", find_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("report", report_command))
+    application.add_handler(CallbackQueryHandler(button_callback))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_address))
     
-    data = {
-        "query": address,
-        "count": 1
-    }
+    # Время каждого обработчика - в метрики
+    metrics.instrument_handlers(application, 'dispatcher')
     
-    try:
-        response = requests.post(url, headers=headers, json=data, timeout=10)
-        
-        if response.status_code != 200:
-            logger.error(f"DaData ошибка {response.status_code}: {response.text}")
-            return None
-        
-        result = response.json()
-        
-        if not result.get('suggestions'):
-            return None
-        
-        suggestion = result['suggestions'][0]
-        data = suggestion.get('data', {})
-        
-        if data.get('geo_lat') and data.get('geo_lon'):
-            return {
-                'lat': float(data['geo_lat']),
-                'lon': float(data['geo_lon']),
-                'address': suggestion['value']
-            }
-        else:
-            return None
-        
-    except Exception as e:
-        logger.error(f"Ошибка запроса к DaData: {e}")
-        return None
+    # Запись обновлений для нагрузочного прогона (если задан RECORD_UPDATES)
+    recorder.install(application, 'dispatcher', DISPATCHER_ID)
+    
+    return application
 
 
 def main():
@@ -482,23 +803,25 @@ def main():
         logger.error("DADATA_API_KEY не найден!")
         return
     
-    # Создаем приложение
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    try:
+        # Webhook, если задан WEBHOOK_PORT, иначе polling
+        webhook_config = webhook.config_from_env()
+    except ValueError as e:
+        logger.error(str(e))
+        return
     
-    # Добавляем обработчики
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("status", status_command))
-    application.add_handler(CommandHandler("busy", busy_command))
-    application.add_handler(CommandHandler("arrived", arrived_command))
-    application.add_handler(CommandHandler("free", free_command))
-    application.add_handler(CommandHandler("myid", myid_command))
-    application.add_handler(CommandHandler("find", find_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_address))
+    # Готовим базу данных (WAL, поисковый индекс)
+    db.init_db()
+    
+    application = build_application()
     
     # Запускаем бота
     logger.info("Запуск GBR Security Bot (полный MVP)...")
-    application.run_polling()
+    try:
+        webhook.run(application, webhook_config)
+    finally:
+        async_db.shutdown()
+        db.close_all()
 
 
 if __name__ == '__main__':
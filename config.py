@@ -0,0 +1,12 @@
+import os
+from dotenv import load_dotenv
+
+# Общие настройки обоих ботов. Переменные окружения загружаются из .env
+# здесь, до того как остальные модули прочитают свои настройки
+load_dotenv()
+
+# ID диспетчера
+DISPATCHER_ID = int(os.getenv('DISPATCHER_ID', '5986066094'))
+
+# Путь к базе данных (общая для диспетчерского бота и бота ГБР)
+DB_PATH = os.getenv('DB_PATH', 'objects.db')
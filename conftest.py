@@ -0,0 +1,25 @@
+"""Общие настройки pytest.
+
+test_dadata.py, test_search.py и simple_test.py - ручные скрипты проверки
+(настоящая DaData, рабочая objects.db), а не тесты pytest.
+"""
+import pytest
+
+import bench_data
+import db
+from crew_registry import registry
+
+collect_ignore = ['test_dadata.py', 'test_search.py', 'simple_test.py']
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Временная база с синтетическим справочником, подготовленная db.init_db"""
+    path = str(tmp_path / 'objects.db')
+    bench_data.generate_catalog(path, objects=50, crews=5, seed=1)
+    db.close_all()
+    monkeypatch.setattr(db, 'DB_PATH', path)
+    db.init_db()
+    registry.invalidate()
+    yield path
+    db.close_all()
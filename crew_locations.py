@@ -0,0 +1,218 @@
+import os
+import math
+import time
+import heapq
+import logging
+import threading
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Размер ячейки сетки, градусы (~1 км по широте)
+GRID_CELL = 0.01
+
+# Как часто сбрасывать накопленные координаты в базу, секунды
+LOCATION_FLUSH_INTERVAL = float(os.getenv('LOCATION_FLUSH_INTERVAL', '5'))
+
+# Как часто перечитывать координаты из базы в процессе, который их не получает сам
+LOCATION_REFRESH_INTERVAL = float(os.getenv('LOCATION_REFRESH_INTERVAL', '5'))
+
+# Координаты старше этого считаются неизвестными, секунды
+LOCATION_MAX_AGE = float(os.getenv('LOCATION_MAX_AGE', '900'))
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def ensure_location_columns(conn):
+    """Добавить в gbr_crews колонки с последними координатами экипажа"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(gbr_crews)')}
+    for name, column_type in (('lat', 'REAL'), ('lon', 'REAL'), ('location_at', 'REAL')):
+        if name not in columns:
+            conn.execute(f'ALTER TABLE gbr_crews ADD COLUMN {name} {column_type}')
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Расстояние между точками по формуле гаверсинусов, км"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+db.register_schema(ensure_location_columns)
+
+
+def _cell(lat, lon):
+    return int(math.floor(lat / GRID_CELL)), int(math.floor(lon / GRID_CELL))
+
+
+class CrewLocations:
+    """Последние координаты экипажей в сеточном индексе.
+
+    Обновления пишутся в память сразу, в базу - пачкой раз в
+    LOCATION_FLUSH_INTERVAL секунд (flush).
+    """
+
+    def __init__(self):
+        # crew_id -> (lat, lon, время)
+        self._positions = {}
+        # ячейка сетки -> множество crew_id
+        self._grid = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._refreshed_at = 0.0
+        self.updates = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._positions)
+
+    def update(self, crew_id, lat, lon, at=None):
+        """Запомнить новое положение экипажа"""
+        at = at or time.time()
+        with self._lock:
+            self._place(crew_id, lat, lon, at)
+            self._dirty.add(crew_id)
+            self.updates += 1
+
+    def _place(self, crew_id, lat, lon, at):
+        old = self._positions.get(crew_id)
+        if old is not None:
+            old_cell = _cell(old[0], old[1])
+            if old_cell != _cell(lat, lon):
+                members = self._grid.get(old_cell)
+                if members is not None:
+                    members.discard(crew_id)
+                    if not members:
+                        del self._grid[old_cell]
+        self._positions[crew_id] = (lat, lon, at)
+        self._grid.setdefault(_cell(lat, lon), set()).add(crew_id)
+
+    def get(self, crew_id):
+        """Последнее известное положение экипажа или None"""
+        position = self._positions.get(crew_id)
+        if position is None or time.time() - position[2] > LOCATION_MAX_AGE:
+            return None
+        return position
+
+    def iter_nearest(self, lat, lon):
+        """Экипажи по возрастанию расстояния: (км, crew_id).
+
+        Обходит только занятые ячейки сетки в порядке нижней границы
+        расстояния до них, поэтому дальние экипажи не проверяются, пока
+        не понадобятся, а пустые просторы между точкой и экипажами не
+        стоят ничего.
+        """
+        with self._lock:
+            grid = {cell: set(members) for cell, members in self._grid.items()}
+            positions = dict(self._positions)
+        if not positions:
+            return
+
+        now = time.time()
+        cells = [(_cell_min_distance(lat, lon, cell), cell) for cell in grid]
+        heapq.heapify(cells)
+
+        pending = []
+        while cells:
+            bound, cell = heapq.heappop(cells)
+            # Все экипажи ближе границы следующей ячейки уже найдены
+            while pending and pending[0][0] <= bound:
+                yield heapq.heappop(pending)
+            for crew_id in grid[cell]:
+                crew_lat, crew_lon, at = positions[crew_id]
+                if now - at > LOCATION_MAX_AGE:
+                    continue
+                heapq.heappush(pending, (distance_km(lat, lon, crew_lat, crew_lon), crew_id))
+        while pending:
+            yield heapq.heappop(pending)
+
+    def flush(self):
+        """Записать накопленные координаты в базу одной транзакцией"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            rows = [
+                (self._positions[crew_id][0], self._positions[crew_id][1],
+                 self._positions[crew_id][2], crew_id)
+                for crew_id in self._dirty
+            ]
+            self._dirty.clear()
+
+        with db.write_transaction() as conn:
+            conn.executemany('UPDATE gbr_crews SET lat = ?, lon = ?, location_at = ? WHERE id = ?', rows)
+        self.flushes += 1
+        return len(rows)
+
+    def refresh_from_db(self, force=False):
+        """Перечитать координаты из базы (не чаще LOCATION_REFRESH_INTERVAL)"""
+        now = time.time()
+        if not force and now - self._refreshed_at < LOCATION_REFRESH_INTERVAL:
+            return
+        rows = db.fetch_all(
+            'SELECT id, lat, lon, location_at FROM gbr_crews '
+            'WHERE lat IS NOT NULL AND location_at > ?',
+            # Запас на отложенную запись: координаты попадают в базу с задержкой до flush
+            (self._refreshed_at - 2 * LOCATION_FLUSH_INTERVAL,)
+        )
+        with self._lock:
+            for crew_id, lat, lon, at in rows:
+                known = self._positions.get(crew_id)
+                # Свежие данные в памяти не затираем более старыми из базы
+                if known is None or known[2] < at:
+                    self._place(crew_id, lat, lon, at)
+        self._refreshed_at = now
+
+
+# Общие координаты экипажей процесса (в совместном запуске - для обоих ботов)
+positions = CrewLocations()
+
+
+def _cell_min_distance(lat, lon, cell):
+    """Нижняя граница расстояния от точки до любой точки ячейки, км.
+
+    Расстояние до центра ячейки минус наибольшее расстояние от центра
+    до её углов (неравенство треугольника).
+    """
+    cell_lat, cell_lon = cell[0] * GRID_CELL, cell[1] * GRID_CELL
+    center_lat, center_lon = cell_lat + GRID_CELL / 2, cell_lon + GRID_CELL / 2
+    radius = max(
+        distance_km(center_lat, center_lon, corner_lat, corner_lon)
+        for corner_lat in (cell_lat, cell_lat + GRID_CELL)
+        for corner_lon in (cell_lon, cell_lon + GRID_CELL)
+    )
+    return max(0.0, distance_km(lat, lon, center_lat, center_lon) - radius)
+
+
+def rank_crews(crews, locations, lat, lon, limit=None):
+    """Упорядочить экипажи для вызова на объект: свободные первыми, ближние выше.
+
+    crews - строки (id, name, status, telegram_id). Возвращает список
+    (строка экипажа, расстояние в км или None).
+    """
+    by_id = {crew[0]: crew for crew in crews}
+    if lat is None or lon is None:
+        # Расстояний нет: свободные первыми, внутри групп - исходный порядок
+        ranked = sorted(crews, key=lambda crew: crew[2] != 'free')
+        return [(crew, None) for crew in ranked][:limit]
+
+    free, others = [], []
+    for distance, crew_id in locations.iter_nearest(lat, lon):
+        crew = by_id.pop(crew_id, None)
+        if crew is None:
+            continue
+        if crew[2] == 'free':
+            free.append((crew, distance))
+            if limit is not None and len(free) >= limit:
+                break
+        else:
+            others.append((crew, distance))
+
+    if limit is not None and len(free) >= limit:
+        return free
+
+    # Экипажи без координат - в конце, свободные раньше
+    rest = sorted(by_id.values(), key=lambda crew: (crew[2] != 'free', crew[0]))
+    ranked = free + others + [(crew, None) for crew in rest]
+    return ranked[:limit]
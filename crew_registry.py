@@ -0,0 +1,124 @@
+import logging
+import threading
+
+import db
+
+logger = logging.getLogger(__name__)
+
+CREW_COLUMNS = 'id, name, status, telegram_id'
+
+
+# Версия таблицы gbr_crews: её увеличивают триггеры при изменении экипажей
+# (добавление, удаление, смена имени, статуса или Telegram ID) из любого
+# процесса. Координаты экипажей версию не меняют - реестр их не хранит
+CREW_REGISTRY_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS gbr_crews_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''',
+    'INSERT OR IGNORE INTO gbr_crews_version (id, version) VALUES (1, 0)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS gbr_crews_version_ai
+    AFTER INSERT ON gbr_crews
+    BEGIN
+        UPDATE gbr_crews_version SET version = version + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS gbr_crews_version_ad
+    AFTER DELETE ON gbr_crews
+    BEGIN
+        UPDATE gbr_crews_version SET version = version + 1 WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS gbr_crews_version_au
+    AFTER UPDATE OF name, status, telegram_id ON gbr_crews
+    WHEN old.name IS NOT new.name OR old.status IS NOT new.status
+        OR old.telegram_id IS NOT new.telegram_id
+    BEGIN
+        UPDATE gbr_crews_version SET version = version + 1 WHERE id = 1;
+    END
+    ''',
+)
+
+
+def ensure_crew_registry_schema(conn):
+    """Создать счётчик версии gbr_crews и его триггеры"""
+    for statement in CREW_REGISTRY_SCHEMA:
+        conn.execute(statement)
+
+
+db.register_schema(ensure_crew_registry_schema)
+
+
+class CrewRegistry:
+    """Экипажи ГБР в памяти с поиском по telegram_id за O(1).
+
+    Перед каждым поиском читается версия gbr_crews (таблица
+    gbr_crews_version, её ведут триггеры). Таблица экипажей перечитывается,
+    только когда версия изменилась - записи в другие таблицы и координаты
+    экипажей её не меняют.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._by_telegram_id = {}
+        self._by_id = {}
+        self.reloads = 0
+
+    def _refresh(self):
+        conn = db.get_reader()
+        version = conn.execute('SELECT version FROM gbr_crews_version WHERE id = 1').fetchone()[0]
+        if version == self._version:
+            return
+
+        rows = conn.execute(f'SELECT {CREW_COLUMNS} FROM gbr_crews ORDER BY id').fetchall()
+        self._by_id = {row[0]: row for row in rows}
+        self._by_telegram_id = {row[3]: row for row in rows if row[3]}
+        self._version = version
+        self.reloads += 1
+
+    def apply(self, crew_id, status=None, telegram_id=None):
+        """Сразу учесть изменение, сделанное этим процессом"""
+        with self._lock:
+            crew = self._by_id.get(crew_id)
+            if crew is None:
+                return
+            crew_id, name, old_status, old_telegram_id = crew
+            crew = (crew_id, name, status or old_status, str(telegram_id) if telegram_id else old_telegram_id)
+            self._by_id[crew_id] = crew
+            if old_telegram_id and old_telegram_id != crew[3]:
+                self._by_telegram_id.pop(old_telegram_id, None)
+            if crew[3]:
+                self._by_telegram_id[crew[3]] = crew
+
+    def invalidate(self):
+        """Перечитать экипажи при следующем поиске"""
+        with self._lock:
+            self._version = None
+
+    def get_by_telegram_id(self, telegram_id):
+        """Экипаж (id, name, status, telegram_id) по Telegram ID или None"""
+        with self._lock:
+            self._refresh()
+            return self._by_telegram_id.get(str(telegram_id))
+
+    def get(self, crew_id):
+        """Экипаж по id или None"""
+        with self._lock:
+            self._refresh()
+            return self._by_id.get(crew_id)
+
+    def all(self):
+        """Все экипажи по порядку id"""
+        with self._lock:
+            self._refresh()
+            return list(self._by_id.values())
+
+
+# Общий реестр процесса
+registry = CrewRegistry()
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import async_db
+import db
+import dispatch_log
+import status_feed
+from crew_registry import registry
+
+# Общие функции работы с экипажами ГБР для обоих ботов.
+# Экипажи читаются из реестра в памяти; при записи реестр обновляется сразу,
+# поэтому в одном процессе смена статуса видна без повторного чтения базы
+
+
+def get_crew_status(crew_id=None):
+    """Получить статус экипажа(ей): (id, name, status, telegram_id)"""
+    if crew_id:
+        return registry.get(crew_id)
+    return registry.all()
+
+
+def get_crew_by_telegram_id(telegram_id):
+    """Найти ГБР по Telegram ID"""
+    return registry.get_by_telegram_id(telegram_id)
+
+
+def update_crew_status(crew_id, status, telegram_id=None):
+    """Обновить статус экипажа"""
+    if telegram_id:
+        db.execute('''
+            UPDATE gbr_crews 
+            SET status = ?, last_active = ?, telegram_id = ?
+            WHERE id = ?
+        ''', (status, datetime.now(), telegram_id, crew_id))
+    else:
+        db.execute('''
+            UPDATE gbr_crews 
+            SET status = ?, last_active = ?
+            WHERE id = ?
+        ''', (status, datetime.now(), crew_id))
+    registry.apply(crew_id, status=status, telegram_id=telegram_id)
+
+
+async def get_crew_status_async(crew_id=None):
+    """Получить статус экипажа(ей), не блокируя бота"""
+    return await async_db.read(get_crew_status, crew_id)
+
+
+async def get_crew_by_telegram_id_async(telegram_id):
+    """Найти ГБР по Telegram ID, не блокируя бота"""
+    return await async_db.read(get_crew_by_telegram_id, telegram_id)
+
+
+async def update_crew_status_async(crew_id, status, telegram_id=None):
+    """Обновить статус экипажа, не блокируя бота"""
+    await async_db.write(update_crew_status, crew_id, status, telegram_id)
+    if telegram_id is None:
+        # Статус сменил сам экипаж (не регистрация) - событие журнала вызовов
+        dispatch_log.record(status, crew_id)
+    # Табло диспетчера в этом процессе обновится без ожидания опроса журнала
+    status_feed.notify()
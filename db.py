@@ -0,0 +1,160 @@
+import os
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+import metrics
+import search_index
+
+logger = logging.getLogger(__name__)
+
+# Путь к базе данных (общая для диспетчерского бота и бота ГБР)
+DB_PATH = config.DB_PATH
+
+# Сколько подготовленных запросов держит в кэше каждое соединение
+STATEMENT_CACHE_SIZE = 256
+
+# Настройки соединений. journal_mode=WAL хранится в самом файле базы,
+# остальные параметры действуют на время жизни соединения
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('cache_size', -20000),       # ~20 МБ страничного кэша
+    ('mmap_size', 268435456),     # 256 МБ memory-mapped I/O
+    ('temp_store', 'MEMORY'),
+    ('foreign_keys', 'ON'),
+)
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+_writer = None
+_write_lock = threading.RLock()
+_initialized = False
+# Увеличивается в close_all, чтобы потоки не взяли закрытое соединение
+_generation = 0
+# Функции, дополняющие схему базы при старте (получают соединение для записи)
+_schema_hooks = []
+
+
+def _connect(readonly=False):
+    """Открыть соединение с настроенными параметрами"""
+    # isolation_level=None - транзакции открываем сами, читатели не держат
+    # открытых транзакций между запросами
+    conn = sqlite3.connect(
+        DB_PATH,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    if readonly:
+        conn.execute('PRAGMA query_only = ON')
+
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+
+def register_schema(hook):
+    """Зарегистрировать функцию, которая дополняет схему базы в init_db"""
+    if hook in _schema_hooks:
+        return
+    _schema_hooks.append(hook)
+    # База уже подготовлена - применяем сразу
+    if _initialized:
+        with write_transaction() as conn:
+            hook(conn)
+
+
+def init_db():
+    """Подготовить базу: WAL, поисковый индекс, схемы модулей. Вызывается один раз при старте"""
+    global _initialized
+    with _write_lock:
+        if _initialized:
+            return
+        conn = get_writer()
+        search_index.ensure_search_index(conn)
+        with write_transaction() as conn:
+            for hook in _schema_hooks:
+                hook(conn)
+        _initialized = True
+        logger.info(f"База данных {os.path.abspath(DB_PATH)} готова (WAL)")
+
+
+def get_reader():
+    """Долгоживущее соединение для чтения, своё у каждого потока"""
+    if getattr(_local, 'generation', None) != _generation:
+        _local.reader = _connect(readonly=True)
+        _local.generation = _generation
+    return _local.reader
+
+
+def open_reader():
+    """Отдельное соединение для чтения, которым владеет вызывающий"""
+    return _connect(readonly=True)
+
+
+def get_writer():
+    """Единственное соединение для записи (использовать под _write_lock)"""
+    global _writer
+    if _writer is None:
+        _writer = _connect()
+    return _writer
+
+
+@contextmanager
+def write_transaction():
+    """Транзакция записи. Читатели в режиме WAL её не ждут"""
+    with _write_lock:
+        started = time.perf_counter()
+        conn = get_writer()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            metrics.SQL_SECONDS.observe(time.perf_counter() - started, 'transaction')
+
+
+def fetch_one(sql, params=()):
+    """Выполнить запрос на чтение и вернуть одну строку"""
+    with metrics.SQL_SECONDS.time('fetch_one'):
+        return get_reader().execute(sql, params).fetchone()
+
+
+def fetch_all(sql, params=()):
+    """Выполнить запрос на чтение и вернуть все строки"""
+    with metrics.SQL_SECONDS.time('fetch_all'):
+        return get_reader().execute(sql, params).fetchall()
+
+
+def execute(sql, params=()):
+    """Выполнить один запрос на запись в отдельной транзакции"""
+    with write_transaction() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+def close_all():
+    """Закрыть все открытые соединения (при остановке бота)"""
+    global _writer, _initialized, _generation
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _connections.clear()
+    _writer = None
+    _initialized = False
+    _generation += 1
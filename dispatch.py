@@ -0,0 +1,68 @@
+import os
+import time
+import logging
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from rate_limit import TelegramRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Дольше этого не ждать лимита чата внутри отправки, секунды: после ответа 429
+# сообщение возвращается вызывающему с retry_after, а не держит остальных
+MAX_INLINE_WAIT = float(os.getenv('MAX_INLINE_WAIT', '1'))
+
+# Общий ограничитель отправки для бота диспетчера
+limiter = TelegramRateLimiter()
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def send_message(bot, chat_id, text, limiter=limiter, **kwargs):
+    """Отправить сообщение с учётом лимитов Telegram (одна попытка).
+
+    Возвращает результат доставки: chat_id, ok, latency (с начала вызова
+    до ответа Telegram, секунды), waited (ожидание лимитов), attempts, error,
+    permanent (повтор не поможет: чат не найден, бот заблокирован),
+    retry_after (Telegram просит подождать: через сколько секунд повторить).
+    Ответ 429 не пережидается здесь - повтор планирует вызывающий.
+    """
+    started = time.perf_counter()
+    result = {'chat_id': chat_id, 'ok': False, 'latency': None, 'waited': 0.0,
+              'attempts': 0, 'error': None, 'permanent': False, 'retry_after': None}
+
+    blocked = limiter.chat_wait(chat_id)
+    if blocked > MAX_INLINE_WAIT:
+        # Чат ещё под ответом 429 - не занимаем отправку ожиданием
+        result['error'] = f"Telegram просит подождать {blocked:.0f} с"
+        result['retry_after'] = blocked
+        result['latency'] = time.perf_counter() - started
+        return result
+
+    result['attempts'] = 1
+    result['waited'] += await limiter.acquire(chat_id)
+    try:
+        await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+    except RetryAfter as e:
+        seconds = _retry_after_seconds(e)
+        logger.warning(f"Telegram просит подождать {seconds} с перед отправкой в {chat_id}")
+        limiter.retry_after(chat_id, seconds)
+        result['error'] = str(e)
+        result['retry_after'] = seconds
+    except (BadRequest, Forbidden) as e:
+        result['error'] = str(e)
+        result['permanent'] = True
+    except TelegramError as e:
+        result['error'] = str(e)
+    else:
+        result['ok'] = True
+
+    result['latency'] = time.perf_counter() - started
+    if not result['ok'] and result['retry_after'] is None:
+        logger.error(f"Ошибка отправки в {chat_id}: {result['error']}")
+    return result
@@ -0,0 +1,441 @@
+"""Журнал вызовов ГБР и статистика времени реагирования.
+
+Каждое событие - вызов (dispatch), "выехал" (busy), "на месте" (arrived),
+"свободен" (free) - дописывается в таблицу dispatch_events и никогда не
+меняется. Статусы от экипажей копятся в памяти и пишутся пачкой раз в
+DISPATCH_LOG_FLUSH_INTERVAL секунд, поэтому нажатие кнопки не ждёт диска.
+Вызовы и статус busy при доставке тревоги пишет очередь тревог (outbox)
+в своих транзакциях (apply_event).
+
+В той же транзакции обновляются готовые итоги - число, сумма, минимум,
+максимум и гистограмма времени от вызова до каждого статуса - по всем
+вызовам, по экипажу и по смене (response_stats, response_histogram), а
+также свёртки по времени для отчётов: вызовы по часам (dispatch_hourly),
+вызовы по объектам и гистограммы времени реагирования экипажей за день и
+за месяц (object_daily/monthly, response_daily/monthly; crew_id = 0 - все
+экипажи вместе). Отчётам не нужно перечитывать журнал.
+"""
+import os
+import time
+import bisect
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import async_db
+import db
+
+logger = logging.getLogger(__name__)
+
+# Как часто писать накопленные события и сколько событий пишется сразу, не дожидаясь
+DISPATCH_LOG_FLUSH_INTERVAL = float(os.getenv('DISPATCH_LOG_FLUSH_INTERVAL', '1'))
+DISPATCH_LOG_BATCH_SIZE = 500
+
+# Смены: начало первой смены (час) и длительность смены, часы
+SHIFT_START_HOUR = int(os.getenv('SHIFT_START_HOUR', '8'))
+SHIFT_HOURS = int(os.getenv('SHIFT_HOURS', '12'))
+
+EVENT_KINDS = ('dispatch', 'busy', 'arrived', 'free')
+
+# Что измеряется от момента вызова: принял (busy), прибыл (arrived), освободился (free)
+METRIC_BY_KIND = {'busy': 'accept', 'arrived': 'arrival', 'free': 'handling'}
+
+# Границы корзин гистограммы, секунды
+RESPONSE_BUCKETS = (30, 60, 120, 180, 300, 420, 600, 900, 1200, 1800, 2700, 3600, 7200)
+
+DISPATCH_LOG_SCHEMA = (
+    # dispatch_id - вызов, к которому относится статус (у самих вызовов пусто)
+    '''
+    CREATE TABLE IF NOT EXISTS dispatch_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL NOT NULL,
+        kind TEXT NOT NULL,
+        crew_id INTEGER NOT NULL,
+        object_id INTEGER,
+        dispatch_id INTEGER
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_dispatch_events_crew ON dispatch_events(crew_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_dispatch_events_object ON dispatch_events(object_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_dispatch_events_created ON dispatch_events(created_at)',
+    # Незакрытый вызов каждого экипажа: к нему относятся следующие статусы
+    '''
+    CREATE TABLE IF NOT EXISTS dispatch_open (
+        crew_id INTEGER PRIMARY KEY,
+        dispatch_id INTEGER NOT NULL,
+        object_id INTEGER,
+        dispatched_at REAL NOT NULL,
+        busy_at REAL,
+        arrived_at REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS response_stats (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        total REAL NOT NULL,
+        min REAL NOT NULL,
+        max REAL NOT NULL,
+        PRIMARY KEY (scope, key, metric)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS response_histogram (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (scope, key, metric, bucket)
+    )
+    ''',
+    # Свёртки для отчётов; hour - номер часа от эпохи, period - местная дата
+    # вызова ('2026-10-18') в *_daily или месяц ('2026-10') в *_monthly
+    '''
+    CREATE TABLE IF NOT EXISTS dispatch_hourly (
+        hour INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS object_daily (
+        period TEXT NOT NULL,
+        object_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (period, object_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS response_daily (
+        period TEXT NOT NULL,
+        crew_id INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY (period, crew_id, metric, bucket)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS object_monthly (
+        period TEXT NOT NULL,
+        object_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (period, object_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS response_monthly (
+        period TEXT NOT NULL,
+        crew_id INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        total REAL NOT NULL,
+        PRIMARY KEY (period, crew_id, metric, bucket)
+    ) WITHOUT ROWID
+    ''',
+)
+
+
+def ensure_dispatch_log_tables(conn):
+    """Журнал событий, открытые вызовы и таблицы итогов"""
+    for statement in DISPATCH_LOG_SCHEMA:
+        conn.execute(statement)
+    # Журнал, записанный до появления свёрток, сворачиваем один раз
+    if (conn.execute('SELECT 1 FROM dispatch_events LIMIT 1').fetchone()
+            and not conn.execute('SELECT 1 FROM dispatch_hourly LIMIT 1').fetchone()):
+        rebuild_rollups(conn)
+
+
+def shift_key(timestamp):
+    """Смена, в которую попадает момент: '2026-10-18#1' (первая смена дня)"""
+    moment = datetime.fromtimestamp(timestamp) - timedelta(hours=SHIFT_START_HOUR)
+    return f"{moment.date().isoformat()}#{moment.hour // SHIFT_HOURS + 1}"
+
+
+def day_key(timestamp):
+    """Местная дата момента: '2026-10-18'"""
+    return datetime.fromtimestamp(timestamp).date().isoformat()
+
+
+def bucket_index(seconds):
+    """Номер корзины гистограммы (последняя - больше всех границ)"""
+    return bisect.bisect_left(RESPONSE_BUCKETS, seconds)
+
+
+def _observe(conn, metric, crew_id, dispatched_at, seconds):
+    """Добавить замер в итоги: все вызовы, экипаж, смена"""
+    bucket = bucket_index(seconds)
+    for scope, key in (('all', ''), ('crew', str(crew_id)), ('shift', shift_key(dispatched_at))):
+        conn.execute('''
+            INSERT INTO response_stats (scope, key, metric, count, total, min, max)
+            VALUES (?, ?, ?, 1, ?, ?, ?)
+            ON CONFLICT(scope, key, metric) DO UPDATE SET
+                count = count + 1, total = total + excluded.total,
+                min = min(min, excluded.min), max = max(max, excluded.max)
+        ''', (scope, key, metric, seconds, seconds, seconds))
+        conn.execute('''
+            INSERT INTO response_histogram (scope, key, metric, bucket, count) VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT(scope, key, metric, bucket) DO UPDATE SET count = count + 1
+        ''', (scope, key, metric, bucket))
+    _add_response(conn, crew_id, metric, dispatched_at, seconds)
+
+
+def _add_response(conn, crew_id, metric, dispatched_at, seconds):
+    """Добавить замер в гистограммы экипажа и всех экипажей за день и за месяц"""
+    day = day_key(dispatched_at)
+    bucket = bucket_index(seconds)
+    for table, period in (('response_daily', day), ('response_monthly', day[:7])):
+        conn.executemany(f'''
+            INSERT INTO {table} (period, crew_id, metric, bucket, count, total) VALUES (?, ?, ?, ?, 1, ?)
+            ON CONFLICT(period, crew_id, metric, bucket) DO UPDATE SET
+                count = count + 1, total = total + excluded.total
+        ''', ((period, crew, metric, bucket, seconds) for crew in (crew_id, 0)))
+
+
+def _count_dispatch(conn, created_at, object_id):
+    """Добавить вызов в свёртки по часам и по объектам"""
+    conn.execute('''
+        INSERT INTO dispatch_hourly (hour, count) VALUES (?, 1)
+        ON CONFLICT(hour) DO UPDATE SET count = count + 1
+    ''', (int(created_at // 3600),))
+    if object_id is None:
+        return
+    day = day_key(created_at)
+    for table, period in (('object_daily', day), ('object_monthly', day[:7])):
+        conn.execute(f'''
+            INSERT INTO {table} (period, object_id, count) VALUES (?, ?, 1)
+            ON CONFLICT(period, object_id) DO UPDATE SET count = count + 1
+        ''', (period, object_id))
+
+
+def apply_event(conn, created_at, kind, crew_id, object_id=None):
+    """Записать одно событие и обновить итоги в открытой транзакции conn.
+
+    Вызов (dispatch) пишет очередь тревог в той же транзакции, что и само
+    сообщение, а автоматический статус busy - вместе с отметкой о доставке,
+    поэтому вызов всегда оказывается в базе раньше статусов экипажа,
+    из какого бы процесса они ни пришли. Вернуть False, если статус
+    не относится ни к одному открытому вызову.
+    """
+    if kind == 'dispatch':
+        dispatch_id = conn.execute(
+            'INSERT INTO dispatch_events (created_at, kind, crew_id, object_id) VALUES (?, ?, ?, ?)',
+            (created_at, kind, crew_id, object_id)
+        ).lastrowid
+        conn.execute('''
+            INSERT OR REPLACE INTO dispatch_open (crew_id, dispatch_id, object_id, dispatched_at)
+            VALUES (?, ?, ?, ?)
+        ''', (crew_id, dispatch_id, object_id, created_at))
+        _count_dispatch(conn, created_at, object_id)
+        return True
+
+    opened = conn.execute(
+        'SELECT dispatch_id, object_id, dispatched_at, busy_at, arrived_at FROM dispatch_open WHERE crew_id = ?',
+        (crew_id,)
+    ).fetchone()
+    # Статус, нажатый до вызова (пачка пришла позже), к вызову не относится
+    if opened is not None and created_at < opened[2]:
+        opened = None
+    dispatch_id, object_id = (opened[0], opened[1]) if opened else (None, None)
+    conn.execute('''
+        INSERT INTO dispatch_events (created_at, kind, crew_id, object_id, dispatch_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (created_at, kind, crew_id, object_id, dispatch_id))
+    if opened is None:
+        return False
+
+    dispatched_at, busy_at, arrived_at = opened[2], opened[3], opened[4]
+    if kind == 'busy' and busy_at is None:
+        conn.execute('UPDATE dispatch_open SET busy_at = ? WHERE crew_id = ?', (created_at, crew_id))
+    elif kind == 'arrived' and arrived_at is None:
+        conn.execute('UPDATE dispatch_open SET arrived_at = ? WHERE crew_id = ?', (created_at, crew_id))
+    elif kind == 'free':
+        conn.execute('DELETE FROM dispatch_open WHERE crew_id = ?', (crew_id,))
+    else:
+        # Повторный статус того же вызова: в итоги идёт только первый
+        return True
+    seconds = max(0.0, created_at - dispatched_at)
+    _observe(conn, METRIC_BY_KIND[kind], crew_id, dispatched_at, seconds)
+    return True
+
+
+def write_events(events):
+    """Записать пачку событий (время, вид, экипаж, объект) и обновить итоги"""
+    unmatched = 0
+    with db.write_transaction() as conn:
+        for created_at, kind, crew_id, object_id in sorted(events, key=lambda event: event[0]):
+            if not apply_event(conn, created_at, kind, crew_id, object_id) and kind != 'free':
+                unmatched += 1
+    if unmatched:
+        # Обычно это смена статуса без вызова; в итоги времени реагирования не входит
+        logger.info(f"Журнал вызовов: статусов без открытого вызова: {unmatched}")
+    return len(events)
+
+
+def rebuild_rollups(conn):
+    """Пересчитать свёртки для отчётов по всему журналу.
+
+    Время реагирования - от вызова до первого статуса каждого вида,
+    как при записи пачками.
+    """
+    for table in ('dispatch_hourly', 'object_daily', 'object_monthly', 'response_daily', 'response_monthly'):
+        conn.execute(f'DELETE FROM {table}')
+    dispatches = conn.execute(
+        "SELECT created_at, object_id FROM dispatch_events WHERE kind = 'dispatch'").fetchall()
+    for created_at, object_id in dispatches:
+        _count_dispatch(conn, created_at, object_id)
+    statuses = conn.execute('''
+        SELECT d.created_at, s.crew_id, s.kind, s.created_at - d.created_at
+        FROM (
+            SELECT dispatch_id, crew_id, kind, created_at,
+                   row_number() OVER (PARTITION BY dispatch_id, kind ORDER BY created_at) AS n
+            FROM dispatch_events
+            WHERE dispatch_id IS NOT NULL
+        ) s
+        JOIN dispatch_events d ON d.id = s.dispatch_id
+        WHERE s.n = 1
+    ''').fetchall()
+    for dispatched_at, crew_id, kind, seconds in statuses:
+        _add_response(conn, crew_id, METRIC_BY_KIND[kind], dispatched_at, max(0.0, seconds))
+    logger.info(f"Журнал вызовов: свёрнуто {len(dispatches)} вызовов, {len(statuses)} статусов")
+    return len(dispatches)
+
+
+# Регистрируем после rebuild_rollups: если база уже открыта, схема применяется сразу
+db.register_schema(ensure_dispatch_log_tables)
+
+
+def histogram_percentile(counts, q):
+    """Оценка перцентиля q (0..1) по корзинам: верхняя граница корзины"""
+    total = sum(counts.values())
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bucket in sorted(counts):
+        seen += counts[bucket]
+        if seen >= rank:
+            return RESPONSE_BUCKETS[bucket] if bucket < len(RESPONSE_BUCKETS) else float('inf')
+    return float('inf')
+
+
+def response_stats(scope='all', key=''):
+    """Итоги по области: {метрика: {count, avg, min, max, p50, p90}}"""
+    result = {}
+    for metric, count, total, low, high in db.fetch_all(
+            'SELECT metric, count, total, min, max FROM response_stats WHERE scope = ? AND key = ?',
+            (scope, key)):
+        result[metric] = {'count': count, 'avg': total / count, 'min': low, 'max': high}
+    histograms = {}
+    for metric, bucket, count in db.fetch_all(
+            'SELECT metric, bucket, count FROM response_histogram WHERE scope = ? AND key = ?',
+            (scope, key)):
+        histograms.setdefault(metric, {})[bucket] = count
+    for metric, counts in histograms.items():
+        if metric in result:
+            result[metric]['p50'] = histogram_percentile(counts, 0.5)
+            result[metric]['p90'] = histogram_percentile(counts, 0.9)
+    return result
+
+
+class DispatchLog:
+    """Буфер событий в памяти и фоновая запись пачками"""
+
+    def __init__(self, flush_interval=DISPATCH_LOG_FLUSH_INTERVAL, batch_size=DISPATCH_LOG_BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._task = None
+        self._wakeup = None
+        # Статистика
+        self.recorded = 0
+        self.written = 0
+        self.flushes = 0
+        self.flush_time = 0.0
+
+    def record(self, kind, crew_id, object_id=None, at=None):
+        """Запомнить событие; в базу оно попадёт со следующей пачкой"""
+        if kind not in EVENT_KINDS or crew_id is None:
+            return
+        with self._lock:
+            self._buffer.append((at or time.time(), kind, crew_id, object_id))
+            full = len(self._buffer) >= self.batch_size
+        self.recorded += 1
+        if full and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Записать накопленное одной транзакцией, вернуть число событий"""
+        with self._lock:
+            events, self._buffer = self._buffer, []
+        if not events:
+            return 0
+        started = time.perf_counter()
+        try:
+            await async_db.write(write_events, events)
+        except Exception:
+            with self._lock:
+                self._buffer[:0] = events
+            raise
+        self.flush_time += time.perf_counter() - started
+        self.flushes += 1
+        self.written += len(events)
+        return len(events)
+
+    async def start(self):
+        """Писать события в фоне (при старте бота).
+
+        Журнал общий для обоих ботов: при совместном запуске его запускают
+        оба, второй вызов ничего не делает.
+        """
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую запись и записать остаток"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Журнал вызовов: ошибка записи: {e}")
+
+    def stats(self):
+        return {
+            'recorded': self.recorded,
+            'written': self.written,
+            'buffered': len(self._buffer),
+            'flushes': self.flushes,
+            'flush_avg_ms': (self.flush_time / self.flushes * 1000) if self.flushes else 0.0,
+        }
+
+
+log = DispatchLog()
+
+
+def record(kind, crew_id, object_id=None, at=None):
+    log.record(kind, crew_id, object_id, at)
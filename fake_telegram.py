@@ -0,0 +1,134 @@
+"""Имитация Bot API Telegram для бенчмарков и проверки ботов без сети.
+
+Подключается как транспорт python-telegram-bot, поэтому обработчики,
+сериализация запросов и разбор ответов работают как с настоящим API:
+
+    application = bot.build_application(token=FAKE_TOKEN, request=FakeTelegramRequest())
+
+Для нагрузочного прогона (loadtest.py) имитация умеет отвечать с разбросом
+задержки и, как Telegram, ответом 429 с retry_after при превышении лимитов
+отправки.
+"""
+import json
+import math
+import time
+import random
+import asyncio
+import itertools
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+from rate_limit import TokenBucket
+
+# Токен в формате Telegram (id бота:секрет), настоящий не нужен
+FAKE_TOKEN = '123456:fake-token'
+
+# Лимиты Telegram, сверх которых имитация отвечает 429: сообщений в секунду
+# всего, в один чат и допустимый всплеск в один чат
+LIMIT_GLOBAL_RATE = 30
+LIMIT_CHAT_RATE = 1
+LIMIT_CHAT_BURST = 5
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Бенчмарк', 'username': 'bench_bot'}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Отвечает на вызовы Bot API так, как ответил бы Telegram.
+
+    latency - задержка каждого ответа, секунды; с jitter задержка случайная
+    (логнормальная с медианой latency и разбросом jitter). rate_limits -
+    отвечать 429 на отправку сообщений сверх лимитов Telegram, throttle_rate -
+    доля отправок, получающих 429 без причины. Считает вызовы по методам
+    (calls), ответы 429 (throttled) и хранит последние отправленные тексты (sent).
+    """
+
+    def __init__(self, latency=0.0, keep_sent=100, jitter=0.0, rate_limits=False,
+                 throttle_rate=0.0, seed=None):
+        self.latency = latency
+        self.keep_sent = keep_sent
+        self.jitter = jitter
+        self.rate_limits = rate_limits
+        self.throttle_rate = throttle_rate
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.sent = []
+        self._message_ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._global_bucket = TokenBucket(LIMIT_GLOBAL_RATE)
+        self._chat_buckets = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params, message_id=None):
+        chat_id = json.loads(params.get('chat_id', '0'))
+        text = params.get('text', '')
+        if len(self.sent) < self.keep_sent:
+            self.sent.append((chat_id, text))
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': BOT_USER,
+            'text': text,
+        }
+
+    def respond(self, method, params):
+        """Результат метода Bot API (поле result ответа)"""
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'sendMessage':
+            return self._message(params)
+        if method == 'editMessageText':
+            message_id = params.get('message_id')
+            return self._message(params, int(message_id)) if message_id else True
+        if method == 'getUpdates':
+            return []
+        return True
+
+    def retry_after(self, method, params):
+        """Через сколько секунд повторить отправку (None - лимит не превышен)"""
+        if not method.startswith(('send', 'edit', 'copy', 'forward')):
+            return None
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            return 1
+        if not self.rate_limits:
+            return None
+        chat_id = params.get('chat_id')
+        buckets = [self._global_bucket]
+        if chat_id is not None:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(LIMIT_CHAT_RATE, LIMIT_CHAT_BURST)
+            buckets.append(bucket)
+        for bucket in buckets:
+            if not bucket.try_acquire():
+                return max(1, math.ceil((1 - bucket.tokens) / bucket.rate))
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.json_parameters if request_data else {}
+        if self.latency:
+            delay = self.latency
+            if self.jitter:
+                delay *= self._random.lognormvariate(0, self.jitter)
+            await asyncio.sleep(delay)
+
+        retry_after = self.retry_after(api_method, params)
+        if retry_after is not None:
+            self.throttled[api_method] += 1
+            payload = {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {retry_after}',
+                'parameters': {'retry_after': retry_after},
+            }
+            return 429, json.dumps(payload).encode('utf-8')
+        payload = {'ok': True, 'result': self.respond(api_method, params)}
+        return 200, json.dumps(payload).encode('utf-8')
@@ -0,0 +1,462 @@
+"""Нечёткий поиск объектов: опечатки, "№", сокращения улиц.
+
+Для каждого объекта хранится ключ - нормализованные слова названия и
+адреса (normalize.search_words) в таблице search_keys с индексом FTS5 по
+словам. Ключи пересчитываются из очереди search_keys_dirty, которую
+заполняют триггеры objects, поэтому импорт и правки из любого процесса не
+требуют участия бота.
+
+Поиск:
+  1. каждое слово запроса исправляется по словарю индекса: триграммы
+     словаря дают кандидатов, расстояние Левенштейна отбирает близкие
+     ("ленена" -> "ленина", "совецкая" -> "советская");
+  2. FTS5 находит объекты, где есть вариант каждого слова - сначала только
+     точные слова, потом с одной опечаткой, потом с двумя, лучшие по bm25,
+     всего не больше FUZZY_CANDIDATES;
+  3. кандидаты ранжируются по сумме расстояний, совпадениям в названии
+     и длине ключа.
+"""
+import os
+import time
+import bisect
+import asyncio
+import logging
+import threading
+from collections import Counter
+
+import async_db
+import db
+from normalize import search_words
+from search_index import OBJECT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Сколько объектов-кандидатов ранжировать
+FUZZY_CANDIDATES = int(os.getenv('FUZZY_CANDIDATES', '300'))
+
+# Веса полей ключа для bm25 при отборе кандидатов: название, адрес
+KEY_RANK_WEIGHTS = (2.0, 1.0)
+
+# Сколько вариантов исправления брать на одно слово запроса
+VARIANTS_PER_WORD = 8
+
+# Пересчёт ключей: строк за транзакцию и пауза между проверками очереди, секунды
+REFRESH_BATCH = 5000
+REFRESH_INTERVAL = float(os.getenv('FUZZY_REFRESH_INTERVAL', '2'))
+
+# Сколько исправлений слова запоминать
+VARIANT_CACHE_SIZE = 10000
+
+FUZZY_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS search_keys (
+        object_id INTEGER PRIMARY KEY,
+        name_key TEXT NOT NULL,
+        address_key TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS search_keys_dirty (
+        object_id INTEGER PRIMARY KEY
+    )
+    ''',
+    # Номер версии ключей: по нему читатели понимают, что словарь устарел
+    '''
+    CREATE TABLE IF NOT EXISTS search_keys_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_keys_fts USING fts5(
+        name_key, address_key,
+        content='search_keys', content_rowid='object_id',
+        tokenize='unicode61 remove_diacritics 0'
+    )
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_keys_vocab USING fts5vocab(search_keys_fts, 'row')
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS search_keys_ai AFTER INSERT ON search_keys BEGIN
+        INSERT INTO search_keys_fts(rowid, name_key, address_key)
+        VALUES (new.object_id, new.name_key, new.address_key);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS search_keys_ad AFTER DELETE ON search_keys BEGIN
+        INSERT INTO search_keys_fts(search_keys_fts, rowid, name_key, address_key)
+        VALUES ('delete', old.object_id, old.name_key, old.address_key);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS search_keys_au AFTER UPDATE ON search_keys BEGIN
+        INSERT INTO search_keys_fts(search_keys_fts, rowid, name_key, address_key)
+        VALUES ('delete', old.object_id, old.name_key, old.address_key);
+        INSERT INTO search_keys_fts(rowid, name_key, address_key)
+        VALUES (new.object_id, new.name_key, new.address_key);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS objects_keys_ai AFTER INSERT ON objects BEGIN
+        INSERT OR IGNORE INTO search_keys_dirty (object_id) VALUES (new.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS objects_keys_au AFTER UPDATE OF name, address ON objects BEGIN
+        INSERT OR IGNORE INTO search_keys_dirty (object_id) VALUES (new.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS objects_keys_ad AFTER DELETE ON objects BEGIN
+        DELETE FROM search_keys WHERE object_id = old.id;
+    END
+    ''',
+)
+
+
+def ensure_fuzzy_schema(conn):
+    """Таблицы ключей и очереди; при первом создании - все объекты в очередь"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_keys'"
+    ).fetchone()
+    for statement in FUZZY_SCHEMA:
+        conn.execute(statement)
+    if not exists:
+        conn.execute('INSERT OR IGNORE INTO search_keys_dirty (object_id) SELECT id FROM objects')
+        conn.execute('INSERT OR IGNORE INTO search_keys_meta (id, generation) VALUES (1, 0)')
+
+
+db.register_schema(ensure_fuzzy_schema)
+
+
+def refresh_batch(limit=REFRESH_BATCH):
+    """Пересчитать ключи из очереди (не больше limit).
+
+    Вернуть (число строк очереди, новые ключи, версия ключей после записи)
+    """
+    with db.write_transaction() as conn:
+        rows = conn.execute('''
+            SELECT d.object_id, o.name, o.address FROM search_keys_dirty d
+            LEFT JOIN objects o ON o.id = d.object_id
+            LIMIT ?
+        ''', (limit,)).fetchall()
+        if not rows:
+            return 0, [], None
+        keys = [(obj_id, ' '.join(search_words(name)), ' '.join(search_words(address)))
+                for obj_id, name, address in rows if name is not None]
+        conn.executemany('''
+            INSERT INTO search_keys (object_id, name_key, address_key) VALUES (?, ?, ?)
+            ON CONFLICT(object_id) DO UPDATE SET
+                name_key = excluded.name_key, address_key = excluded.address_key
+            WHERE (name_key, address_key) IS NOT (excluded.name_key, excluded.address_key)
+        ''', keys)
+        conn.executemany('DELETE FROM search_keys_dirty WHERE object_id = ?', [(row[0],) for row in rows])
+        generation = conn.execute(
+            'UPDATE search_keys_meta SET generation = generation + 1 RETURNING generation'
+        ).fetchone()[0]
+    return len(rows), keys, generation
+
+
+def refresh_all(batch=REFRESH_BATCH):
+    """Пересчитать всю очередь, вернуть число ключей"""
+    total = 0
+    while True:
+        count, keys, generation = refresh_batch(batch)
+        if not count:
+            return total
+        total += count
+
+
+def pending_count():
+    return db.fetch_one('SELECT count(*) FROM search_keys_dirty')[0]
+
+
+def trigrams(word):
+    """Триграммы слова с границами (пробелами), как в pg_trgm"""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_distance(a, b, limit):
+    """Расстояние Левенштейна, но не больше limit + 1 (дальше не считаем)"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            current.append(cost)
+            row_min = min(row_min, cost)
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def quote_term(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def max_distance(word):
+    """Сколько опечаток допускать в слове такой длины"""
+    if len(word) < 4 or word.isdigit():
+        return 0
+    return 1 if len(word) < 7 else 2
+
+
+class FuzzySearch:
+    """Словарь индекса в памяти и нечёткий поиск по search_keys.
+
+    Словарь (слово -> число объектов, триграммы слов) загружается при первом
+    поиске и перезагружается, когда меняется версия ключей.
+    """
+
+    def __init__(self, candidates=FUZZY_CANDIDATES):
+        self.candidates = candidates
+        self._generation = None
+        self._vocabulary = {}
+        self._sorted_terms = []
+        self._trigram_terms = {}
+        self._variants = {}
+        self._load_lock = threading.Lock()
+        self._task = None
+        # Статистика
+        self.searches = 0
+        self.fuzzy_searches = 0
+        self.vocabulary_loads = 0
+        self.refreshed = 0
+
+    def _load_vocabulary(self, conn, generation):
+        vocabulary = dict(conn.execute('SELECT term, doc FROM search_keys_vocab').fetchall())
+        trigram_terms = {}
+        for term in vocabulary:
+            if not term.isdigit():
+                for trigram in trigrams(term):
+                    trigram_terms.setdefault(trigram, []).append(term)
+        self._vocabulary = vocabulary
+        self._sorted_terms = sorted(vocabulary)
+        self._trigram_terms = trigram_terms
+        self._variants = {}
+        self._generation = generation
+        self.vocabulary_loads += 1
+        logger.info(f"Нечёткий поиск: словарь {len(vocabulary)} слов")
+
+    def _ensure_vocabulary(self, conn):
+        row = conn.execute('SELECT generation FROM search_keys_meta').fetchone()
+        generation = row[0] if row else 0
+        if generation != self._generation:
+            with self._load_lock:
+                if generation != self._generation:
+                    self._load_vocabulary(conn, generation)
+
+    def _add_terms(self, keys, generation):
+        """Дополнить словарь ключами, пересчитанными в этом процессе.
+
+        Полная перезагрузка словаря - это чтение всего индекса, поэтому после
+        своих правок словарь дополняется на месте. Если ключи менял и другой
+        процесс (версия ушла дальше), словарь перечитает следующий поиск.
+        """
+        with self._load_lock:
+            if self._generation is None or generation != self._generation + 1:
+                return
+            new_terms = set()
+            for obj_id, name_key, address_key in keys:
+                for term in (name_key + ' ' + address_key).split():
+                    if term not in self._vocabulary:
+                        new_terms.add(term)
+            for term in new_terms:
+                self._vocabulary[term] = 1
+                bisect.insort(self._sorted_terms, term)
+                if not term.isdigit():
+                    for trigram in trigrams(term):
+                        self._trigram_terms.setdefault(trigram, []).append(term)
+            if new_terms:
+                self._variants = {}
+            self._generation = generation
+
+    def refresh(self, limit=REFRESH_BATCH):
+        """Пересчитать пачку ключей из очереди, вернуть число строк"""
+        count, keys, generation = refresh_batch(limit)
+        if count:
+            self._add_terms(keys, generation)
+            self.refreshed += count
+        return count
+
+    def variants(self, word):
+        """Слова словаря, похожие на word: {слово: расстояние}"""
+        cached = self._variants.get(word)
+        if cached is not None:
+            return cached
+
+        vocabulary = self._vocabulary
+        found = {}
+        if word in vocabulary:
+            found[word] = 0
+        limit = max_distance(word)
+        if limit:
+            # Каждая правка портит не больше трёх триграмм слова, поэтому у слов
+            # на расстоянии limit общих триграмм не меньше len + 1 - 3 * limit
+            counts = Counter()
+            for trigram in trigrams(word):
+                counts.update(self._trigram_terms.get(trigram, ()))
+            threshold = max(1, len(word) + 1 - 3 * limit)
+            for term, common in counts.items():
+                if common >= threshold and term not in found:
+                    distance = bounded_distance(word, term, limit)
+                    if distance <= limit:
+                        found[term] = distance
+
+            # Недописанное слово: "гагар" -> "гагарина"
+            start = bisect.bisect_left(self._sorted_terms, word)
+            for term in self._sorted_terms[start:start + VARIANTS_PER_WORD]:
+                if not term.startswith(word):
+                    break
+                found.setdefault(term, 1)
+
+        best = sorted(found.items(), key=lambda item: (item[1], -vocabulary.get(item[0], 0)))
+        result = dict(best[:VARIANTS_PER_WORD])
+        if len(self._variants) >= VARIANT_CACHE_SIZE:
+            self._variants = {}
+        self._variants[word] = result
+        return result
+
+    def _candidates(self, conn, word_variants, tier, exclude, limit):
+        """Объекты, где есть вариант каждого слова не дальше tier опечаток.
+
+        Совпадения упорядочиваются по bm25 до LIMIT (название важнее адреса),
+        поэтому при многих совпадениях отбрасываются худшие, а не самые
+        поздние по номеру.
+        """
+        groups = []
+        for variants in word_variants:
+            terms = [term for term, distance in variants.items() if distance <= tier]
+            if not terms:
+                return []
+            groups.append('(' + ' OR '.join(quote_term(term) for term in terms) + ')')
+        rows = conn.execute(
+            'SELECT k.object_id, k.name_key, k.address_key FROM search_keys_fts f '
+            'JOIN search_keys k ON k.object_id = f.rowid '
+            'WHERE search_keys_fts MATCH ? ORDER BY bm25(search_keys_fts, ?, ?) LIMIT ?',
+            (' AND '.join(groups), *KEY_RANK_WEIGHTS, limit + len(exclude))
+        ).fetchall()
+        return [row for row in rows if row[0] not in exclude][:limit]
+
+    @staticmethod
+    def score(word_variants, name_key, address_key):
+        """Ключ сортировки кандидата: меньше - лучше.
+
+        Сумма расстояний по словам запроса, затем число слов, найденных в
+        названии. Номер ("5") засчитывается полностью, только если он в том
+        же поле, что и слово перед ним: "ленина 5" - дом 5, "склад 5" - склад №5.
+        """
+        fields = (set(name_key.split()), set(address_key.split()))
+        total = 0.0
+        name_hits = 0
+        previous_field = None
+        for variants in word_variants:
+            best = None
+            for term, distance in variants.items():
+                for field, words in enumerate(fields):
+                    if term in words and (best is None or (distance, field != previous_field) < best):
+                        best = (distance, field != previous_field, field)
+            if best is None:
+                total += 3
+                continue
+            distance, other_field, field = best
+            is_number = next(iter(variants)).isdigit()
+            total += distance + (0.5 if is_number and other_field and previous_field is not None else 0)
+            if field == 0 and not is_number:
+                name_hits += 1
+            previous_field = field
+        return total, -name_hits, len(name_key) + len(address_key)
+
+    def search(self, conn, query, limit=10):
+        """Лучшие limit объектов по запросу с опечатками"""
+        words = search_words(query)
+        if not words:
+            return []
+        self._ensure_vocabulary(conn)
+        self.searches += 1
+        # Слова, которым в словаре нет ничего похожего, не участвуют в поиске
+        word_variants = [variants for variants in map(self.variants, words) if variants]
+        if not word_variants:
+            return []
+
+        # Сначала объекты со всеми словами без исправлений; если их мало -
+        # с одной опечаткой в слове, потом с двумя
+        tiers = sorted({distance for variants in word_variants for distance in variants.values()})
+        candidates = []
+        seen = set()
+        fuzzy = False
+        for tier in tiers:
+            if len(candidates) >= self.candidates:
+                break
+            found = self._candidates(conn, word_variants, tier, seen, self.candidates - len(candidates))
+            candidates += found
+            seen.update(row[0] for row in found)
+            fuzzy = fuzzy or tier > 0
+        if fuzzy:
+            self.fuzzy_searches += 1
+        if not candidates:
+            return []
+
+        candidates.sort(key=lambda row: (*self.score(word_variants, row[1], row[2]), row[0]))
+        ids = [row[0] for row in candidates[:limit]]
+        rows = conn.execute(
+            f"SELECT {OBJECT_COLUMNS} FROM objects o WHERE o.id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+        order = {obj_id: index for index, obj_id in enumerate(ids)}
+        return sorted(rows, key=lambda row: order[row[0]])
+
+    async def start(self):
+        """Пересчитывать ключи из очереди в фоне (при старте бота)"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                count = await async_db.write(self.refresh)
+                if count:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Нечёткий поиск: ошибка пересчёта ключей: {e}")
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+    def stats(self):
+        return {
+            'searches': self.searches,
+            'fuzzy_searches': self.fuzzy_searches,
+            'vocabulary_terms': len(self._vocabulary),
+            'vocabulary_loads': self.vocabulary_loads,
+            'refreshed': self.refreshed,
+        }
+
+
+engine = FuzzySearch()
+
+
+def search(conn, query, limit=10):
+    return engine.search(conn, query, limit)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    db.init_db()
+    started = time.perf_counter()
+    count = refresh_all()
+    print(f"Пересчитано ключей: {count} за {time.perf_counter() - started:.1f} с")
+    db.close_all()
@@ -0,0 +1,419 @@
+"""Локальный справочник адресов: улица + дом -> координаты без DaData.
+
+    python gazetteer.py                       # пересчитать ключи объектов
+    python gazetteer.py --dump addresses.csv  # загрузить выгрузку ФИАС/OSM
+
+Ключ адреса - нормализованные улица и дом (normalize.street_and_house):
+"г. Москва, ул. Ленина, д. 5" и "Ленина 5" дают "ленина 5". Источники:
+- объекты справочника с координатами (gazetteer_objects, обновляется
+  в фоне по очереди изменений, как ключи нечёткого поиска);
+- необязательная выгрузка реестра адресов города в CSV (gazetteer):
+  колонки адрес + широта/долгота или улица + дом + широта/долгота.
+Поиск - несколько чтений по первичному ключу SQLite, доли миллисекунды, и
+работает без сети.
+"""
+import os
+import csv
+import gzip
+import time
+import asyncio
+import logging
+import argparse
+
+import async_db
+import db
+from normalize import LOCALITY_MARKERS, STREET_TYPES, normalize_text, street_and_house
+
+logger = logging.getLogger(__name__)
+
+# Выгрузка адресов города (CSV, можно .csv.gz); загружается при старте бота, если изменилась
+GAZETTEER_DUMP = os.getenv('GAZETTEER_DUMP', '')
+
+# Названия населённых пунктов и регионов, которые пишут перед улицей без
+# запятой ("Москва Ленина 5"); дополняются через запятую в GAZETTEER_LOCALITIES
+LOCALITY_NAMES = (
+    'москва', 'московская', 'санкт-петербург', 'санкт петербург', 'спб', 'питер',
+    'ленинградская', 'подмосковье',
+)
+GAZETTEER_LOCALITIES = os.getenv('GAZETTEER_LOCALITIES', '')
+
+# Пересчёт ключей объектов: строк за транзакцию и пауза между проверками очереди, секунды
+REFRESH_BATCH = 5000
+REFRESH_INTERVAL = float(os.getenv('GAZETTEER_REFRESH_INTERVAL', '5'))
+
+# Строк выгрузки в одной транзакции
+DUMP_BATCH = 5000
+
+# Заголовки колонок выгрузки (сравниваются после normalize_text)
+DUMP_COLUMNS = {
+    'address': ('address', 'адрес', 'full address', 'addr full'),
+    'street': ('street', 'улица', 'addr street', 'formalname street'),
+    'house': ('house', 'дом', 'housenumber', 'addr housenumber', 'housenum'),
+    'lat': ('lat', 'latitude', 'широта', 'geo lat', 'y'),
+    'lon': ('lon', 'lng', 'longitude', 'долгота', 'geo lon', 'x'),
+}
+
+GAZETTEER_SCHEMA = (
+    # Адреса из выгрузки реестра
+    '''
+    CREATE TABLE IF NOT EXISTS gazetteer (
+        key TEXT PRIMARY KEY,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        address TEXT NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    # Адреса объектов справочника: по строке на объект с координатами
+    '''
+    CREATE TABLE IF NOT EXISTS gazetteer_objects (
+        object_id INTEGER PRIMARY KEY,
+        key TEXT NOT NULL,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        address TEXT NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_gazetteer_objects_key ON gazetteer_objects(key, object_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS gazetteer_dirty (
+        object_id INTEGER PRIMARY KEY
+    )
+    ''',
+    # Какая выгрузка загружена: путь, размер, время изменения, строк
+    '''
+    CREATE TABLE IF NOT EXISTS gazetteer_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        dump_path TEXT,
+        dump_size INTEGER,
+        dump_mtime REAL,
+        dump_rows INTEGER,
+        loaded_at REAL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS objects_gazetteer_ai AFTER INSERT ON objects BEGIN
+        INSERT OR IGNORE INTO gazetteer_dirty (object_id) VALUES (new.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS objects_gazetteer_au AFTER UPDATE OF address, lat, lon ON objects BEGIN
+        INSERT OR IGNORE INTO gazetteer_dirty (object_id) VALUES (new.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS objects_gazetteer_ad AFTER DELETE ON objects BEGIN
+        DELETE FROM gazetteer_objects WHERE object_id = old.id;
+    END
+    ''',
+)
+
+
+def ensure_gazetteer_schema(conn):
+    """Таблицы справочника; при первом создании - все объекты в очередь"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'gazetteer_objects'"
+    ).fetchone()
+    for statement in GAZETTEER_SCHEMA:
+        conn.execute(statement)
+    if not exists:
+        conn.execute('INSERT OR IGNORE INTO gazetteer_dirty (object_id) SELECT id FROM objects')
+
+
+db.register_schema(ensure_gazetteer_schema)
+
+
+def make_key(street, house):
+    return f"{' '.join(street)} {house}"
+
+
+def address_key(address):
+    """Ключ адреса или None, если в адресе нет улицы и дома"""
+    parsed = street_and_house(address or '')
+    return make_key(*parsed) if parsed else None
+
+
+def locality_names(extra=GAZETTEER_LOCALITIES):
+    """Названия населённых пунктов списками слов, длинные первыми"""
+    names = {tuple(normalize_text(name).split()) for name in LOCALITY_NAMES + tuple(extra.split(','))}
+    names.update((marker,) for marker in LOCALITY_MARKERS)
+    return sorted((name for name in names if name), key=len, reverse=True)
+
+
+_LOCALITY_NAMES = locality_names()
+
+
+def lookup_keys(address):
+    """Ключи для поиска: полный, затем без названия города в начале ("Москва Ленина 5" -> "ленина 5").
+
+    Отбрасываются только известные населённые пункты (LOCALITY_NAMES,
+    LOCALITY_MARKERS). Слова самой улицы ("Большая", "1-я") остаются:
+    укороченный ключ мог бы найти другую улицу, такой адрес ищет DaData.
+    """
+    parsed = street_and_house(address or '')
+    if parsed is None:
+        return []
+    street, house = parsed
+    types = set(STREET_TYPES.values())
+    names = [word for word in street if word not in types]
+    kinds = street[len(names):]
+    keys = [make_key(names + kinds, house)]
+    start = 0
+    while True:
+        locality = next((name for name in _LOCALITY_NAMES
+                         if tuple(names[start:start + len(name)]) == name), None)
+        # Хотя бы одно слово названия улицы должно остаться
+        if locality is None or start + len(locality) >= len(names):
+            return keys
+        start += len(locality)
+        keys.append(make_key(names[start:] + kinds, house))
+
+
+def valid_coordinates(lat, lon):
+    """Координаты, которым можно верить: есть, в допустимых пределах и не (0, 0)"""
+    return (lat is not None and lon is not None and -90 <= lat <= 90 and -180 <= lon <= 180
+            and (lat, lon) != (0, 0))
+
+
+def lookup(address):
+    """Координаты адреса из справочника: {lat, lon, address, source} или None"""
+    for key in lookup_keys(address):
+        row = db.fetch_one('''
+            SELECT lat, lon, address, 'objects' FROM gazetteer_objects WHERE key = ?
+            UNION ALL
+            SELECT lat, lon, address, 'dump' FROM gazetteer WHERE key = ?
+            LIMIT 1
+        ''', (key, key))
+        if row:
+            return {'lat': row[0], 'lon': row[1], 'address': row[2], 'source': row[3]}
+    return None
+
+
+def refresh_batch(limit=REFRESH_BATCH):
+    """Пересчитать ключи объектов из очереди (не больше limit), вернуть число строк"""
+    with db.write_transaction() as conn:
+        rows = conn.execute('''
+            SELECT d.object_id, o.address, o.lat, o.lon FROM gazetteer_dirty d
+            LEFT JOIN objects o ON o.id = d.object_id
+            LIMIT ?
+        ''', (limit,)).fetchall()
+        if not rows:
+            return 0
+        keep, drop = [], []
+        for object_id, address, lat, lon in rows:
+            key = address_key(address)
+            if key and valid_coordinates(lat, lon):
+                keep.append((object_id, key, lat, lon, address))
+            else:
+                drop.append((object_id,))
+        conn.executemany('''
+            INSERT INTO gazetteer_objects (object_id, key, lat, lon, address) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(object_id) DO UPDATE SET
+                key = excluded.key, lat = excluded.lat, lon = excluded.lon, address = excluded.address
+        ''', keep)
+        conn.executemany('DELETE FROM gazetteer_objects WHERE object_id = ?', drop)
+        conn.executemany('DELETE FROM gazetteer_dirty WHERE object_id = ?', [(row[0],) for row in rows])
+    return len(rows)
+
+
+def refresh_all(batch=REFRESH_BATCH):
+    """Пересчитать всю очередь, вернуть число объектов"""
+    total = 0
+    while True:
+        count = refresh_batch(batch)
+        if not count:
+            return total
+        total += count
+
+
+def rebuild_objects():
+    """Поставить в очередь все объекты и пересчитать ключи"""
+    with db.write_transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO gazetteer_dirty (object_id) SELECT id FROM objects')
+    return refresh_all()
+
+
+def _open_dump(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8-sig', newline='')
+    return open(path, encoding='utf-8-sig', newline='')
+
+
+def _dump_columns(header):
+    """Номера колонок выгрузки по заголовку: поле -> индекс"""
+    names = [normalize_text(name.replace(':', ' ').replace('_', ' ')) for name in header]
+    columns = {}
+    for field, aliases in DUMP_COLUMNS.items():
+        for i, name in enumerate(names):
+            if name in aliases:
+                columns[field] = i
+                break
+    if 'lat' not in columns or 'lon' not in columns:
+        raise ValueError("в выгрузке нет колонок широты и долготы")
+    if 'address' not in columns and not ('street' in columns and 'house' in columns):
+        raise ValueError("в выгрузке нет колонки адреса или колонок улицы и дома")
+    return columns
+
+
+def _dump_rows(reader, columns):
+    """(ключ, широта, долгота, адрес) из строк выгрузки; негодные строки пропускаются"""
+    for row in reader:
+        try:
+            lat = float(row[columns['lat']].replace(',', '.'))
+            lon = float(row[columns['lon']].replace(',', '.'))
+            if 'street' in columns and 'house' in columns and row[columns['street']]:
+                address = f"{row[columns['street']]}, {row[columns['house']]}"
+            else:
+                address = row[columns['address']]
+        except (IndexError, ValueError):
+            yield None
+            continue
+        key = address_key(address)
+        if not key or not valid_coordinates(lat, lon):
+            yield None
+            continue
+        yield key, lat, lon, address.strip()
+
+
+def load_dump(path, batch=DUMP_BATCH):
+    """Заменить адреса выгрузки содержимым файла CSV, вернуть (загружено, пропущено)"""
+    loaded = skipped = 0
+    with _open_dump(path) as f:
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        reader = csv.reader(f, dialect)
+        columns = _dump_columns(next(reader))
+        with db.write_transaction() as conn:
+            conn.execute('DELETE FROM gazetteer')
+        chunk = []
+        for item in _dump_rows(reader, columns):
+            if item is None:
+                skipped += 1
+                continue
+            chunk.append(item)
+            if len(chunk) >= batch:
+                loaded += _insert_dump(chunk)
+                chunk = []
+        if chunk:
+            loaded += _insert_dump(chunk)
+
+    stat = os.stat(path)
+    with db.write_transaction() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO gazetteer_meta (id, dump_path, dump_size, dump_mtime, dump_rows, loaded_at)
+            VALUES (1, ?, ?, ?, ?, ?)
+        ''', (os.path.abspath(path), stat.st_size, stat.st_mtime, loaded, time.time()))
+    logger.info(f"Справочник адресов: из {path} загружено {loaded}, пропущено {skipped}")
+    return loaded, skipped
+
+
+def _insert_dump(rows):
+    # Один адрес в выгрузке может встречаться несколько раз - берём последний
+    with db.write_transaction() as conn:
+        conn.executemany('INSERT OR REPLACE INTO gazetteer (key, lat, lon, address) VALUES (?, ?, ?, ?)', rows)
+    return len(rows)
+
+
+def dump_changed(path):
+    """Файл выгрузки не тот или изменился с прошлой загрузки"""
+    if not path or not os.path.exists(path):
+        return False
+    row = db.fetch_one('SELECT dump_path, dump_size, dump_mtime FROM gazetteer_meta WHERE id = 1')
+    stat = os.stat(path)
+    return row != (os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+
+class Gazetteer:
+    """Поиск адресов в локальном справочнике и фоновое обновление ключей объектов"""
+
+    def __init__(self, dump_path=GAZETTEER_DUMP):
+        self.dump_path = dump_path
+        self._task = None
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.refreshed = 0
+        self.lookup_time = 0.0
+
+    def lookup(self, address):
+        """Координаты адреса или None (выполняется в пуле потоков базы)"""
+        started = time.perf_counter()
+        result = lookup(address)
+        self.lookup_time += time.perf_counter() - started
+        if result:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return result
+
+    def refresh(self, limit=REFRESH_BATCH):
+        count = refresh_batch(limit)
+        self.refreshed += count
+        return count
+
+    async def start(self):
+        """Обновлять ключи объектов (и выгрузку, если изменилась) в фоне"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        try:
+            if await async_db.read(dump_changed, self.dump_path):
+                await async_db.write(load_dump, self.dump_path)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Справочник адресов: не удалось загрузить {self.dump_path}: {e}")
+        while True:
+            try:
+                count = await async_db.write(self.refresh)
+                if count:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Справочник адресов: ошибка пересчёта ключей: {e}")
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'lookup_avg_ms': (self.lookup_time / lookups * 1000) if lookups else 0.0,
+            'refreshed': self.refreshed,
+        }
+
+
+index = Gazetteer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный справочник адресов')
+    parser.add_argument('--dump', help='загрузить выгрузку адресов (CSV или CSV.GZ)')
+    parser.add_argument('--lookup', help='найти адрес в справочнике')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    db.init_db()
+    if args.lookup:
+        print(lookup(args.lookup))
+        return
+    if args.dump:
+        load_dump(args.dump)
+        return
+    started = time.perf_counter()
+    count = rebuild_objects()
+    logger.info(f"Справочник адресов: ключи {count} объектов за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,21 @@
 import os
+import asyncio
 import logging
-import sqlite3
-from datetime import datetime
 from dotenv import load_dotenv
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
+import async_db
+import config
+import crew_locations
+import db
+import dispatch_log
+import metrics
+import profiler
+import recorder
+import webhook
+from crews import get_crew_by_telegram_id_async, update_crew_status_async
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -20,43 +30,22 @@ logger = logging.getLogger(__name__)
 GBR_BOT_TOKEN = os.getenv('GBR_BOT_TOKEN')
 
 # ID диспетчера (тот же, что в bot.py)
-DISPATCHER_ID = 5986066094
+DISPATCHER_ID = config.DISPATCHER_ID
 
 # Путь к базе данных (общая с диспетчерским ботом)
-DB_PATH = 'objects.db'
+DB_PATH = config.DB_PATH
 
 # Клавиатура с кнопками на русском
 reply_keyboard = [
     [KeyboardButton("🔴 Занят")],
     [KeyboardButton("🏁 Прибыл")],
-    [KeyboardButton("🟢 Свободен")]
+    [KeyboardButton("🟢 Свободен")],
+    [KeyboardButton("📍 Отправить геопозицию", request_location=True)]
 ]
 main_keyboard = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
 
-
-def get_crew_by_telegram_id(telegram_id):
-    """Найти ГБР по Telegram ID"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, name, status FROM gbr_crews WHERE telegram_id = ?
-    ''', (str(telegram_id),))
-    result = cursor.fetchone()
-    conn.close()
-    return result
-
-
-def update_crew_status(crew_id, status):
-    """Обновить статус ГБР"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE gbr_crews 
-        SET status = ?, last_active = ?
-        WHERE id = ?
-    ''', (status, datetime.now(), crew_id))
-    conn.commit()
-    conn.close()
+# Последние координаты экипажей, в базу пишутся пачками (write-behind)
+crew_positions = crew_locations.positions
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -72,10 +61,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     
     # 2. Проверяем, есть ли пользователь в таблице ГБР
-    crew = get_crew_by_telegram_id(user_id)
+    crew = await get_crew_by_telegram_id_async(user_id)
     
     if crew:
-        crew_id, crew_name, status = crew
+        crew_id, crew_name, status, telegram_id = crew
         await update.message.reply_text(
             f"👋 С возвращением, {crew_name}!\n"
             f"Твой текущий статус: {status}",
@@ -101,7 +90,7 @@ async def handle_status_change(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
     
-    crew = get_crew_by_telegram_id(user_id)
+    crew = await get_crew_by_telegram_id_async(user_id)
     
     if not crew:
         await update.message.reply_text(
@@ -110,7 +99,7 @@ async def handle_status_change(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
     
-    crew_id, crew_name, current_status = crew
+    crew_id, crew_name, current_status, telegram_id = crew
     
     status_map = {
         "🔴 Занят": "busy",
@@ -120,7 +109,7 @@ async def handle_status_change(update: Update, context: ContextTypes.DEFAULT_TYP
     
     if text in status_map:
         new_status = status_map[text]
-        update_crew_status(crew_id, new_status)
+        await update_crew_status_async(crew_id, new_status)
         
         status_messages = {
             "busy": "🔴 Статус изменён: Занят (выехал на вызов)",
@@ -141,6 +130,87 @@ async def handle_status_change(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка геопозиции экипажа (в том числе обновлений трансляции)"""
+    message = update.effective_message
+    user_id = update.effective_user.id
+    
+    crew = await get_crew_by_telegram_id_async(user_id)
+    if not crew:
+        if update.message:
+            await update.message.reply_text("❌ Ты не зарегистрирован в системе.")
+        return
+    
+    crew_positions.update(crew[0], message.location.latitude, message.location.longitude)
+    
+    # Обновления трансляции приходят как edited_message - на них не отвечаем
+    if update.message:
+        await update.message.reply_text(
+            "📍 Геопозиция получена. Включи трансляцию геопозиции, "
+            "чтобы диспетчер видел, где ты.",
+            reply_markup=main_keyboard
+        )
+
+
+async def flush_locations_loop() -> None:
+    """Периодически сбрасывать координаты экипажей в базу"""
+    while True:
+        await asyncio.sleep(crew_locations.LOCATION_FLUSH_INTERVAL)
+        try:
+            await async_db.write(crew_positions.flush)
+        except Exception as e:
+            logger.error(f"Ошибка записи координат ГБР: {e}")
+
+
+async def on_startup(application: Application) -> None:
+    """Запуск фоновых задач и сервера метрик"""
+    application.bot_data['flush_task'] = asyncio.create_task(flush_locations_loop())
+    await dispatch_log.log.start()
+    await metrics.start_server(metrics.config_from_env('GBR_'))
+    profiler.install_signal_handler(application)
+
+
+async def on_shutdown(application: Application) -> None:
+    """Остановка фоновых задач и запись несохранённых координат"""
+    task = application.bot_data.pop('flush_task', None)
+    if task:
+        task.cancel()
+    await async_db.write(crew_positions.flush)
+    await dispatch_log.log.stop()
+    await metrics.stop_server(metrics.config_from_env('GBR_'))
+    recorder.close(application)
+
+
+def build_application(token=None, request=None):
+    """Создать приложение бота ГБР со всеми обработчиками.
+
+    request - свой транспорт Bot API (например, fake_telegram для нагрузочного прогона)
+    """
+    # Создаём приложение
+    builder = (
+        Application.builder()
+        .token(token or GBR_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    
+    # Добавляем обработчики
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(MessageHandler(filters.LOCATION, handle_location))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_status_change))
+    
+    # Время каждого обработчика - в метрики
+    metrics.instrument_handlers(application, 'gbr')
+    
+    # Запись обновлений для нагрузочного прогона (если задан GBR_RECORD_UPDATES)
+    recorder.install(application, 'gbr', DISPATCHER_ID, prefix='GBR_')
+    
+    return application
+
+
 def main():
     """Запуск бота для ГБР"""
     if not GBR_BOT_TOKEN:
@@ -148,17 +218,26 @@ def main():
         print("\n⚠️  ВНИМАНИЕ: Добавь GBR_BOT_TOKEN в файл .env\n")
         return
     
-    # Создаём приложение
-    application = Application.builder().token(GBR_BOT_TOKEN).build()
+    try:
+        # Webhook, если задан GBR_WEBHOOK_PORT, иначе polling
+        webhook_config = webhook.config_from_env('GBR_')
+    except ValueError as e:
+        logger.error(f"❌ {e}")
+        return
     
-    # Добавляем обработчики
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_status_change))
+    # Готовим базу данных (WAL)
+    db.init_db()
+    
+    application = build_application()
     
     # Запускаем бота
     logger.info("Запуск GBR Crew Bot...")
     print("✅ Бот для ГБР запущен. Готов к работе.")
-    application.run_polling()
+    try:
+        webhook.run(application, webhook_config)
+    finally:
+        async_db.shutdown()
+        db.close_all()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,226 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import db
+from normalize import normalize_address
+
+logger = logging.getLogger(__name__)
+
+# Сколько живёт запись в кэше, секунды (по умолчанию 30 дней)
+GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', str(30 * 24 * 3600)))
+
+# Максимум записей в памяти и в базе
+GEOCODE_MEMORY_SIZE = int(os.getenv('GEOCODE_MEMORY_SIZE', '2048'))
+GEOCODE_CACHE_MAX_ROWS = int(os.getenv('GEOCODE_CACHE_MAX_ROWS', '100000'))
+
+# Как часто (в записях) чистить просроченные и лишние строки в базе
+PURGE_EVERY = 500
+
+CACHE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        key TEXT PRIMARY KEY,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        address TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_geocode_cache_created ON geocode_cache(created_at)',
+)
+
+
+def ensure_geocode_cache(conn):
+    """Таблица кэша геокодирования"""
+    for statement in CACHE_SCHEMA:
+        conn.execute(statement)
+
+
+db.register_schema(ensure_geocode_cache)
+
+
+class GeocodeCache:
+    """Двухуровневый кэш геокодирования: LRU в памяти поверх таблицы в SQLite.
+
+    Ключ - нормализованный адрес, поэтому "Ленина 5" и "ул. Ленина, д. 5"
+    попадают в одну запись. Записи старше ttl считаются промахом.
+    """
+
+    def __init__(self, ttl=GEOCODE_CACHE_TTL, memory_size=GEOCODE_MEMORY_SIZE,
+                 max_rows=GEOCODE_CACHE_MAX_ROWS):
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        # ключ -> (результат, время записи)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_purge = 0
+        # Счётчики
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _remember(self, key, value, created_at):
+        with self._lock:
+            self._memory[key] = (value, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+                self.evictions += 1
+
+    def get_memory(self, address):
+        """Быстрая проверка только памяти: (найдено, результат)"""
+        key = normalize_address(address)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if time.time() - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return True, value
+                del self._memory[key]
+        return False, None
+
+    def get(self, address):
+        """Найти адрес в памяти, затем в базе: (найдено, результат)"""
+        found, value = self.get_memory(address)
+        if found:
+            return found, value
+
+        key = normalize_address(address)
+        row = db.fetch_one(
+            'SELECT lat, lon, address, created_at FROM geocode_cache WHERE key = ? AND created_at > ?',
+            (key, time.time() - self.ttl)
+        )
+        if row is None:
+            self.misses += 1
+            return False, None
+
+        lat, lon, full_address, created_at = row
+        value = {'lat': lat, 'lon': lon, 'address': full_address}
+        self._remember(key, value, created_at)
+        self.disk_hits += 1
+        return True, value
+
+    def get_stale(self, address):
+        """Запись из базы без учёта срока: (найдено, результат).
+
+        Для случая, когда DaData недоступна: старые координаты лучше, чем никаких.
+        """
+        row = db.fetch_one('SELECT lat, lon, address FROM geocode_cache WHERE key = ?',
+                           (normalize_address(address),))
+        if row is None:
+            return False, None
+        self.stale_hits += 1
+        return True, {'lat': row[0], 'lon': row[1], 'address': row[2]}
+
+    def put(self, address, value):
+        """Запомнить найденные координаты адреса"""
+        key = normalize_address(address)
+        if not value or not key:
+            return
+        created_at = time.time()
+        self._remember(key, value, created_at)
+        db.execute(
+            'INSERT OR REPLACE INTO geocode_cache (key, lat, lon, address, created_at) VALUES (?, ?, ?, ?, ?)',
+            (key, value['lat'], value['lon'], value['address'], created_at)
+        )
+        self.stores += 1
+
+        self._writes_since_purge += 1
+        if self._writes_since_purge >= PURGE_EVERY:
+            self._writes_since_purge = 0
+            self.purge()
+
+    def get_many(self, addresses):
+        """Найти пачку адресов одним запросом: адрес -> результат (только найденные)"""
+        found = {}
+        missing = {}
+        for address in addresses:
+            hit, value = self.get_memory(address)
+            if hit:
+                found[address] = value
+            else:
+                key = normalize_address(address)
+                if key:
+                    missing.setdefault(key, []).append(address)
+        if not missing:
+            return found
+
+        keys = list(missing)
+        rows = []
+        # Не больше 500 параметров в одном запросе
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows.extend(db.fetch_all(
+                f"SELECT key, lat, lon, address, created_at FROM geocode_cache "
+                f"WHERE key IN ({','.join('?' * len(chunk))}) AND created_at > ?",
+                (*chunk, time.time() - self.ttl)
+            ))
+        for key, lat, lon, full_address, created_at in rows:
+            value = {'lat': lat, 'lon': lon, 'address': full_address}
+            self._remember(key, value, created_at)
+            self.disk_hits += len(missing[key])
+            for address in missing.pop(key):
+                found[address] = value
+        self.misses += sum(len(addresses) for addresses in missing.values())
+        return found
+
+    def put_many(self, items):
+        """Запомнить пачку (адрес, результат) одной транзакцией"""
+        rows = []
+        created_at = time.time()
+        for address, value in items:
+            key = normalize_address(address)
+            if value and key:
+                self._remember(key, value, created_at)
+                rows.append((key, value['lat'], value['lon'], value['address'], created_at))
+        if not rows:
+            return
+        with db.write_transaction() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO geocode_cache (key, lat, lon, address, created_at) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+        self.stores += len(rows)
+
+        self._writes_since_purge += len(rows)
+        if self._writes_since_purge >= PURGE_EVERY:
+            self._writes_since_purge = 0
+            self.purge()
+
+    def purge(self):
+        """Удалить просроченные записи и самые старые сверх лимита"""
+        with db.write_transaction() as conn:
+            expired = conn.execute(
+                'DELETE FROM geocode_cache WHERE created_at <= ?', (time.time() - self.ttl,)
+            ).rowcount
+            overflow = conn.execute(
+                'DELETE FROM geocode_cache WHERE key IN ('
+                '  SELECT key FROM geocode_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?'
+                ')', (self.max_rows,)
+            ).rowcount
+        self.evictions += expired + overflow
+        if expired or overflow:
+            logger.info(f"Кэш геокодирования: удалено {expired} просроченных, {overflow} лишних")
+
+    def stats(self):
+        """Счётчики попаданий и промахов"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_entries': len(self._memory),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'hit_ratio': ((self.memory_hits + self.disk_hits) / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,435 @@
+"""Фоновое геокодирование объектов без координат.
+
+Объекты с пустыми или подозрительными координатами (0,0, вне рабочей
+области GEOCODE_BBOX, одна точка у десятков разных адресов - типичный
+ответ "центр города") геокодируются через DaData пачками: несколько
+запросов одновременно, не чаще GEOCODE_RATE в секунду, сначала через
+общий кэш geocode_cache. Найденные координаты записываются одной
+транзакцией на пачку. Ненайденные адреса повторяются не раньше чем через
+GEOCODE_RETRY_AFTER.
+
+В боте включается GEOCODE_WORKER=1, разовый прогон:
+    python geocode_worker.py                 # до конца очереди
+    python geocode_worker.py --dry-run       # только посчитать
+    python geocode_worker.py --stub          # против локальной заглушки
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+
+import async_db
+import db
+import geocoder
+from geocode_cache import GeocodeCache
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Включить фоновое геокодирование в bot.py
+GEOCODE_WORKER = os.getenv('GEOCODE_WORKER', '0') == '1'
+
+# Одновременных запросов и запросов в секунду к DaData от фоновой задачи.
+# Меньше DADATA_MAX_IN_FLIGHT, чтобы диспетчеру всегда оставались слоты
+GEOCODE_CONCURRENCY = int(os.getenv('GEOCODE_CONCURRENCY', '4'))
+GEOCODE_RATE = float(os.getenv('GEOCODE_RATE', '5'))
+
+# Объектов в пачке (одна транзакция записи на пачку)
+GEOCODE_BATCH_SIZE = int(os.getenv('GEOCODE_BATCH_SIZE', '100'))
+
+# Пауза между проходами по справочнику, секунды
+GEOCODE_INTERVAL = float(os.getenv('GEOCODE_INTERVAL', '3600'))
+
+# Через сколько повторять ненайденный адрес, секунды (по умолчанию 7 дней)
+GEOCODE_RETRY_AFTER = float(os.getenv('GEOCODE_RETRY_AFTER', str(7 * 24 * 3600)))
+
+# Рабочая область "мин_широта,мин_долгота,макс_широта,макс_долгота";
+# координаты за её пределами считаются ошибочными
+GEOCODE_BBOX = os.getenv('GEOCODE_BBOX', '')
+
+# Точка, общая для стольких разных адресов, считается подозрительной (0 - не проверять)
+GEOCODE_SHARED_POINT_LIMIT = int(os.getenv('GEOCODE_SHARED_POINT_LIMIT', '50'))
+
+# Город, который дописывается к адресам без него ("г Москва")
+GEOCODE_CITY = os.getenv('GEOCODE_CITY', '')
+
+# Сколько подозрительных точек проверять (параметров SQL-запроса)
+SHARED_POINTS_MAX = 200
+
+GEOCODE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS geocode_attempts (
+        object_id INTEGER PRIMARY KEY,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS objects_geocode_address_au
+    AFTER UPDATE OF address ON objects
+    WHEN old.address IS NOT new.address
+    BEGIN
+        DELETE FROM geocode_attempts WHERE object_id = new.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS objects_geocode_ad
+    AFTER DELETE ON objects
+    BEGIN
+        DELETE FROM geocode_attempts WHERE object_id = old.id;
+    END
+    ''',
+)
+
+
+def ensure_geocode_table(conn):
+    """Таблица попыток геокодирования; смена адреса сбрасывает попытки"""
+    for statement in GEOCODE_SCHEMA:
+        conn.execute(statement)
+
+
+db.register_schema(ensure_geocode_table)
+
+
+def parse_bbox(text):
+    """'55.1,36.8,56.1,38.4' -> (55.1, 36.8, 56.1, 38.4) или None"""
+    if not text:
+        return None
+    values = tuple(float(value) for value in text.split(','))
+    if len(values) != 4:
+        raise ValueError(f"GEOCODE_BBOX: нужно 4 числа, получено {len(values)}")
+    return values
+
+
+def shared_points(limit=GEOCODE_SHARED_POINT_LIMIT):
+    """Точки, которые стоят у limit и больше разных адресов"""
+    if limit <= 0:
+        return []
+    return db.fetch_all('''
+        SELECT lat, lon FROM objects
+        WHERE lat IS NOT NULL AND lon IS NOT NULL
+        GROUP BY lat, lon
+        HAVING count(DISTINCT address) >= ?
+        ORDER BY count(*) DESC
+        LIMIT ?
+    ''', (limit, SHARED_POINTS_MAX))
+
+
+def candidates_filter(bbox=None, points=(), retry_before=0.0):
+    """Условие WHERE и параметры для объектов, которые нужно геокодировать"""
+    suspect = [
+        'o.lat IS NULL', 'o.lon IS NULL',
+        'o.lat NOT BETWEEN -90 AND 90', 'o.lon NOT BETWEEN -180 AND 180',
+        '(o.lat = 0 AND o.lon = 0)',
+    ]
+    params = []
+    if bbox:
+        suspect.append('o.lat NOT BETWEEN ? AND ? OR o.lon NOT BETWEEN ? AND ?')
+        params.extend((bbox[0], bbox[2], bbox[1], bbox[3]))
+    if points:
+        suspect.append(f"(o.lat, o.lon) IN (VALUES {', '.join(['(?, ?)'] * len(points))})")
+        params.extend(value for point in points for value in point)
+
+    # Подтверждённые координаты не трогаем, пока они есть; ненайденные - ждут повтора
+    where = f'''
+        ({' OR '.join(suspect)})
+        AND (g.object_id IS NULL
+             OR (g.status = 'ok' AND (o.lat IS NULL OR o.lon IS NULL))
+             OR (g.status != 'ok' AND g.updated_at < ?))
+    '''
+    params.append(retry_before)
+    return where, params
+
+
+def count_candidates(where, params):
+    return db.fetch_one(f'''
+        SELECT count(*) FROM objects o
+        LEFT JOIN geocode_attempts g ON g.object_id = o.id
+        WHERE {where}
+    ''', params)[0]
+
+
+def fetch_candidates(where, params, after_id, limit):
+    """Следующая пачка объектов после after_id: [(id, address)]"""
+    return db.fetch_all(f'''
+        SELECT o.id, o.address FROM objects o
+        LEFT JOIN geocode_attempts g ON g.object_id = o.id
+        WHERE o.id > ? AND {where}
+        ORDER BY o.id
+        LIMIT ?
+    ''', (after_id, *params, limit))
+
+
+def save_results(found, not_found):
+    """Записать координаты found [(id, address, lat, lon)] и промахи not_found [(id, address)].
+
+    Объект, адрес которого успел измениться, не трогаем - его геокодирует
+    следующий проход. Возвращает число обновлённых объектов.
+    """
+    now = time.time()
+    with db.write_transaction() as conn:
+        updated = conn.executemany(
+            'UPDATE objects SET lat = ?, lon = ? WHERE id = ? AND address = ?',
+            ((lat, lon, obj_id, address) for obj_id, address, lat, lon in found)
+        ).rowcount
+        conn.executemany('''
+            INSERT INTO geocode_attempts (object_id, status, attempts, updated_at)
+            SELECT id, ?, 1, ? FROM objects WHERE id = ? AND address = ?
+            ON CONFLICT(object_id) DO UPDATE SET
+                status = excluded.status, attempts = attempts + 1, updated_at = excluded.updated_at
+        ''', [('ok', now, obj_id, address) for obj_id, address, lat, lon in found]
+             + [('not_found', now, obj_id, address) for obj_id, address in not_found])
+    return updated
+
+
+class GeocodeWorker:
+    """Проходы по справочнику объектов с геокодированием пачками.
+
+    Использует общий клиент DaData и кэш бота: адрес, который диспетчер уже
+    искал, не запрашивается повторно, и наоборот.
+    """
+
+    def __init__(self, client, cache, concurrency=GEOCODE_CONCURRENCY, rate=GEOCODE_RATE,
+                 batch_size=GEOCODE_BATCH_SIZE, interval=GEOCODE_INTERVAL,
+                 retry_after=GEOCODE_RETRY_AFTER, bbox=GEOCODE_BBOX,
+                 shared_limit=GEOCODE_SHARED_POINT_LIMIT, city=GEOCODE_CITY):
+        self.client = client
+        self.cache = cache
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_after = retry_after
+        self.bbox = parse_bbox(bbox) if isinstance(bbox, str) else bbox
+        self.shared_limit = shared_limit
+        self.city = city
+        self._bucket = TokenBucket(rate) if rate > 0 else None
+        self._task = None
+        self._wakeup = None
+        # Статистика текущего (или последнего) прохода
+        self.total = 0
+        self.processed = 0
+        self.resolved = 0
+        self.not_found = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.requests = 0
+        self.passes = 0
+        self.started_at = None
+        self.elapsed = 0.0
+
+    def query_for(self, address):
+        """Строка запроса к DaData для адреса из справочника"""
+        if self.city and self.city.lower() not in address.lower():
+            return f"{self.city}, {address}"
+        return address
+
+    async def start(self):
+        """Запустить проходы в фоне (при старте бота)"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Начать проход, не дожидаясь интервала (например, после импорта)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_pass()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Геокодирование: ошибка прохода: {e}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_pass(self, limit=None, dry_run=False, progress=None):
+        """Один проход по справочнику. Вернуть stats().
+
+        limit - не больше стольких объектов, dry_run - только посчитать,
+        progress - функция, вызываемая со stats() после каждой пачки
+        """
+        points = await async_db.read(shared_points, self.shared_limit)
+        where, params = candidates_filter(self.bbox, points, time.time() - self.retry_after)
+        self.total = await async_db.read(count_candidates, where, params)
+        if limit is not None:
+            self.total = min(self.total, limit)
+        self.processed = self.resolved = self.not_found = self.failed = 0
+        self.cache_hits = self.requests = 0
+        self.started_at = time.monotonic()
+        self.elapsed = 0.0
+        if not self.total or dry_run:
+            return self.stats()
+
+        logger.info(f"Геокодирование: {self.total} объектов без координат "
+                    f"(подозрительных точек: {len(points)})")
+        after_id = 0
+        while self.processed < self.total:
+            size = min(self.batch_size, self.total - self.processed)
+            batch = await async_db.read(fetch_candidates, where, params, after_id, size)
+            if not batch:
+                break
+            after_id = batch[-1][0]
+            await self.process_batch(batch)
+            self.elapsed = time.monotonic() - self.started_at
+            if progress is not None:
+                progress(self.stats())
+            else:
+                logger.info(self.progress_text())
+
+        self.passes += 1
+        self.elapsed = time.monotonic() - self.started_at
+        logger.info(f"Геокодирование завершено: {self.progress_text()}")
+        return self.stats()
+
+    async def process_batch(self, batch):
+        """Геокодировать пачку [(id, address)] и записать результат"""
+        queries = {obj_id: self.query_for(address) for obj_id, address in batch}
+        unique = list(dict.fromkeys(queries.values()))
+        results = await async_db.read(self.cache.get_many, unique)
+        self.cache_hits += sum(1 for query in queries.values() if query in results)
+
+        missing = [query for query in unique if query not in results]
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(query):
+            async with slots:
+                # DaData отключена автоматом защиты - ждём пробного запроса
+                pause = self.client.breaker.retry_in()
+                if pause:
+                    await asyncio.sleep(pause)
+                if self._bucket is not None:
+                    await self._bucket.acquire()
+                self.requests += 1
+                # Без страховки: фоновой работе задержка не важна, лимит запросов важнее
+                return await self.client.lookup(query, self.client.timeout, hedge=False)
+
+        fetched = dict(zip(missing, await asyncio.gather(*(fetch(query) for query in missing))))
+        # Если в пачке были ошибки, промахи не запоминаем - их повторит следующий проход
+        had_errors = not all(ok for value, ok in fetched.values())
+        fetched = {query: value for query, (value, ok) in fetched.items()}
+        results.update((query, value) for query, value in fetched.items() if value)
+
+        found, not_found = [], []
+        for obj_id, address in batch:
+            value = results.get(queries[obj_id])
+            if value and value.get('lat') is not None:
+                found.append((obj_id, address, value['lat'], value['lon']))
+            elif had_errors:
+                self.failed += 1
+            else:
+                not_found.append((obj_id, address))
+
+        await async_db.write(self.cache.put_many, [item for item in fetched.items() if item[1]])
+        await async_db.write(save_results, found, not_found)
+        self.processed += len(batch)
+        self.resolved += len(found)
+        self.not_found += len(not_found)
+
+    def progress_text(self):
+        stats = self.stats()
+        text = (f"{self.processed}/{self.total} ({stats['progress']:.0%}), найдено {self.resolved}, "
+                f"не найдено {self.not_found}, ошибок {self.failed}, из кэша {self.cache_hits}, "
+                f"{stats['objects_per_s']:.1f} объектов/с")
+        if stats['eta_s'] >= 120:
+            text += f", осталось ~{stats['eta_s'] / 60:.0f} мин"
+        elif stats['eta_s']:
+            text += f", осталось ~{stats['eta_s']:.0f} с"
+        return text
+
+    def stats(self):
+        """Прогресс и пропускная способность текущего прохода"""
+        rate = self.processed / self.elapsed if self.elapsed else 0.0
+        remaining = self.total - self.processed
+        return {
+            'total': self.total,
+            'processed': self.processed,
+            'resolved': self.resolved,
+            'not_found': self.not_found,
+            'failed': self.failed,
+            'cache_hits': self.cache_hits,
+            'requests': self.requests,
+            'passes': self.passes,
+            'progress': (self.processed / self.total) if self.total else 1.0,
+            'objects_per_s': rate,
+            'requests_per_s': self.requests / self.elapsed if self.elapsed else 0.0,
+            'eta_s': (remaining / rate) if rate and remaining > 0 else 0.0,
+        }
+
+
+async def _main(args):
+    stub = None
+    api_key = os.getenv('DADATA_API_KEY')
+    url = args.url or os.getenv('DADATA_URL', geocoder.DADATA_URL)
+    if args.stub:
+        from stub_dadata import StubDaData
+        stub = StubDaData(delay=args.stub_delay)
+        url = f"http://127.0.0.1:{await stub.start()}/suggest"
+        api_key = api_key or 'stub'
+    elif not api_key and not args.dry_run:
+        print("❌ DADATA_API_KEY не задан")
+        return
+
+    client = geocoder.DaDataGeocoder(api_key, url=url,
+                                     max_in_flight=max(args.concurrency, 1))
+    worker = GeocodeWorker(client, GeocodeCache(), concurrency=args.concurrency, rate=args.rate,
+                           batch_size=args.batch_size)
+
+    def progress(stats):
+        print(f"\r{worker.progress_text()}", end='', flush=True)
+
+    try:
+        stats = await worker.run_pass(limit=args.limit, dry_run=args.dry_run, progress=progress)
+    finally:
+        await client.close()
+        if stub is not None:
+            await stub.stop()
+    if args.dry_run:
+        print(f"Нужно геокодировать: {stats['total']}")
+    else:
+        print(f"\n✅ {worker.progress_text()}, запросов к DaData: {stats['requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Геокодирование объектов без координат')
+    parser.add_argument('--limit', type=int, help='не больше стольких объектов')
+    parser.add_argument('--concurrency', type=int, default=GEOCODE_CONCURRENCY)
+    parser.add_argument('--rate', type=float, default=GEOCODE_RATE, help='запросов в секунду (0 - без ограничения)')
+    parser.add_argument('--batch-size', type=int, default=GEOCODE_BATCH_SIZE)
+    parser.add_argument('--url', help='адрес API DaData (по умолчанию DADATA_URL)')
+    parser.add_argument('--stub', action='store_true', help='запустить локальную заглушку DaData')
+    parser.add_argument('--stub-delay', type=float, default=0.05, help='задержка заглушки, секунды')
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать объекты')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    db.init_db()
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        print("\n⏸ Прервано. Уже найденные координаты сохранены.")
+        sys.exit(130)
+    finally:
+        async_db.shutdown()
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Адрес API подсказок DaData
+DADATA_URL = "https://suggestions.dadata.ru/suggestions/api/4_1/rs/suggest/address"
+
+# Сколько запросов к DaData может выполняться одновременно
+DADATA_MAX_IN_FLIGHT = int(os.getenv('DADATA_MAX_IN_FLIGHT', '8'))
+
+# Срок ответа на один запрос, секунды
+DADATA_TIMEOUT = float(os.getenv('DADATA_TIMEOUT', '3'))
+
+# Общий срок поиска одного адреса со всеми попытками, секунды
+DADATA_BUDGET = float(os.getenv('DADATA_BUDGET', '2'))
+
+# Страхующий второй запрос, если первый отвечает дольше p95 последних ответов
+DADATA_HEDGE = os.getenv('DADATA_HEDGE', '1') == '1'
+
+# Страхующих запросов не больше этой доли от всех, чтобы не удвоить нагрузку
+HEDGE_MAX_SHARE = 0.1
+# Задержка страховки: не меньше, секунды; сколько последних ответов учитывать;
+# пока ответов меньше HEDGE_MIN_SAMPLES, ждём половину срока
+HEDGE_MIN_DELAY = 0.05
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+# Автомат защиты: после стольких ошибок подряд DaData не опрашивается
+# BREAKER_COOLDOWN секунд, затем пропускается один пробный запрос
+BREAKER_FAILURES = int(os.getenv('DADATA_BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN = float(os.getenv('DADATA_BREAKER_COOLDOWN', '30'))
+
+
+def parse_suggestion(result):
+    """Достать координаты из ответа DaData (None, если их нет)"""
+    if not result.get('suggestions'):
+        return None
+
+    suggestion = result['suggestions'][0]
+    data = suggestion.get('data') or {}
+
+    if data.get('geo_lat') and data.get('geo_lon'):
+        return {
+            'lat': float(data['geo_lat']),
+            'lon': float(data['geo_lon']),
+            'address': suggestion['value']
+        }
+    return None
+
+
+class CircuitBreaker:
+    """Автомат защиты от неотвечающей DaData.
+
+    closed - запросы идут; после failures ошибок подряд - open: запросы
+    сразу отклоняются cooldown секунд; затем half_open - проходит один
+    пробный запрос, успех замыкает автомат, ошибка снова размыкает.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+    # Числовой код состояния для метрик
+    STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        # Когда пропущен пробный запрос (None - ещё не пропущен)
+        self.probe_at = None
+        # Счётчики
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Можно ли сейчас отправить запрос"""
+        if self.state == self.CLOSED:
+            return True
+        now = self.clock()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_at = None
+        # Пробный запрос один; если он пропал без ответа, через cooldown - следующий
+        if self.probe_at is not None and now - self.probe_at < self.cooldown:
+            self.rejected += 1
+            return False
+        self.probe_at = now
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("DaData снова отвечает, запросы возобновлены")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.probe_at = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.consecutive_failures >= self.failures):
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+            self.probe_at = None
+            self.opens += 1
+            logger.warning(f"DaData: {self.consecutive_failures} ошибок подряд, "
+                           f"запросы приостановлены на {self.cooldown:.0f} с")
+
+    def retry_in(self):
+        """Через сколько секунд автомат пропустит запрос (0 - уже пропускает)"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.cooldown - (self.clock() - self.opened_at))
+
+    def stats(self):
+        return {
+            'breaker_state': self.STATE_CODES[self.state],
+            'breaker_opens': self.opens,
+            'breaker_rejected': self.rejected,
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+class DaDataGeocoder:
+    """Асинхронный клиент DaData.
+
+    Держит пул keep-alive соединений, ограничивает число одновременных
+    запросов, одинаковые запросы в полёте объединяются в один. На поиск
+    адреса целиком даётся budget секунд. Если ответа нет дольше p95
+    последних ответов, уходит страхующий второй запрос и берётся первый
+    ответ. После серии ошибок автомат защиты (CircuitBreaker) на время
+    отключает DaData, и поиск сразу возвращает неудачу - вызывающий
+    обходится кэшем и справочником.
+    """
+
+    def __init__(self, api_key, url=DADATA_URL, max_in_flight=DADATA_MAX_IN_FLIGHT,
+                 timeout=DADATA_TIMEOUT, budget=DADATA_BUDGET, hedge=DADATA_HEDGE, breaker=None):
+        self.api_key = api_key
+        self.url = url
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.budget = budget
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self._slots = None
+        # Запросы в полёте: адрес -> задача
+        self._in_flight = {}
+        # Время последних удачных ответов для задержки страховки
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        # Статистика
+        self.requests = 0
+        self.merged = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.short_circuits = 0
+        self.request_time_total = 0.0
+
+    def _ensure_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={
+                    "Content-Type": "application/json",
+                    "Accept": "application/json",
+                    "Authorization": f"Token {self.api_key}"
+                },
+                limits=httpx.Limits(
+                    max_connections=self.max_in_flight,
+                    max_keepalive_connections=self.max_in_flight,
+                    keepalive_expiry=60,
+                ),
+                timeout=self.timeout,
+            )
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        return self._client
+
+    @staticmethod
+    def request_key(address):
+        """Ключ для объединения одинаковых запросов"""
+        return ' '.join(address.split()).lower()
+
+    def available(self):
+        """Пропустит ли автомат защиты запрос к DaData"""
+        return self.breaker.state != CircuitBreaker.OPEN or not self.breaker.retry_in()
+
+    def hedge_delay(self, budget):
+        """Через сколько секунд без ответа отправлять страхующий запрос"""
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return budget / 2
+        latencies = sorted(self._latencies)
+        return max(HEDGE_MIN_DELAY, latencies[int(len(latencies) * 0.95)])
+
+    def _may_hedge(self):
+        return (self.hedge and self.breaker.state == CircuitBreaker.CLOSED
+                and not self._slots.locked()
+                and self.hedges < HEDGE_MAX_SHARE * self.requests)
+
+    async def geocode(self, address, timeout=None, hedge=True):
+        """Получить координаты адреса: {'lat', 'lon', 'address'} или None"""
+        result, ok = await self.lookup(address, timeout, hedge)
+        return result
+
+    async def lookup(self, address, timeout=None, hedge=True):
+        """(координаты или None, ok).
+
+        ok=False - DaData не ответила за timeout (по умолчанию budget),
+        ответила ошибкой или отключена автоматом защиты; ok=True и None -
+        адрес не найден.
+        """
+        self._ensure_client()
+        key = self.request_key(address)
+        if not key:
+            return None, True
+        budget = timeout or self.budget
+
+        task = self._in_flight.get(key)
+        if task is None:
+            if not self.breaker.allow():
+                self.short_circuits += 1
+                return None, False
+            task = asyncio.ensure_future(self._fetch(address))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            # Страхует только тот, кто начал запрос, а не присоединившиеся
+            hedge = hedge and self._may_hedge()
+        else:
+            self.merged += 1
+            hedge = False
+
+        # Ждём через asyncio.wait: если этот вызывающий отвалится по сроку,
+        # общий запрос продолжит работу для остальных
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        hedge_at = loop.time() + self.hedge_delay(budget) if hedge else None
+        pending, hedged = {task}, None
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    break
+                wake = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(
+                    pending, timeout=wake - now, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    result, ok = finished.result()
+                    if ok:
+                        if finished is hedged:
+                            self.hedge_wins += 1
+                        return result, True
+                # Страховка - по задержке или сразу, если первый запрос упал
+                if hedge_at is not None and (done or loop.time() >= hedge_at):
+                    hedge_at = None
+                    if self._may_hedge():
+                        hedged = asyncio.ensure_future(self._fetch(address))
+                        pending.add(hedged)
+                        self.hedges += 1
+        finally:
+            if hedged is not None and not hedged.done():
+                hedged.cancel()
+
+        if pending:
+            self.timeouts += 1
+            logger.error(f"DaData не ответила за {budget} с: '{address}'")
+        return None, False
+
+    async def _fetch(self, address):
+        """Один запрос к DaData: (координаты или None, ok)"""
+        async with self._slots:
+            started = time.perf_counter()
+            self.requests += 1
+            try:
+                response = await self._client.post(self.url, json={"query": address, "count": 1})
+            except httpx.HTTPError as e:
+                self.errors += 1
+                self.breaker.record_failure()
+                metrics.DADATA_SECONDS.observe(time.perf_counter() - started, 'network_error')
+                logger.error(f"Ошибка запроса к DaData: {e!r}")
+                return None, False
+            finally:
+                self.request_time_total += time.perf_counter() - started
+            elapsed = time.perf_counter() - started
+            metrics.DADATA_SECONDS.observe(elapsed, 'ok' if response.status_code == 200 else 'http_error')
+
+        if response.status_code != 200:
+            self.errors += 1
+            self.breaker.record_failure()
+            logger.error(f"DaData ошибка {response.status_code}: {response.text}")
+            return None, False
+
+        try:
+            result = parse_suggestion(response.json())
+        except (ValueError, KeyError, TypeError) as e:
+            self.errors += 1
+            self.breaker.record_failure()
+            logger.error(f"Некорректный ответ DaData: {e!r}")
+            return None, False
+        self.breaker.record_success()
+        self._latencies.append(elapsed)
+        return result, True
+
+    def stats(self):
+        """Счётчики запросов к DaData"""
+        return {
+            'requests': self.requests,
+            'merged': self.merged,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'short_circuits': self.short_circuits,
+            'hedge_delay_ms': self.hedge_delay(self.budget) * 1000,
+            'in_flight': len(self._in_flight),
+            'request_time_avg_ms': (self.request_time_total / self.requests * 1000) if self.requests else 0.0,
+            **self.breaker.stats(),
+        }
+
+    async def close(self):
+        """Закрыть пул соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
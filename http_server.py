@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Максимальный размер тела запроса (обновления Telegram намного меньше)
+MAX_BODY_SIZE = 1024 * 1024
+
+STATUS_REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 429: 'Too Many Requests',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+async def read_http_request(reader):
+    """Прочитать один HTTP-запрос: (метод, путь, заголовки, тело) или None"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', '0'))
+    if length > MAX_BODY_SIZE:
+        raise ValueError(f'слишком большое тело запроса: {length}')
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+def write_http_response(writer, status, body, content_type='application/json'):
+    """Записать HTTP-ответ с keep-alive"""
+    reason = STATUS_REASONS.get(status, 'OK')
+    writer.write(
+        f'HTTP/1.1 {status} {reason}\r\n'
+        f'Content-Type: {content_type}; charset=utf-8\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f'Connection: keep-alive\r\n\r\n'.encode('latin-1') + body
+    )
+
+
+class HttpServer:
+    """Небольшой асинхронный HTTP-сервер на asyncio.
+
+    routes: путь -> async handler(method, headers, body), который
+    возвращает (статус, тело в bytes, content-type). Маршрут '*'
+    обрабатывает все остальные пути.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = 0
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Запустить сервер, вернуть фактический порт"""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_http_request(reader)
+                except ValueError:
+                    write_http_response(writer, 413, b'')
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                self.requests += 1
+
+                handler = self.routes.get(path.split('?', 1)[0]) or self.routes.get('*')
+                if handler is None:
+                    status, payload, content_type = 404, b'', 'text/plain'
+                else:
+                    try:
+                        status, payload, content_type = await handler(method, headers, body)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки HTTP-запроса {path}: {e}")
+                        status, payload, content_type = 500, b'', 'text/plain'
+
+                write_http_response(writer, status, payload, content_type)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
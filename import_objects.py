@@ -0,0 +1,347 @@
+"""Потоковый импорт справочника объектов из CSV или XLSX.
+
+    python import_objects.py contracts.csv
+    python import_objects.py contracts.xlsx --batch 5000
+    python import_objects.py contracts.csv --encoding cp1251 --delimiter ";"
+
+Файл читается по строкам, память не зависит от его размера. Строки
+проверяются и пачками вставляются или обновляются в objects (ключ -
+external_id: номер договора из файла или название+адрес). Поисковый
+индекс обновляют триггеры - только по изменённым строкам. После каждой
+пачки в той же транзакции сохраняется, сколько строк уже обработано,
+поэтому прерванный импорт продолжается с места остановки.
+XLSX требует openpyxl (pip install openpyxl).
+"""
+import os
+import csv
+import sys
+import time
+import logging
+import argparse
+
+import db
+from normalize import normalize_address, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк в одной транзакции
+IMPORT_BATCH_SIZE = 5000
+
+# Максимальная длина текстовых полей
+MAX_FIELD_LENGTH = 500
+
+# Заголовки колонок в файле -> поле objects (сравниваются после normalize_text)
+COLUMN_ALIASES = {
+    'external_id': ('external_id', 'id', 'код', 'номер договора', 'договор', 'contract'),
+    'name': ('name', 'название', 'наименование', 'объект'),
+    'address': ('address', 'адрес'),
+    'category': ('category', 'категория', 'тип'),
+    'notes': ('notes', 'примечание', 'примечания', 'заметки', 'комментарий'),
+    'lat': ('lat', 'latitude', 'широта'),
+    'lon': ('lon', 'lng', 'longitude', 'долгота'),
+}
+
+IMPORT_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS import_checkpoints (
+        source TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        rows_done INTEGER NOT NULL,
+        finished INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    )
+    ''',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_objects_external_id ON objects(external_id)',
+)
+
+# Обновляем только изменившиеся строки: иначе триггер зря переписал бы поисковый индекс.
+# Не UPSERT: внутри INSERT ... ON CONFLICT DO UPDATE SQLite не выполняет OR IGNORE
+# в триггерах (очереди пересчёта ключей), и повторная правка объекта падала бы
+UPDATE_SQL = '''
+    UPDATE objects SET name = ?, address = ?, category = ?, notes = ?, lat = ?, lon = ?
+    WHERE external_id = ? AND (name, address, category, notes, lat, lon) IS NOT (?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_SQL = '''
+    INSERT OR IGNORE INTO objects (external_id, name, address, category, notes, lat, lon)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def ensure_import_schema(conn):
+    """Колонка external_id в objects и таблица контрольных точек импорта"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(objects)')}
+    if 'external_id' not in columns:
+        conn.execute('ALTER TABLE objects ADD COLUMN external_id TEXT')
+    for statement in IMPORT_SCHEMA:
+        conn.execute(statement)
+
+
+db.register_schema(ensure_import_schema)
+
+
+class RowError(ValueError):
+    """Строка файла не прошла проверку"""
+
+
+def map_columns(header):
+    """Номер колонки для каждого поля objects по заголовку файла"""
+    normalized = [normalize_text(str(title or '')) for title in header]
+    mapping = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for index, title in enumerate(normalized):
+            if title in aliases:
+                mapping[field] = index
+                break
+    missing = {'name', 'address'} - set(mapping)
+    if missing:
+        raise ValueError(f"в файле нет колонок: {', '.join(sorted(missing))}")
+    return mapping
+
+
+def _text(value, field, required=False):
+    text = '' if value is None else str(value).strip()
+    if required and not text:
+        raise RowError(f"пустое поле {field}")
+    if len(text) > MAX_FIELD_LENGTH:
+        raise RowError(f"поле {field} длиннее {MAX_FIELD_LENGTH} символов")
+    return text or None
+
+
+def _coordinate(value, field, limit):
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        number = float(str(value).strip().replace(',', '.'))
+    except ValueError:
+        raise RowError(f"{field} не число: {value!r}")
+    if not -limit <= number <= limit:
+        raise RowError(f"{field} вне диапазона: {number}")
+    return number
+
+
+def validate_row(row, mapping):
+    """Строка файла -> (external_id, name, address, category, notes, lat, lon)"""
+    def get(field):
+        index = mapping.get(field)
+        return row[index] if index is not None and index < len(row) else None
+
+    name = _text(get('name'), 'name', required=True)
+    address = _text(get('address'), 'address', required=True)
+    lat = _coordinate(get('lat'), 'lat', 90)
+    lon = _coordinate(get('lon'), 'lon', 180)
+    if (lat is None) != (lon is None):
+        raise RowError("указана только одна координата")
+
+    external_id = _text(get('external_id'), 'external_id')
+    if external_id is None:
+        # Номера договора нет - объект определяется названием и адресом
+        external_id = f"{normalize_text(name)}|{normalize_address(address)}"
+    return (external_id, name, address, _text(get('category'), 'category'),
+            _text(get('notes'), 'notes'), lat, lon)
+
+
+def read_csv(path, encoding='utf-8-sig', delimiter=None):
+    """Строки CSV по одной (первая - заголовок)"""
+    with open(path, newline='', encoding=encoding) as f:
+        if delimiter is None:
+            sample = f.read(65536)
+            f.seek(0)
+            try:
+                delimiter = csv.Sniffer().sniff(sample, delimiters=';,\t').delimiter
+            except csv.Error:
+                delimiter = ';'
+        yield from csv.reader(f, delimiter=delimiter)
+
+
+def read_xlsx(path):
+    """Строки первого листа XLSX по одной (первая - заголовок)"""
+    try:
+        import openpyxl
+    except ImportError:
+        raise SystemExit("Для импорта XLSX установите openpyxl: pip install openpyxl")
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def read_rows(path, encoding='utf-8-sig', delimiter=None):
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        return read_xlsx(path)
+    return read_csv(path, encoding, delimiter)
+
+
+def backfill_external_ids(batch_size=IMPORT_BATCH_SIZE):
+    """Проставить ключ объектам, добавленным не импортом, чтобы импорт их обновлял, а не дублировал.
+
+    Объекты без ключа читаются пачками по id, в памяти - одна пачка. Ключ
+    уже занят (дубликат по названию и адресу или объект из импорта) -
+    UPDATE OR IGNORE по уникальному индексу оставляет объект без ключа,
+    ключ достаётся объекту с меньшим id.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        with db.write_transaction() as conn:
+            rows = conn.execute(
+                'SELECT id, name, address FROM objects WHERE external_id IS NULL AND id > ? ORDER BY id LIMIT ?',
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                return updated
+            for obj_id, name, address in rows:
+                key = f"{normalize_text(name or '')}|{normalize_address(address or '')}"
+                updated += conn.execute(
+                    'UPDATE OR IGNORE objects SET external_id = ? WHERE id = ?', (key, obj_id)).rowcount
+        last_id = rows[-1][0]
+
+
+def load_checkpoint(source, size, mtime):
+    """(строк обработано, импорт завершён) или (0, False), если файл новый или изменился"""
+    row = db.fetch_one('SELECT size, mtime, rows_done, finished FROM import_checkpoints WHERE source = ?',
+                       (source,))
+    if row is None or row[0] != size or row[1] != mtime:
+        return 0, False
+    return row[2], bool(row[3])
+
+
+def write_batch(batch, source, size, mtime, rows_done, finished=False):
+    """Записать пачку и контрольную точку одной транзакцией. Вернуть (новых, изменённых)"""
+    with db.write_transaction() as conn:
+        keys = list(batch)
+        existing = 0
+        # Сколько ключей уже есть - чтобы отличить новые объекты от обновлённых
+        for start in range(0, len(keys), 900):
+            chunk = keys[start:start + 900]
+            existing += conn.execute(
+                f"SELECT count(*) FROM objects WHERE external_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchone()[0]
+
+        # rowcount не учитывает изменения, сделанные триггерами поискового индекса
+        changed = conn.executemany(
+            UPDATE_SQL, [(*record[1:], record[0], *record[1:]) for record in batch.values()]).rowcount
+        changed += conn.executemany(INSERT_SQL, batch.values()).rowcount
+
+        conn.execute('''
+            INSERT INTO import_checkpoints (source, size, mtime, rows_done, finished, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET size = excluded.size, mtime = excluded.mtime,
+                rows_done = excluded.rows_done, finished = excluded.finished, updated_at = excluded.updated_at
+        ''', (source, size, mtime, rows_done, int(finished), time.time()))
+    inserted = len(batch) - existing
+    return inserted, changed - inserted
+
+
+def import_file(path, batch_size=IMPORT_BATCH_SIZE, encoding='utf-8-sig', delimiter=None,
+                rejects_path=None, force=False, progress=print):
+    """Импортировать файл, вернуть счётчики"""
+    source = os.path.abspath(path)
+    stat = os.stat(path)
+    skip, finished = (0, False) if force else load_checkpoint(source, stat.st_size, stat.st_mtime)
+    stats = {'rows': 0, 'skipped': skip, 'inserted': 0, 'updated': 0, 'unchanged': 0,
+             'rejected': 0, 'seconds': 0.0, 'rows_per_s': 0.0}
+    if finished:
+        progress(f"{path} уже импортирован (--force, чтобы импортировать заново)")
+        return stats
+    if skip:
+        progress(f"Продолжаю импорт {path} со строки {skip + 1}")
+
+    rows = read_rows(path, encoding, delimiter)
+    mapping = map_columns(next(rows, None) or [])
+
+    backfilled = backfill_external_ids(batch_size)
+    if backfilled:
+        progress(f"Ключи проставлены {backfilled} объектам, добавленным раньше")
+
+    rejects = rejects_writer = None
+    rejected_rows = []
+
+    started = time.perf_counter()
+    line = 0
+    batch = {}
+
+    def write_rejects():
+        nonlocal rejects, rejects_writer
+        if rejected_rows and rejects_path:
+            if rejects is None:
+                rejects = open(rejects_path, 'a' if skip else 'w', newline='', encoding='utf-8')
+                rejects_writer = csv.writer(rejects)
+            rejects_writer.writerows(rejected_rows)
+        rejected_rows.clear()
+
+    def flush(done=False):
+        inserted, updated = write_batch(batch, source, stat.st_size, stat.st_mtime, line, done)
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+        stats['unchanged'] += len(batch) - inserted - updated
+        batch.clear()
+        # Отклонённые строки пишем после фиксации пачки, чтобы при продолжении не повторить их
+        write_rejects()
+        elapsed = time.perf_counter() - started
+        progress(f"  {line} строк, {stats['rows'] / elapsed:.0f} строк/с")
+
+    try:
+        for row in rows:
+            line += 1
+            if line <= skip:
+                continue
+            stats['rows'] += 1
+            if not any(cell not in (None, '') for cell in row):
+                continue
+            try:
+                record = validate_row(row, mapping)
+            except RowError as e:
+                stats['rejected'] += 1
+                rejected_rows.append([line + 1, str(e)] + list(row))
+                continue
+            # Повтор ключа в одной пачке - берём последнюю строку
+            batch[record[0]] = record
+            if len(batch) >= batch_size:
+                flush()
+        flush(done=True)
+    finally:
+        if rejects:
+            rejects.close()
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['rows_per_s'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Импорт справочника объектов из CSV/XLSX')
+    parser.add_argument('path', help='файл CSV или XLSX (первая строка - заголовки)')
+    parser.add_argument('--batch', type=int, default=IMPORT_BATCH_SIZE, help='строк в транзакции')
+    parser.add_argument('--encoding', default='utf-8-sig', help='кодировка CSV (например, cp1251)')
+    parser.add_argument('--delimiter', help='разделитель CSV (по умолчанию определяется сам)')
+    parser.add_argument('--rejects', help='куда записать отклонённые строки (CSV)')
+    parser.add_argument('--force', action='store_true', help='импортировать заново, игнорируя контрольную точку')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    db.init_db()
+    rejects = args.rejects or args.path + '.rejects.csv'
+    try:
+        stats = import_file(args.path, args.batch, args.encoding, args.delimiter, rejects, args.force)
+    except KeyboardInterrupt:
+        print("⏸ Импорт прерван. Запустите ту же команду, чтобы продолжить.")
+        sys.exit(130)
+    except (OSError, ValueError, UnicodeDecodeError) as e:
+        print(f"❌ Ошибка импорта: {e}")
+        sys.exit(1)
+    finally:
+        db.close_all()
+
+    print(f"✅ Импорт завершён за {stats['seconds']:.1f} с ({stats['rows_per_s']:.0f} строк/с): "
+          f"новых {stats['inserted']}, обновлено {stats['updated']}, без изменений {stats['unchanged']}, "
+          f"отклонено {stats['rejected']}")
+    if stats['rejected']:
+        print(f"Отклонённые строки: {rejects}")
+
+
+if __name__ == '__main__':
+    main()
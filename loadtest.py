@@ -0,0 +1,487 @@
+"""Нагрузочный прогон обоих ботов: записанная смена на копии базы.
+
+Запись - в работающих ботах (recorder.py):
+    RECORD_UPDATES=shift.jsonl GBR_RECORD_UPDATES=shift_gbr.jsonl RECORD_SALT=соль python run_all.py
+
+Воспроизведение:
+    python loadtest.py shift.jsonl shift_gbr.jsonl --db objects.db --speed 10
+    python loadtest.py --synthetic 3000 --speed 20 --output load.json
+    python loadtest.py --synthetic 3000 --speed 20 --output new.json --compare load.json
+
+Обновления подаются в очереди настоящих Application обоих ботов с теми же
+промежутками, что в записи, ускоренными в speed раз (1-100). Bot API заменён
+имитацией (fake_telegram.py) с задержкой ответа и ответами 429, DaData -
+заглушкой. Псевдонимы из записи привязываются к экипажам рабочей копии
+базы, псевдоним диспетчера - к DISPATCHER_ID. Итог: сколько обновлений в
+секунду боты выдержали, задержка от подачи обновления до конца обработчика,
+время каждого обработчика и задержки цикла событий.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import argparse
+import functools
+from collections import Counter, defaultdict
+
+import bench_data
+import recorder
+from bench import REGRESSION_THRESHOLD, UpdateFactory, summarize
+
+logger = logging.getLogger(__name__)
+
+# Ускорение воспроизведения по умолчанию
+LOADTEST_SPEED = 1.0
+
+# Задержка ответа имитации Bot API (медиана, секунды) и её разброс
+TELEGRAM_LATENCY = 0.05
+TELEGRAM_JITTER = 0.5
+
+# Задержка ответа заглушки DaData, секунды
+DADATA_DELAY = 0.1
+
+# Как часто проверять задержку цикла событий, секунды
+LAG_INTERVAL = 0.01
+
+# Синтетическая смена: обновлений в секунду и доли видов (бот, вид, вес)
+SYNTHETIC_RATE = 2.0
+SYNTHETIC_MIX = (
+    ('dispatcher', 'find', 20),
+    ('dispatcher', 'select', 12),
+    ('dispatcher', 'send', 6),
+    ('dispatcher', 'address', 10),
+    ('dispatcher', 'status', 4),
+    ('gbr', 'status', 18),
+    ('gbr', 'location', 30),
+)
+CREW_BUTTONS = ('🔴 Занят', '🏁 Прибыл', '🟢 Свободен')
+
+# В --compare не считать регрессией рост p95, если он меньше этого, мс
+COMPARE_MIN_MS = 1.0
+
+
+def load_records(paths):
+    """Записи recorder.py из файлов: [(время, бот, обновление)] по времени"""
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records.append((record['at'], record['bot'], record['update']))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def synthetic_records(rng, count, rate, object_ids, crew_ids, queries):
+    """Синтетическая смена: count обновлений, в среднем rate в секунду"""
+    factory = UpdateFactory(recorder.ANON_DISPATCHER_ID)
+    crew_users = [recorder.ANON_ID_BASE + i for i in range(len(crew_ids))]
+    kinds = [(bot_name, kind) for bot_name, kind, weight in SYNTHETIC_MIX]
+    weights = [weight for bot_name, kind, weight in SYNTHETIC_MIX]
+
+    records, at = [], 0.0
+    for bot_name, kind in rng.choices(kinds, weights, k=count):
+        at += rng.expovariate(rate)
+        if kind == 'find':
+            update = factory.message(f'/find {rng.choice(queries)}')
+        elif kind == 'select':
+            update = factory.callback(f'select_{rng.choice(object_ids)}')
+        elif kind == 'send':
+            update = factory.callback(f'send_{rng.choice(crew_ids)}_{rng.choice(object_ids)}')
+        elif kind == 'address':
+            update = factory.message(f"{rng.choice(bench_data.STREETS)} {rng.randint(1, 150)}")
+        elif bot_name == 'dispatcher':
+            update = factory.message('/status')
+        elif kind == 'status':
+            update = factory.message(rng.choice(CREW_BUTTONS), rng.choice(crew_users))
+        else:
+            # Трансляция геопозиции: почти всё - edited_message
+            update = factory.location(
+                bench_data.CENTER_LAT + rng.uniform(-bench_data.SPREAD, bench_data.SPREAD),
+                bench_data.CENTER_LON + rng.uniform(-bench_data.SPREAD, bench_data.SPREAD) * 1.8,
+                rng.choice(crew_users), live=rng.random() < 0.9)
+        records.append((at, bot_name, update))
+    return records
+
+
+def sender_id(update):
+    """Telegram ID отправителя обновления или None"""
+    for field in ('message', 'edited_message', 'callback_query'):
+        if field in update:
+            return (update[field].get('from') or {}).get('id')
+    return None
+
+
+def bind_users(records, dispatcher_id):
+    """Привязать псевдонимы записи к экипажам базы.
+
+    Отправители по порядку появления получают telegram_id экипажей базы
+    (лишним экипажей не хватает - они останутся незарегистрированными),
+    псевдоним диспетчера заменяется на dispatcher_id. Возвращает записи
+    с заменой и число привязанных экипажей.
+    """
+    import db
+    from crews import registry
+
+    users = []
+    for at, bot_name, update in records:
+        user_id = sender_id(update)
+        if user_id is not None and user_id != recorder.ANON_DISPATCHER_ID and user_id not in users:
+            users.append(user_id)
+
+    crew_ids = [row[0] for row in db.fetch_all('SELECT id FROM gbr_crews ORDER BY id')]
+    pairs = [(str(user_id), crew_id) for user_id, crew_id in zip(users, crew_ids)]
+    with db.write_transaction() as conn:
+        conn.executemany('UPDATE gbr_crews SET telegram_id = NULL WHERE id = ?',
+                         [(crew_id,) for _, crew_id in pairs])
+        conn.executemany('UPDATE gbr_crews SET telegram_id = ? WHERE id = ?', pairs)
+    registry.invalidate()
+
+    def map_id(user_id):
+        return dispatcher_id if user_id == recorder.ANON_DISPATCHER_ID else user_id
+
+    records = [(at, bot_name, recorder.map_ids(update, map_id)) for at, bot_name, update in records]
+    return records, len(pairs)
+
+
+class LoopLagMonitor:
+    """Задержки цикла событий: насколько позже заказанного просыпается sleep"""
+
+    def __init__(self, interval=LAG_INTERVAL):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+
+class HandlerTimer:
+    """Время обработчиков и путь обновления от подачи в очередь до конца обработчика"""
+
+    def __init__(self):
+        # 'бот.обработчик' -> [секунды]
+        self.handlers = defaultdict(list)
+        # бот -> [секунды от подачи до конца обработчика]
+        self.updates = defaultdict(list)
+        # 'бот.обработчик: исключение' -> сколько раз
+        self.errors = Counter()
+        self.completed = 0
+        self.last_completed = None
+        # (бот, update_id) -> время подачи
+        self._queued = {}
+
+    def instrument(self, application, bot_name):
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                handler.callback = self._wrap(handler.callback, bot_name)
+
+    def queued(self, bot_name, update_id):
+        self._queued[(bot_name, update_id)] = time.perf_counter()
+
+    @property
+    def pending(self):
+        """Поданные, но ещё не обработанные обновления"""
+        return len(self._queued)
+
+    def _wrap(self, callback, bot_name):
+        name = f'{bot_name}.{callback.__name__}'
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception as e:
+                error = f'{name}: {type(e).__name__}'
+                if not self.errors[error]:
+                    logger.warning(f"Исключение в {name}: {e!r}")
+                self.errors[error] += 1
+                raise
+            finally:
+                finished = time.perf_counter()
+                self.handlers[name].append(finished - started)
+                queued = self._queued.pop((bot_name, update.update_id), None)
+                if queued is not None:
+                    self.updates[bot_name].append(finished - queued)
+                    self.completed += 1
+                    self.last_completed = finished
+
+        return wrapper
+
+
+async def replay(records, speed=LOADTEST_SPEED, telegram_options=None, dadata_delay=DADATA_DELAY):
+    """Подать записи в оба бота с ускорением speed, вернуть замеры"""
+    import bot
+    import gbr_bot
+    import geocoder
+    from fake_telegram import FAKE_TOKEN, FakeTelegramRequest
+    from stub_dadata import StubDaData
+    from telegram import Update
+
+    telegram_options = telegram_options or {}
+    seed = telegram_options.pop('seed', None)
+    requests = {
+        'dispatcher': FakeTelegramRequest(seed=seed, **telegram_options),
+        'gbr': FakeTelegramRequest(seed=None if seed is None else seed + 1, **telegram_options),
+    }
+    applications = {
+        'dispatcher': bot.build_application(token=FAKE_TOKEN, request=requests['dispatcher']),
+        'gbr': gbr_bot.build_application(token=FAKE_TOKEN, request=requests['gbr']),
+    }
+    timer = HandlerTimer()
+    for name, application in applications.items():
+        timer.instrument(application, name)
+
+    stub = StubDaData(delay=dadata_delay)
+    port = await stub.start()
+    bot.dadata_client = geocoder.DaDataGeocoder('loadtest', url=f'http://127.0.0.1:{port}/suggest')
+
+    for application in applications.values():
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+    lag = LoopLagMonitor()
+    await lag.start()
+
+    loop = asyncio.get_running_loop()
+    update_ids = Counter()
+    skipped = max_backlog = 0
+    first_at = records[0][0] if records else 0.0
+    started_at = loop.time()
+    started = time.perf_counter()
+    try:
+        for at, bot_name, data in records:
+            application = applications.get(bot_name)
+            if application is None:
+                skipped += 1
+                continue
+            delay = started_at + (at - first_at) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Свои update_id: в записи они могут повторяться после перезапуска бота
+            update_ids[bot_name] += 1
+            update = Update.de_json(dict(data, update_id=update_ids[bot_name]), application.bot)
+            timer.queued(bot_name, update.update_id)
+            await application.update_queue.put(update)
+            max_backlog = max(max_backlog, timer.pending)
+        queued = time.perf_counter()
+    finally:
+        # Остановка Application дожидается обработки всего, что уже в очереди
+        for application in applications.values():
+            await application.stop()
+        finished = time.perf_counter()
+        await lag.stop()
+        for application in applications.values():
+            await application.shutdown()
+            await application.post_shutdown(application)
+        await stub.stop()
+
+    total = sum(update_ids.values())
+    schedule = (records[-1][0] - first_at) / speed if records else 0.0
+    wall = finished - started
+    busy = (timer.last_completed - started) if timer.completed else 0.0
+    latency = {f'update.{name}': summarize(times, wall) for name, times in sorted(timer.updates.items())}
+    latency.update((f'handler.{name}', summarize(times, wall)) for name, times in sorted(timer.handlers.items()))
+    latency['loop_lag'] = summarize(lag.samples, wall)
+    return {
+        'updates': total,
+        'skipped': skipped,
+        'speed': speed,
+        'schedule_s': schedule,
+        'wall_s': wall,
+        'drain_s': finished - queued,
+        'offered_per_s': total / schedule if schedule else 0.0,
+        'sustained_per_s': timer.completed / busy if busy else 0.0,
+        'max_backlog': max_backlog,
+        'unhandled': timer.pending,
+        'latency': latency,
+        'errors': dict(timer.errors),
+        'telegram': {name: {'calls': dict(request.calls), 'throttled': dict(request.throttled)}
+                     for name, request in requests.items()},
+        'dadata_requests': stub.requests,
+    }
+
+
+def prepare_database(db_dir, source=None, objects=10000, crews=300, seed=1):
+    """Рабочая копия базы: прогон меняет статусы экипажей и журнал вызовов"""
+    os.makedirs(db_dir, exist_ok=True)
+    path = os.path.join(db_dir, 'loadtest.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    if source:
+        # backup, а не копирование файла: забирает и то, что ещё в WAL
+        with sqlite3.connect(source) as src, sqlite3.connect(path) as dst:
+            src.backup(dst)
+    else:
+        bench_data.generate_catalog(path, objects, crews, seed)
+    return path
+
+
+def run(args):
+    """Подготовить базу и записи, выполнить прогон"""
+    path = prepare_database(args.db_dir, args.db, args.objects, args.crews, args.seed)
+
+    # Настройки читаются модулями при импорте
+    os.environ['DB_PATH'] = path
+    os.environ['GEOCODE_WORKER'] = '0'
+    os.environ.setdefault('DADATA_API_KEY', 'loadtest')
+    for name in ('RECORD_UPDATES', 'GBR_RECORD_UPDATES', 'METRICS_PORT', 'GBR_METRICS_PORT'):
+        os.environ.pop(name, None)
+    import async_db
+    import bot  # noqa: F401 - регистрирует схемы модулей бота
+    import config
+    import db
+    import fuzzy_search
+    import gazetteer
+    import gbr_bot  # noqa: F401
+
+    # Журнал каждого обновления исказил бы замеры, а ошибки отправки под
+    # нагрузкой ожидаемы: ответы 429 и исключения попадают в итог прогона
+    logging.getLogger().setLevel(logging.CRITICAL)
+    logger.setLevel(logging.WARNING)
+
+    db.init_db()
+    # Ключи поиска и справочника адресов бот строит в фоне - здесь заранее
+    fuzzy_search.refresh_all()
+    gazetteer.refresh_all()
+
+    rng = random.Random(args.seed)
+    if args.synthetic:
+        object_ids = [row[0] for row in db.fetch_all('SELECT id FROM objects')]
+        crew_ids = [row[0] for row in db.fetch_all('SELECT id FROM gbr_crews ORDER BY id')]
+        records = synthetic_records(rng, args.synthetic, args.rate, object_ids, crew_ids,
+                                    bench_data.sample_queries(rng, 200))
+    else:
+        records = load_records(args.recordings)
+    records, bound = bind_users(records, config.DISPATCHER_ID)
+
+    telegram_options = {
+        'latency': args.telegram_latency,
+        'jitter': args.telegram_jitter,
+        'rate_limits': not args.no_telegram_limits,
+        'throttle_rate': args.throttle_rate,
+        'seed': args.seed,
+    }
+    try:
+        results = asyncio.run(replay(records, args.speed, telegram_options, args.dadata_delay))
+    finally:
+        async_db.shutdown()
+        db.close_all()
+    results['crews_bound'] = bound
+    return results
+
+
+def print_results(results):
+    print(f"\nОбновлений: {results['updates']} за {results['wall_s']:.1f} с "
+          f"(ускорение {results['speed']:g}x, экипажей привязано: {results['crews_bound']})")
+    print(f"Подавалось {results['offered_per_s']:.1f}/с, обработано {results['sustained_per_s']:.1f}/с, "
+          f"очередь до {results['max_backlog']}, дообработка после подачи {results['drain_s']:.2f} с, "
+          f"без обработчика {results['unhandled']}")
+    print(f"{'операция':<40} {'кол-во':>7} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'макс мс':>9}")
+    for name, stats in results['latency'].items():
+        print(f"{name:<40} {stats['count']:7d} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+              f"{stats['p99_ms']:9.2f} {stats['max_ms']:9.2f}")
+    for name, telegram in results['telegram'].items():
+        throttled = sum(telegram['throttled'].values())
+        print(f"Bot API ({name}): вызовов {sum(telegram['calls'].values())}, ответов 429: {throttled}")
+    for error, count in sorted(results['errors'].items()):
+        print(f"Исключение {error}: {count}")
+
+
+def compare(current, previous, threshold=REGRESSION_THRESHOLD):
+    """Сравнить p95 и пропускную способность с прошлым прогоном, вернуть регрессии"""
+    regressions = []
+    for name, stats in current['latency'].items():
+        old = previous.get('latency', {}).get(name)
+        if not old or not old.get('p95_ms') or not stats['count']:
+            continue
+        change = stats['p95_ms'] / old['p95_ms'] - 1
+        regressed = change > threshold and stats['p95_ms'] - old['p95_ms'] > COMPARE_MIN_MS
+        marker = ' <-- регрессия' if regressed else ''
+        print(f"{name:<40} p95 {old['p95_ms']:8.2f} -> {stats['p95_ms']:8.2f} мс ({change:+.0%}){marker}")
+        if regressed:
+            regressions.append((name, change))
+
+    old_rate = previous.get('sustained_per_s')
+    if old_rate:
+        change = current['sustained_per_s'] / old_rate - 1
+        marker = ' <-- регрессия' if change < -threshold else ''
+        print(f"{'обработано в секунду':<40} {old_rate:8.1f} -> {current['sustained_per_s']:8.1f} "
+              f"({change:+.0%}){marker}")
+        if marker:
+            regressions.append(('sustained_per_s', change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон записанных обновлений обоих ботов')
+    parser.add_argument('recordings', nargs='*', help='файлы записи recorder.py')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='вместо записи - синтетическая смена из стольких обновлений')
+    parser.add_argument('--rate', type=float, default=SYNTHETIC_RATE,
+                        help='обновлений в секунду в синтетической смене')
+    parser.add_argument('--speed', type=float, default=LOADTEST_SPEED, help='ускорение (1-100)')
+    parser.add_argument('--db', help='база, копия которой используется (по умолчанию синтетическая)')
+    parser.add_argument('--objects', type=int, default=10000, help='объектов в синтетической базе')
+    parser.add_argument('--crews', type=int, default=300, help='экипажей в синтетической базе')
+    parser.add_argument('--db-dir', default='loadtest_dbs', help='каталог рабочей копии базы')
+    parser.add_argument('--telegram-latency', type=float, default=TELEGRAM_LATENCY,
+                        help='медиана задержки ответа Bot API, секунды')
+    parser.add_argument('--telegram-jitter', type=float, default=TELEGRAM_JITTER,
+                        help='разброс задержки Bot API (0 - постоянная)')
+    parser.add_argument('--no-telegram-limits', action='store_true',
+                        help='не отвечать 429 сверх лимитов отправки Telegram')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='доля отправок, получающих 429 без причины')
+    parser.add_argument('--dadata-delay', type=float, default=DADATA_DELAY,
+                        help='задержка ответа заглушки DaData, секунды')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    parser.add_argument('--compare', help='прошлый результат для сравнения')
+    args = parser.parse_args()
+    if not args.recordings and not args.synthetic:
+        parser.error('нужны файлы записи или --synthetic')
+    if args.speed <= 0:
+        parser.error('--speed должен быть больше нуля')
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    results = run(args)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        if compare(results, previous):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
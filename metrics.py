@@ -0,0 +1,269 @@
+"""Метрики ботов в текстовом формате Prometheus.
+
+Гистограммы и счётчики живут в памяти процесса; запись - это блокировка,
+bisect и пара сложений, поэтому их можно вызывать на каждом запросе.
+Отдаются встроенным HTTP-сервером на METRICS_PORT (для бота ГБР -
+GBR_METRICS_PORT):
+
+    curl http://127.0.0.1:9100/metrics
+"""
+import os
+import time
+import bisect
+import logging
+import functools
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MetricsConfig = namedtuple('MetricsConfig', 'listen port')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Счётчик с метками"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Гистограмма с метками (кумулятивные корзины, как в Prometheus)"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (+ переполнение), сумма, количество]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """Замерить блок кода"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, (list(series[0]), series[1], series[2]))
+                           for labels, series in self._series.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(total)}')
+            lines.append(f'{self.name}_count{label_text} {count}')
+        return lines
+
+
+class Registry:
+    """Все метрики процесса и источники готовых счётчиков (stats())"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labelnames=()):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help_text, labelnames)
+            return self._metrics[name]
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help_text, labelnames, buckets)
+            return self._metrics[name]
+
+    def register_stats(self, prefix, stats_fn):
+        """Отдавать числовые поля stats_fn() как gauge {prefix}_{поле}"""
+        with self._lock:
+            self._stats[prefix] = stats_fn
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            stats = list(self._stats.items())
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in stats:
+            try:
+                values = stats_fn()
+            except Exception as e:
+                logger.error(f"Метрики: ошибка сбора {prefix}: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{prefix}_{key}'
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Метрики, которые пишут модули ботов
+HANDLER_SECONDS = registry.histogram(
+    'bot_handler_seconds', 'Время работы обработчика обновления', ('bot', 'handler'))
+HANDLER_ERRORS = registry.counter(
+    'bot_handler_errors_total', 'Исключения в обработчиках', ('bot', 'handler'))
+DB_CALL_SECONDS = registry.histogram(
+    'db_call_seconds', 'Время выполнения функции в пуле базы', ('function',))
+DB_QUEUE_WAIT_SECONDS = registry.histogram(
+    'db_queue_wait_seconds', 'Ожидание свободного потока пула базы')
+SQL_SECONDS = registry.histogram(
+    'sql_seconds', 'Время SQL-запроса или транзакции записи', ('operation',))
+DADATA_SECONDS = registry.histogram(
+    'dadata_request_seconds', 'Время запроса к DaData', ('outcome',))
+ALARM_DELIVERY_SECONDS = registry.histogram(
+    'alarm_delivery_seconds', 'От постановки тревоги в очередь до ответа Telegram', ('outcome',),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+
+def register_stats(prefix, stats_fn):
+    registry.register_stats(prefix, stats_fn)
+
+
+def render():
+    return registry.render()
+
+
+def timed_handler(callback, bot_name):
+    """Обёртка обработчика PTB, замеряющая его время"""
+    handler_name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(bot_name, handler_name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, bot_name, handler_name)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_handlers(application, bot_name):
+    """Замерять все обработчики, добавленные в application"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not getattr(handler.callback, 'timed', False):
+                handler.callback = timed_handler(handler.callback, bot_name)
+
+
+def config_from_env(prefix=''):
+    """Адрес сервера метрик из {prefix}METRICS_PORT / {prefix}METRICS_LISTEN или None"""
+    port = os.getenv(f'{prefix}METRICS_PORT')
+    if not port:
+        return None
+    return MetricsConfig(listen=os.getenv(f'{prefix}METRICS_LISTEN', '127.0.0.1'), port=int(port))
+
+
+async def _handle_metrics(method, headers, body):
+    if method != 'GET':
+        return 405, b'', 'text/plain'
+    return 200, render().encode('utf-8'), 'text/plain; version=0.0.4'
+
+
+# Один сервер на процесс: при совместном запуске его делят оба бота
+_server = None
+_server_users = 0
+
+
+async def start_server(config):
+    """Запустить сервер метрик (если config задан), вернуть порт"""
+    global _server, _server_users
+    if config is None:
+        return None
+    _server_users += 1
+    if _server is None:
+        _server = HttpServer({'/metrics': _handle_metrics})
+        port = await _server.start(config.listen, config.port)
+        _server.port = port
+        logger.info(f"Метрики: http://{config.listen}:{port}/metrics")
+    return _server.port
+
+
+async def stop_server(config):
+    """Остановить сервер метрик, когда он больше никому не нужен"""
+    global _server, _server_users
+    if config is None or _server is None:
+        return
+    _server_users -= 1
+    if _server_users <= 0:
+        await _server.stop()
+        _server = None
+        _server_users = 0
@@ -0,0 +1,125 @@
+import re
+
+# Всё, кроме букв, цифр и дефиса, превращаем в пробел
+_PUNCTUATION = re.compile(r'[^\w-]+|_')
+
+# Типы улиц приводим к одному сокращению
+STREET_TYPES = {
+    'улица': 'ул', 'ул': 'ул',
+    'проспект': 'пр-кт', 'пр-кт': 'пр-кт', 'пр-т': 'пр-кт', 'просп': 'пр-кт', 'пр': 'пр-кт',
+    'переулок': 'пер', 'пер': 'пер',
+    'площадь': 'пл', 'пл': 'пл',
+    'бульвар': 'б-р', 'б-р': 'б-р', 'бул': 'б-р',
+    'шоссе': 'ш', 'ш': 'ш',
+    'набережная': 'наб', 'наб': 'наб',
+    'проезд': 'пр-д', 'пр-д': 'пр-д',
+    'тупик': 'туп', 'туп': 'туп',
+    'микрорайон': 'мкр', 'мкр': 'мкр',
+}
+
+# Тип улицы по умолчанию: "Ленина 5" и "ул. Ленина, 5" - один адрес
+DEFAULT_STREET_TYPE = 'ул'
+
+# Слова перед номером дома, которые не несут смысла
+HOUSE_MARKERS = {'д', 'дом'}
+
+# Части адреса до улицы: город, район, регион ("с" и "п" не берём - это и "строение")
+LOCALITY_MARKERS = {
+    'г', 'город', 'гор', 'обл', 'область', 'край', 'респ', 'республика', 'р-н', 'район',
+    'пос', 'поселок', 'пгт', 'рп', 'село', 'деревня', 'мо', 'ао',
+}
+
+# Корпус и строение после номера дома: "5 корп 1" -> "5к1"
+HOUSE_PARTS = {'к': 'к', 'корп': 'к', 'корпус': 'к', 'стр': 'с', 'строение': 'с', 'с': 'с'}
+_HOUSE_PART = re.compile(r'^(к|корп|стр|с)(\d+)$')
+
+# Почтовый индекс
+_POSTCODE = re.compile(r'^\d{6}$')
+
+# Граница буквы и цифры: "склад5" -> "склад 5" ("№5" уже стал " 5")
+_LETTER_DIGIT = re.compile(r'(?<=[^\W\d])(?=\d)')
+
+
+def normalize_text(text):
+    """Нижний регистр, ё -> е, без знаков препинания и лишних пробелов"""
+    text = _PUNCTUATION.sub(' ', text.lower().replace('ё', 'е'))
+    # Дефис внутри сокращений (пр-кт, б-р) сохраняем, одиночные убираем
+    return ' '.join(word.strip('-') for word in text.split() if word.strip('-'))
+
+
+def normalize_address(text):
+    """Ключ адреса: "ул. Ленина, д. 5" и "Ленина 5" дают одно и то же"""
+    words = []
+    for word in normalize_text(text).split():
+        if word in HOUSE_MARKERS:
+            continue
+        street_type = STREET_TYPES.get(word)
+        if street_type == DEFAULT_STREET_TYPE:
+            continue
+        words.append(street_type or word)
+    return ' '.join(words)
+
+
+def search_words(text):
+    """Слова для нечёткого поиска: без типов улиц и "д.", цифры отдельно от букв"""
+    words = []
+    for word in _LETTER_DIGIT.sub(' ', normalize_text(text)).split():
+        if word in HOUSE_MARKERS or word in STREET_TYPES:
+            continue
+        # Слова индекса FTS5 делятся по дефису - так же делим и здесь
+        words.extend(part for part in word.split('-') if part)
+    return words
+
+
+def street_and_house(text):
+    """Улица (список слов) и номер дома из адреса или None, если номера нет.
+
+    "г. Москва, ул. Ленина, д. 5, корп. 1, кв. 3" -> (['ленина'], '5к1').
+    Части с городом и регионом пропускаются; тип улицы, кроме "ул",
+    ставится после названия: "пр-кт Мира" и "Мира проспект" совпадают.
+    """
+    words, starts = [], set()
+    for part in text.split(','):
+        part_words = [STREET_TYPES.get(word, word) for word in normalize_text(part).split()
+                      if word not in HOUSE_MARKERS]
+        if not part_words or any(word in LOCALITY_MARKERS for word in part_words):
+            continue
+        starts.add(len(words))
+        words.extend(part_words)
+
+    types = set(STREET_TYPES.values())
+    for i, word in enumerate(words):
+        if not word[0].isdigit() or _POSTCODE.match(word):
+            continue
+        # Улица - слова перед номером в пределах одной части адреса
+        # (или вся предыдущая часть: "ул. Ленина, 5")
+        begin = max((start for start in starts if start <= i), default=0)
+        if begin == i:
+            begin = max((start for start in starts if start < i), default=i)
+        name = [word for word in words[begin:i] if word not in types]
+        # "ул. 8 Марта, 14": восьмёрка - часть названия, а не дом
+        if not any(char.isalpha() for word in name for char in word):
+            continue
+        street = name + [word for word in words[begin:i] if word in types and word != DEFAULT_STREET_TYPE]
+        house = word
+        rest = words[i + 1:]
+        while rest:
+            match = _HOUSE_PART.match(rest[0])
+            if match:
+                house += HOUSE_PARTS[match.group(1)] + match.group(2)
+                rest = rest[1:]
+            elif rest[0] in HOUSE_PARTS and len(rest) > 1 and rest[1].isdigit():
+                house += HOUSE_PARTS[rest[0]] + rest[1]
+                rest = rest[2:]
+            elif len(rest[0]) == 1 and rest[0].isalpha():
+                # "5 а" -> "5а"
+                house += rest[0]
+                rest = rest[1:]
+            elif rest[0].isdigit() and len(rest[0]) <= 3:
+                # "5/2" после нормализации - "5 2"
+                house += '/' + rest[0]
+                rest = rest[1:]
+            else:
+                break
+        return street, house
+    return None
@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+
+import async_db
+import db
+import dispatch
+import dispatch_log
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений забирать из очереди за раз
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '20'))
+
+# Как часто проверять очередь, если новых сообщений не было, секунды
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1'))
+
+# Повторы: 2, 4, 8 ... секунд, но не больше OUTBOX_MAX_BACKOFF
+OUTBOX_BASE_BACKOFF = float(os.getenv('OUTBOX_BASE_BACKOFF', '2'))
+OUTBOX_MAX_BACKOFF = float(os.getenv('OUTBOX_MAX_BACKOFF', '300'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+
+# Через сколько секунд взятое в отправку, но не завершённое сообщение
+# снова считается ждущим (пачка упала между отправкой и записью итогов)
+OUTBOX_SENDING_TIMEOUT = float(os.getenv('OUTBOX_SENDING_TIMEOUT', '120'))
+
+OUTBOX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    chat_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    options TEXT,
+    crew_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at);
+'''
+
+
+def ensure_outbox_table(conn):
+    """Создать таблицу исходящих сообщений"""
+    for statement in OUTBOX_SCHEMA.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+
+
+db.register_schema(ensure_outbox_table)
+
+
+def backoff_delay(attempts):
+    """Пауза перед следующей попыткой (экспоненциальная)"""
+    return min(OUTBOX_BASE_BACKOFF * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF)
+
+
+def enqueue(idempotency_key, chat_id, text, options=None, crew_id=None, object_id=None):
+    """Положить сообщение в очередь. Вернуть (id, новое ли сообщение, статус).
+
+    Сообщение с тем же ключом, которое не удалось доставить (failed),
+    ставится в очередь заново. Тревога экипажу (crew_id) в той же
+    транзакции записывается в журнал вызовов.
+    """
+    now = time.time()
+    with db.write_transaction() as conn:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO outbox
+                (idempotency_key, chat_id, text, options, crew_id, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (idempotency_key, str(chat_id), text, json.dumps(options or {}), crew_id, now, now))
+        if cursor.rowcount:
+            outbox_id = cursor.lastrowid
+        else:
+            outbox_id, status = conn.execute(
+                'SELECT id, status FROM outbox WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+            if status != 'failed':
+                return outbox_id, False, status
+            conn.execute('''
+                UPDATE outbox SET chat_id = ?, text = ?, options = ?, crew_id = ?, status = 'pending',
+                    attempts = 0, next_attempt_at = ?, created_at = ?, sent_at = NULL, last_error = NULL
+                WHERE id = ?
+            ''', (str(chat_id), text, json.dumps(options or {}), crew_id, now, now, outbox_id))
+        if crew_id is not None:
+            dispatch_log.apply_event(conn, now, 'dispatch', crew_id, object_id)
+        return outbox_id, True, 'pending'
+
+
+def claim_batch(limit=OUTBOX_BATCH_SIZE):
+    """Забрать пачку сообщений, которые пора отправлять.
+
+    Взятое сообщение получает срок OUTBOX_SENDING_TIMEOUT в next_attempt_at:
+    если итоги пачки так и не записаны, по его истечении сообщение снова
+    попадёт в пачку.
+    """
+    now = time.time()
+    with db.write_transaction() as conn:
+        return conn.execute('''
+            UPDATE outbox SET status = 'sending', next_attempt_at = ?
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?
+            )
+            RETURNING id, chat_id, text, options, crew_id, attempts, created_at
+        ''', (now + OUTBOX_SENDING_TIMEOUT, now, limit)).fetchall()
+
+
+def delivery_outcome(row, result):
+    """Что делать с сообщением после попытки: sent, throttled, retry или failed.
+
+    throttled - Telegram просит подождать (429): повтор через retry_after,
+    попытка не засчитывается.
+    """
+    if result['ok']:
+        return 'sent'
+    if result.get('retry_after') is not None:
+        return 'throttled'
+    if result['permanent'] or row[5] + 1 >= OUTBOX_MAX_ATTEMPTS:
+        return 'failed'
+    return 'retry'
+
+
+def complete_batch(results):
+    """Записать итоги отправки пачки одной транзакцией.
+
+    results - список (строка очереди, результат dispatch.send_message).
+    Экипажам, которым вызов доставлен, ставится статус busy; он же
+    записывается в журнал вызовов.
+    """
+    now = time.time()
+    sent, retry, failed, busy_crews = [], [], [], []
+    for row, result in results:
+        outbox_id, crew_id, attempts = row[0], row[4], row[5] + 1
+        outcome = delivery_outcome(row, result)
+        if outcome == 'sent':
+            sent.append((now, attempts, outbox_id))
+            if crew_id is not None:
+                busy_crews.append((datetime.now(), crew_id))
+        elif outcome == 'failed':
+            failed.append((attempts, result['error'], outbox_id))
+        elif outcome == 'throttled':
+            retry.append((row[5], now + result['retry_after'], result['error'], outbox_id))
+        else:
+            retry.append((attempts, now + backoff_delay(attempts), result['error'], outbox_id))
+
+    with db.write_transaction() as conn:
+        conn.executemany(
+            "UPDATE outbox SET status = 'sent', sent_at = ?, attempts = ?, last_error = NULL WHERE id = ?", sent)
+        conn.executemany(
+            "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            retry)
+        conn.executemany(
+            "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?", failed)
+        conn.executemany(
+            "UPDATE gbr_crews SET status = 'busy', last_active = ? WHERE id = ?", busy_crews)
+        for last_active, crew_id in busy_crews:
+            dispatch_log.apply_event(conn, now, 'busy', crew_id)
+    return len(sent), len(retry), len(failed)
+
+
+def recover():
+    """После перезапуска вернуть в очередь сообщения, отправка которых прервалась"""
+    with db.write_transaction() as conn:
+        return conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'").rowcount
+
+
+def pending_count():
+    """Сколько сообщений ждут отправки"""
+    return db.fetch_one("SELECT count(*) FROM outbox WHERE status IN ('pending', 'sending')")[0]
+
+
+class OutboxWorker:
+    """Фоновая доставка сообщений из таблицы outbox.
+
+    Обработчик кладёт сообщение в очередь (send) и может дождаться
+    доставки; если не дождался, сообщение всё равно будет доставлено -
+    с повторами, а после перезапуска бота - при старте. Сообщение, застрявшее
+    в статусе sending, возвращается в пачку через OUTBOX_SENDING_TIMEOUT.
+    """
+
+    def __init__(self, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.bot = None
+        self._task = None
+        self._wakeup = None
+        # id сообщения -> future с результатом доставки
+        self._waiters = {}
+        # Статистика
+        self.enqueued = 0
+        self.duplicates = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.busy_time = 0.0
+
+    async def start(self, bot):
+        """Запустить доставку (при старте бота)"""
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        recovered = await async_db.write(recover)
+        if recovered:
+            logger.info(f"Outbox: {recovered} прерванных сообщений возвращены в очередь")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить доставку; недоставленное останется в базе"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def send(self, idempotency_key, chat_id, text, options=None, crew_id=None, wait=None,
+                   object_id=None):
+        """Поставить сообщение в очередь.
+
+        Если wait задан, дождаться доставки не дольше wait секунд и вернуть
+        результат dispatch.send_message; иначе (или по истечении) - None.
+        Повторный ключ не создаёт второго сообщения: возвращается результат
+        с duplicate=True и статусом первого (sent, pending, sending). Ключ,
+        сообщение которого не доставлено (failed), ставится в очередь заново.
+        object_id - объект тревоги для журнала вызовов (вместе с crew_id).
+        """
+        outbox_id, created, status = await async_db.write(
+            enqueue, idempotency_key, chat_id, text, options, crew_id, object_id)
+        if not created:
+            # Повтор ключа: вернуть, что стало с первым сообщением
+            self.duplicates += 1
+            logger.info(f"Outbox: сообщение {idempotency_key} уже в очереди ({status})")
+            return {'chat_id': str(chat_id), 'ok': status == 'sent', 'duplicate': True, 'status': status,
+                    'latency': None, 'error': None if status == 'sent' else 'уже в очереди',
+                    'permanent': False}
+
+        self.enqueued += 1
+        future = None
+        if wait:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[outbox_id] = future
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+        if future is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), wait)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._waiters.pop(outbox_id, None)
+
+    async def _run(self):
+        while True:
+            try:
+                delivered = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox: ошибка доставки: {e}")
+                delivered = 0
+
+            if delivered < self.batch_size:
+                # Очередь пуста - ждём нового сообщения или следующей проверки
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_batch(self):
+        """Доставить одну пачку, вернуть её размер"""
+        batch = await async_db.write(claim_batch, self.batch_size)
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self._deliver(row) for row in batch))
+        sent, retry, failed = await async_db.write(complete_batch, list(zip(batch, results)))
+        self.busy_time += time.perf_counter() - started
+
+        self.batches += 1
+        self.delivered += sent
+        self.retried += retry
+        self.failed += failed
+
+        now = time.time()
+        for row, result in zip(batch, results):
+            outcome = delivery_outcome(row, result)
+            if outcome in ('sent', 'failed'):
+                metrics.ALARM_DELIVERY_SECONDS.observe(now - row[6], outcome)
+                future = self._waiters.get(row[0])
+                if future is not None and not future.done():
+                    future.set_result(result)
+        return len(batch)
+
+    async def _deliver(self, row):
+        outbox_id, chat_id, text, options, crew_id, attempts, created_at = row
+        return await dispatch.send_message(self.bot, chat_id, text, **json.loads(options or '{}'))
+
+    def stats(self):
+        """Счётчики очереди и пропускная способность доставки"""
+        return {
+            'enqueued': self.enqueued,
+            'duplicates': self.duplicates,
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'failed': self.failed,
+            'batches': self.batches,
+            'throughput_per_s': (self.delivered / self.busy_time) if self.busy_time else 0.0,
+        }
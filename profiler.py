@@ -0,0 +1,309 @@
+"""Профилирование работающего бота без перезапуска.
+
+Запуск: команда /profile [секунды] у диспетчера или сигнал SIGUSR1
+(kill -USR1 <pid>). Раз в PROFILE_INTERVAL секунд снимаются стеки всех
+потоков - цикла событий и пула базы. Результат пишется в PROFILE_DIR:
+    profile_<время>.collapsed           - стеки для flamegraph.pl / speedscope
+    profile_<время>_blocking.collapsed  - стеки, пока цикл событий стоял
+    profile_<время>.txt                 - сводка по обработчикам и функциям
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import inspect
+import logging
+import weakref
+import threading
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Интервал между снимками стеков, секунды
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.01'))
+
+# Длительность профилирования по умолчанию и максимальная, секунды
+PROFILE_SECONDS = int(os.getenv('PROFILE_SECONDS', '30'))
+PROFILE_MAX_SECONDS = 300
+
+# Цикл событий, не отвечающий дольше этого, считается заблокированным, секунды
+PROFILE_BLOCK_THRESHOLD = float(os.getenv('PROFILE_BLOCK_THRESHOLD', '0.05'))
+
+# Каталог для файлов профиля
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+# Сколько строк в каждом разделе сводки
+PROFILE_TOP = 15
+
+# Как часто цикл событий отмечается во время профилирования, секунды
+HEARTBEAT_INTERVAL = 0.005
+
+# Последний кадр потока, который ничего не делает (ждёт задание или событие)
+IDLE_FRAMES = {
+    ('_worker', 'thread.py'),
+    ('select', 'selectors.py'),
+    ('wait', 'threading.py'),
+}
+
+NO_HANDLER = '(вне обработчиков)'
+
+
+def handler_codes(application):
+    """Код обработчиков приложения -> имя, чтобы помечать им выборки"""
+    codes = {}
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = inspect.unwrap(handler.callback)
+            code = getattr(callback, '__code__', None)
+            if code is not None:
+                codes[code] = callback.__name__
+    return codes
+
+
+class SamplingProfiler:
+    """Семплирующий профайлер всех потоков процесса.
+
+    Отдельный поток снимает sys._current_frames(); выборки цикла событий
+    помечаются обработчиком, выполнявшимся в этот момент, выборки пула
+    базы - функцией, которую выполнял поток. Пока цикл событий не успевает
+    отметиться дольше block_threshold, его стеки считаются отдельно.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL, block_threshold=PROFILE_BLOCK_THRESHOLD, handlers=None):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.handlers = handlers or {}
+        # "поток;метка;кадры" -> число выборок
+        self.stacks = Counter()
+        self.blocking = Counter()
+        # (поток, метка) -> число выборок
+        self.tags = Counter()
+        self.blocking_tags = Counter()
+        # Собственное время функций (последний кадр) в активных выборках
+        self.leaves = Counter()
+        self.ticks = 0
+        self.loop_busy = 0
+        self.blocked_ticks = 0
+        self.block_episodes = 0
+        self.max_block = 0.0
+        self.duration = 0.0
+        self._labels = {}
+        self._thread_names = {}
+        self._loop_thread = None
+        self._heartbeat = 0.0
+        self._blocked = False
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+            self._labels[code] = label
+        return label
+
+    def _thread_name(self, ident):
+        name = self._thread_names.get(ident)
+        if name is None:
+            self._thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            name = self._thread_names.get(ident, str(ident))
+        if ident == self._loop_thread:
+            return 'event-loop'
+        return name
+
+    def _walk(self, frame):
+        """Кадры от внешнего к внутреннему и метка выборки"""
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+
+        tag = None
+        for index, code in enumerate(codes):
+            handler = self.handlers.get(code)
+            if handler is not None:
+                tag = handler
+                break
+            if code.co_name == '_timed_call' and index + 1 < len(codes):
+                tag = f"db:{codes[index + 1].co_name}"
+                break
+        return codes, tag
+
+    def sample(self):
+        """Снять стеки всех потоков один раз"""
+        own = threading.get_ident()
+        lag = time.perf_counter() - self._heartbeat
+        blocked = lag > self.block_threshold + HEARTBEAT_INTERVAL
+        self.ticks += 1
+        if blocked:
+            self.blocked_ticks += 1
+            self.max_block = max(self.max_block, lag)
+            if not self._blocked:
+                self.block_episodes += 1
+        self._blocked = blocked
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            leaf = frame.f_code
+            if (leaf.co_name, os.path.basename(leaf.co_filename)) in IDLE_FRAMES:
+                continue
+
+            codes, tag = self._walk(frame)
+            thread = self._thread_name(ident)
+            tag = tag or NO_HANDLER
+            stack = ';'.join([thread, tag] + [self._label(code) for code in codes])
+            self.stacks[stack] += 1
+            if thread == 'event-loop':
+                kind = 'event-loop'
+            else:
+                kind = 'db' if thread.startswith('db') else 'other'
+            self.tags[(kind, tag)] += 1
+            self.leaves[self._label(leaf)] += 1
+            if ident == self._loop_thread:
+                self.loop_busy += 1
+                if blocked:
+                    self.blocking[stack] += 1
+                    self.blocking_tags[tag] += 1
+
+    def _sample_loop(self, stop):
+        while not stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Профайлер: ошибка снимка стеков: {e}")
+
+    async def run(self, seconds):
+        """Профилировать процесс seconds секунд"""
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        stop = threading.Event()
+        thread = threading.Thread(target=self._sample_loop, args=(stop,), name='profiler', daemon=True)
+
+        started = time.perf_counter()
+        thread.start()
+        deadline = loop.time() + seconds
+        try:
+            while loop.time() < deadline:
+                self._heartbeat = time.perf_counter()
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+        finally:
+            stop.set()
+            thread.join()
+            self.duration = time.perf_counter() - started
+
+    def summary(self, top=PROFILE_TOP):
+        """Текстовая сводка профиля"""
+        ms = self.interval * 1000
+        lines = [
+            f"Профиль за {self.duration:.1f} с: {self.ticks} снимков раз в {ms:.0f} мс",
+            f"Цикл событий занят: {self.loop_busy / self.ticks:.1%}" if self.ticks else "Цикл событий занят: -",
+            f"Блокировки цикла > {self.block_threshold * 1000:.0f} мс: {self.block_episodes}, "
+            f"всего ~{self.blocked_ticks * ms:.0f} мс, максимум {self.max_block * 1000:.0f} мс",
+        ]
+
+        def section(title, counter):
+            lines.append('')
+            lines.append(title)
+            total = sum(counter.values())
+            if not total:
+                lines.append('  -')
+                return
+            for name, count in counter.most_common(top):
+                lines.append(f"  {count * ms:8.0f} мс {count / total:6.1%}  {name}")
+
+        section('Цикл событий по обработчикам:', Counter(
+            {tag: count for (thread, tag), count in self.tags.items() if thread == 'event-loop'}))
+        section('Пул базы по функциям:', Counter(
+            {tag: count for (thread, tag), count in self.tags.items() if thread == 'db'}))
+        section('Собственное время функций (все потоки):', self.leaves)
+        section('Блокировки цикла по обработчикам:', self.blocking_tags)
+        section('Блокировки цикла - самые частые стеки (внутренние кадры):', Counter({
+            ' <- '.join(stack.split(';')[:1:-1][:4]): count for stack, count in self.blocking.items()}))
+        return '\n'.join(lines)
+
+    def write(self, directory=PROFILE_DIR):
+        """Записать файлы профиля, вернуть (сводка, collapsed, blocking)"""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        paths = (base + '.txt', base + '.collapsed', base + '_blocking.collapsed')
+        with open(paths[0], 'w', encoding='utf-8') as f:
+            f.write(self.summary() + '\n')
+        for path, counter in ((paths[1], self.stacks), (paths[2], self.blocking)):
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in counter.most_common():
+                    f.write(f"{stack} {count}\n")
+        return paths
+
+
+# Идёт ли сейчас профилирование (одновременно - только одно)
+_active = False
+
+
+def is_active():
+    return _active
+
+
+async def profile(seconds=PROFILE_SECONDS, handlers=None):
+    """Профилировать процесс и записать файлы. Вернуть (профайлер, пути)"""
+    global _active
+    if _active:
+        raise RuntimeError('профилирование уже идёт')
+    _active = True
+    try:
+        profiler = SamplingProfiler(handlers=handlers)
+        await profiler.run(min(seconds, PROFILE_MAX_SECONDS))
+        paths = profiler.write()
+    finally:
+        _active = False
+    logger.info(f"Профиль записан: {paths[0]}\n{profiler.summary()}")
+    return profiler, paths
+
+
+# Приложения, запущенные в цикле событий: цикл -> список приложений
+_applications = weakref.WeakKeyDictionary()
+
+
+def running_handler_codes(application=None):
+    """Код обработчиков всех приложений текущего цикла (и application) -> имя.
+
+    При совместном запуске оба бота работают в одном цикле, и профиль
+    должен помечать обработчики обоих.
+    """
+    applications = list(_applications.get(asyncio.get_running_loop(), ()))
+    if application is not None and application not in applications:
+        applications.append(application)
+    codes = {}
+    for app in applications:
+        codes.update(handler_codes(app))
+    return codes
+
+
+def install_signal_handler(application, seconds=PROFILE_SECONDS):
+    """Профилировать по SIGUSR1 (результат - в файлах и в журнале).
+
+    Обработчик сигнала ставится один раз на цикл событий: повторный вызов
+    из второго бота того же процесса только добавляет его приложение.
+    """
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+    loop = asyncio.get_running_loop()
+    applications = _applications.get(loop)
+    if applications is not None:
+        if application not in applications:
+            applications.append(application)
+        return
+
+    def start():
+        if _active:
+            logger.warning("Профилирование уже идёт")
+            return
+        asyncio.ensure_future(profile(seconds, running_handler_codes()))
+
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, start)
+    except (NotImplementedError, RuntimeError):
+        return
+    _applications[loop] = [application]
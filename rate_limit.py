@@ -0,0 +1,96 @@
+import os
+import time
+import asyncio
+
+# Лимиты Telegram Bot API: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_PER_CHAT_RATE = float(os.getenv('TELEGRAM_PER_CHAT_RATE', '1'))
+
+# Допустимый всплеск сообщений в один чат
+TELEGRAM_PER_CHAT_BURST = int(os.getenv('TELEGRAM_PER_CHAT_BURST', '3'))
+
+# Через сколько секунд простоя забывать корзину чата
+IDLE_BUCKET_TTL = 600
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity сразу"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        """Взять токен без ожидания (True - получилось)"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """Сколько секунд ждать следующего токена"""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        """Дождаться и взять токен, вернуть время ожидания в секундах"""
+        started = time.monotonic()
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+        return time.monotonic() - started
+
+    def penalize(self, seconds):
+        """Не выдавать токены ближайшие seconds секунд (ответ 429 от Telegram)"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class TelegramRateLimiter:
+    """Общий лимит на бота плюс отдельная корзина на каждый чат"""
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, per_chat_rate=TELEGRAM_PER_CHAT_RATE,
+                 per_chat_burst=TELEGRAM_PER_CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self._chats = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            self._forget_idle()
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _forget_idle(self):
+        now = time.monotonic()
+        idle = [chat_id for chat_id, bucket in self._chats.items()
+                if now - bucket.updated_at > IDLE_BUCKET_TTL]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    async def acquire(self, chat_id):
+        """Дождаться права отправить сообщение в чат, вернуть время ожидания"""
+        waited = await self._chat_bucket(chat_id).acquire()
+        waited += await self.global_bucket.acquire()
+        return waited
+
+    def chat_wait(self, chat_id):
+        """Сколько секунд ждать права отправить в чат (без общего лимита)"""
+        bucket = self._chats.get(chat_id)
+        return bucket.wait_time() if bucket is not None else 0.0
+
+    def retry_after(self, chat_id, seconds):
+        """Учесть ответ 429: в этот чат ничего не отправляем seconds секунд"""
+        self._chat_bucket(chat_id).penalize(seconds)
@@ -0,0 +1,150 @@
+"""Запись входящих обновлений Telegram для нагрузочного прогона (loadtest.py).
+
+Включается переменной RECORD_UPDATES=путь (для бота ГБР - GBR_RECORD_UPDATES).
+Каждое обновление пишется строкой JSON: время получения, бот и само
+обновление. Telegram ID, имена, логины и телефоны в нём заменены
+псевдонимами. Псевдоним - HMAC от ID с солью RECORD_SALT (по умолчанию
+случайной на процесс), поэтому один человек в записи - один псевдоним,
+а по записи его не найти. Диспетчер получает псевдоним ANON_DISPATCHER_ID.
+Тексты сообщений и координаты сохраняются - без них прогон не похож
+на настоящую смену.
+"""
+import os
+import hmac
+import json
+import time
+import hashlib
+import logging
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# Соль псевдонимов: одинаковая соль у обоих ботов даёт одинаковые псевдонимы
+RECORD_SALT = os.getenv('RECORD_SALT', '')
+
+# Соль, если RECORD_SALT не задана: одна на процесс, чтобы при совместном
+# запуске у обоих ботов псевдонимы совпадали
+_PROCESS_SALT = os.urandom(16)
+
+# Псевдоним диспетчера; при воспроизведении заменяется на DISPATCHER_ID
+ANON_DISPATCHER_ID = 1000
+
+# Псевдонимы остальных: ANON_ID_BASE + хэш по модулю ANON_ID_RANGE
+ANON_ID_BASE = 10 ** 9
+ANON_ID_RANGE = 10 ** 9
+
+# Группа обработчиков записи - раньше всех остальных
+RECORD_GROUP = -200
+
+# Поля, в которых лежат пользователь или чат
+PERSON_FIELDS = {
+    'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat',
+    'via_bot', 'new_chat_members', 'left_chat_member', 'new_chat_member', 'old_chat_member', 'contact',
+}
+
+# Поля, которые удаляются целиком
+DROP_FIELDS = {'username', 'last_name', 'phone_number', 'bio', 'vcard', 'language_code'}
+
+
+def make_pseudonym(salt, dispatcher_id=None):
+    """Функция ID -> псевдоним (знак ID групповых чатов сохраняется)"""
+    def pseudonym(user_id):
+        if dispatcher_id is not None and user_id == dispatcher_id:
+            return ANON_DISPATCHER_ID
+        digest = hmac.new(salt, str(abs(user_id)).encode(), hashlib.sha256).hexdigest()
+        value = ANON_ID_BASE + int(digest[:15], 16) % ANON_ID_RANGE
+        return -value if user_id < 0 else value
+    return pseudonym
+
+
+def map_ids(value, map_id, scrub=False, field=None):
+    """Копия обновления с ID пользователей и чатов, пропущенными через map_id.
+
+    scrub=True - заодно убрать имена, логины и телефоны.
+    """
+    if isinstance(value, list):
+        return [map_ids(item, map_id, scrub, field) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    person = field in PERSON_FIELDS
+    result = {}
+    for key, item in value.items():
+        if scrub and key in DROP_FIELDS:
+            continue
+        if key == 'id' and person and isinstance(item, int):
+            item = map_id(item)
+        elif key == 'user_id' and isinstance(item, int):
+            item = map_id(item)
+        elif scrub and key == 'chat_instance':
+            item = str(map_id(int(item))) if item.lstrip('-').isdigit() else ''
+        elif scrub and person and key == 'first_name':
+            item = 'Пользователь'
+        elif scrub and person and key == 'title':
+            item = 'Чат'
+        else:
+            item = map_ids(item, map_id, scrub, key)
+        result[key] = item
+    return result
+
+
+def anonymize_update(data, pseudonym):
+    """Обновление (dict) без настоящих ID и личных данных"""
+    return map_ids(data, pseudonym, scrub=True)
+
+
+class UpdateRecorder:
+    """Пишет обновления одного бота в файл, строка JSON на обновление"""
+
+    def __init__(self, path, bot_name, dispatcher_id=None, salt=RECORD_SALT):
+        self.path = path
+        self.bot_name = bot_name
+        self._pseudonym = make_pseudonym(salt.encode() if salt else _PROCESS_SALT, dispatcher_id)
+        # Построчная буферизация: запись не теряется при падении бота
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+        self.recorded = 0
+        self.errors = 0
+
+    async def record(self, update, context):
+        self.write(update.to_dict())
+
+    def write(self, data):
+        """Записать обновление (dict в формате Bot API)"""
+        line = json.dumps({
+            'at': round(time.time(), 3),
+            'bot': self.bot_name,
+            'update': anonymize_update(data, self._pseudonym),
+        }, ensure_ascii=False)
+        try:
+            self._file.write(line + '\n')
+            self.recorded += 1
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            if self.errors == 1:
+                logger.error(f"Запись обновлений в {self.path} не удалась: {e}")
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            logger.info(f"Записано обновлений ({self.bot_name}): {self.recorded} в {self.path}")
+
+
+def install(application, bot_name, dispatcher_id=None, prefix=''):
+    """Записывать обновления application, если задан {prefix}RECORD_UPDATES"""
+    path = os.getenv(f'{prefix}RECORD_UPDATES')
+    if not path:
+        return None
+    recorder = UpdateRecorder(path, bot_name, dispatcher_id)
+    application.add_handler(TypeHandler(Update, recorder.record), group=RECORD_GROUP)
+    application.bot_data['update_recorder'] = recorder
+    logger.info(f"Обновления {bot_name} записываются в {path}")
+    return recorder
+
+
+def close(application):
+    """Закрыть файл записи при остановке бота"""
+    recorder = application.bot_data.pop('update_recorder', None)
+    if recorder is not None:
+        recorder.close()
@@ -0,0 +1,279 @@
+"""Отчёт по вызовам ГБР за период: время реагирования, объекты, часы.
+
+    python report.py --days 7
+    python report.py --days 365 --csv report.csv
+
+Отчёт строится только по свёрткам журнала вызовов (dispatch_log):
+гистограммам времени реагирования экипажей, счётчикам вызовов по объектам
+и по часам. Целые месяцы периода читаются из месячных свёрток, дни по краям
+- из дневных. Перцентили считаются оконными функциями по накопленной сумме
+корзин, поэтому отчёт за год читает около сотни тысяч строк свёрток, а не
+миллионы событий.
+"""
+import io
+import os
+import csv
+import logging
+import argparse
+from datetime import date, datetime, timedelta
+
+import db
+from crews import get_crew_status
+from dispatch_log import RESPONSE_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# Период отчёта по умолчанию и наибольший, дни
+REPORT_DAYS = int(os.getenv('REPORT_DAYS', '7'))
+REPORT_MAX_DAYS = 366
+
+# Сколько объектов показывать в рейтинге и экипажей в текстовой сводке
+REPORT_TOP_OBJECTS = 10
+REPORT_TEXT_CREWS = 15
+
+METRIC_TITLES = {
+    'accept': 'Принял вызов',
+    'arrival': 'Прибыл',
+    'handling': 'Освободился',
+}
+
+# Гистограммы экипажей за период; parts - строки месячных и дневных свёрток
+RESPONSE_QUERY = '''
+    WITH merged AS (
+        SELECT crew_id, metric, bucket, sum(count) AS n, sum(total) AS t
+        FROM ({parts})
+        GROUP BY crew_id, metric, bucket
+    ), running AS (
+        SELECT crew_id, metric, bucket,
+               sum(n) OVER (PARTITION BY crew_id, metric ORDER BY bucket) AS below,
+               sum(n) OVER (PARTITION BY crew_id, metric) AS total_n,
+               sum(t) OVER (PARTITION BY crew_id, metric) AS total_t
+        FROM merged
+    )
+    SELECT crew_id, metric, total_n, total_t / total_n,
+           min(CASE WHEN below >= 0.5 * total_n THEN bucket END),
+           min(CASE WHEN below >= 0.9 * total_n THEN bucket END)
+    FROM running
+    GROUP BY crew_id, metric
+    ORDER BY crew_id, metric
+'''
+
+
+def report_period(days, today=None):
+    """Первый и последний день (включительно) и границы в часах от эпохи"""
+    today = today or date.today()
+    first = today - timedelta(days=days - 1)
+    first_hour = int(datetime.combine(first, datetime.min.time()).timestamp() // 3600)
+    last_hour = int(datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp() // 3600) - 1
+    return first.isoformat(), today.isoformat(), first_hour, last_hour
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def split_period(first_day, last_day, today=None):
+    """Целые месяцы периода ('2025-11', '2026-10') или None и диапазоны оставшихся дней.
+
+    Текущий месяц считается целым, если период доходит до сегодня:
+    более поздних вызовов ещё нет.
+    """
+    today = today or date.today()
+    first, last = date.fromisoformat(first_day), date.fromisoformat(last_day)
+    month = first if first.day == 1 else _next_month(first)
+    months = []
+    while month <= last and (_next_month(month) - timedelta(days=1) <= last or last >= today):
+        months.append(month)
+        month = _next_month(month)
+    if not months:
+        return None, [(first_day, last_day)]
+
+    days = []
+    if first < months[0]:
+        days.append((first_day, (months[0] - timedelta(days=1)).isoformat()))
+    if month <= last:
+        days.append((month.isoformat(), last_day))
+    return (months[0].isoformat()[:7], months[-1].isoformat()[:7]), days
+
+
+def _rollup_parts(name, columns, where, first_day, last_day, today=None):
+    """UNION ALL строк месячных и дневных свёрток name за период и параметры"""
+    months, days = split_period(first_day, last_day, today)
+    parts, params = [], []
+    if months:
+        parts.append(f"SELECT {columns} FROM {name}_monthly WHERE period BETWEEN ? AND ?{where}")
+        params += months
+    for first, last in days:
+        parts.append(f"SELECT {columns} FROM {name}_daily WHERE period BETWEEN ? AND ?{where}")
+        params += (first, last)
+    return ' UNION ALL '.join(parts), params
+
+
+def bucket_limit(bucket):
+    """Верхняя граница корзины в секундах (None - больше всех границ)"""
+    if bucket is None or bucket >= len(RESPONSE_BUCKETS):
+        return None
+    return RESPONSE_BUCKETS[bucket]
+
+
+def response_times(first_day, last_day, by_crew=True, today=None):
+    """[(crew_id, метрика, число, среднее, p50, p90)]; p50/p90 - границы корзин.
+
+    by_crew=False - одна строка на метрику по всем экипажам (crew_id = 0).
+    """
+    parts, params = _rollup_parts(
+        'response', 'crew_id, metric, bucket, count, total',
+        ' AND crew_id != 0' if by_crew else ' AND crew_id = 0', first_day, last_day, today)
+    rows = db.fetch_all(RESPONSE_QUERY.format(parts=parts), params)
+    return [(crew_id, metric, count, avg, bucket_limit(p50), bucket_limit(p90))
+            for crew_id, metric, count, avg, p50, p90 in rows]
+
+
+def top_objects(first_day, last_day, limit=REPORT_TOP_OBJECTS, today=None):
+    """[(место, object_id, название, вызовов)] - объекты с наибольшим числом вызовов"""
+    parts, params = _rollup_parts('object', 'object_id, count', '', first_day, last_day, today)
+    return db.fetch_all(f'''
+        SELECT rank() OVER (ORDER BY top.n DESC), top.object_id, objects.name, top.n
+        FROM (
+            SELECT object_id, sum(count) AS n
+            FROM ({parts})
+            GROUP BY object_id
+            ORDER BY n DESC
+            LIMIT ?
+        ) top
+        LEFT JOIN objects ON objects.id = top.object_id
+        ORDER BY top.n DESC, top.object_id
+    ''', params + [limit])
+
+
+def busiest_hours(first_hour, last_hour):
+    """[(час суток, вызовов, доля)] по убыванию числа вызовов"""
+    return db.fetch_all('''
+        SELECT hour_of_day, n, n * 1.0 / sum(n) OVER ()
+        FROM (
+            SELECT CAST(strftime('%H', hour * 3600, 'unixepoch', 'localtime') AS INTEGER) AS hour_of_day,
+                   sum(count) AS n
+            FROM dispatch_hourly
+            WHERE hour BETWEEN ? AND ?
+            GROUP BY hour_of_day
+        )
+        ORDER BY n DESC, hour_of_day
+    ''', (first_hour, last_hour))
+
+
+def build_report(days=REPORT_DAYS, today=None):
+    """Данные отчёта за последние days дней, включая сегодня"""
+    days = max(1, min(days, REPORT_MAX_DAYS))
+    first_day, last_day, first_hour, last_hour = report_period(days, today)
+    hours = busiest_hours(first_hour, last_hour)
+    return {
+        'days': days,
+        'first_day': first_day,
+        'last_day': last_day,
+        'dispatches': sum(row[1] for row in hours),
+        'crews': {crew[0]: crew[1] for crew in get_crew_status()},
+        'total': response_times(first_day, last_day, by_crew=False, today=today),
+        'by_crew': response_times(first_day, last_day, today=today),
+        'objects': top_objects(first_day, last_day, today=today),
+        'hours': hours,
+    }
+
+
+def format_seconds(seconds):
+    """Длительность для отчёта: '4 мин 10 с', '> 2 ч' для последней корзины"""
+    if seconds is None:
+        return f"> {RESPONSE_BUCKETS[-1] // 3600} ч"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if not minutes:
+        return f"{seconds} с"
+    return f"{minutes} мин {seconds} с" if seconds else f"{minutes} мин"
+
+
+def _response_lines(rows):
+    return [
+        f"  {METRIC_TITLES.get(metric, metric)}: {count} выз., среднее {format_seconds(avg)}, "
+        f"p50 ≤ {format_seconds(p50)}, p90 ≤ {format_seconds(p90)}"
+        for crew_id, metric, count, avg, p50, p90 in rows
+    ]
+
+
+def _crew_lines(report, limit):
+    """По строке на экипаж, сначала дольше всех добиравшиеся (среднее до "Прибыл")"""
+    by_crew = {}
+    for crew_id, metric, count, avg, p50, p90 in report['by_crew']:
+        by_crew.setdefault(crew_id, {})[metric] = (count, avg)
+    ranked = sorted(by_crew.items(), key=lambda item: -item[1].get('arrival', (0, 0))[1])
+    lines = []
+    for crew_id, metrics in ranked[:limit]:
+        calls = max(count for count, avg in metrics.values())
+        times = ', '.join(f"{METRIC_TITLES[metric].lower()} {format_seconds(metrics[metric][1])}"
+                          for metric in METRIC_TITLES if metric in metrics)
+        lines.append(f"  {report['crews'].get(crew_id, f'ГБР #{crew_id}')}: {calls} выз.; {times}")
+    if len(ranked) > limit:
+        lines.append(f"  ... и ещё {len(ranked) - limit}. Все экипажи: /report {report['days']} csv")
+    return lines
+
+
+def format_text(report, crews_limit=REPORT_TEXT_CREWS):
+    """Краткая сводка для сообщения в Telegram (полный отчёт - в CSV)"""
+    lines = [
+        f"📊 Отчёт за {report['days']} дн. ({report['first_day']} - {report['last_day']})",
+        f"Вызовов: {report['dispatches']}",
+    ]
+    if report['total']:
+        lines += ["", "⏱ Время от вызова, все экипажи:"] + _response_lines(report['total'])
+
+    if report['objects']:
+        lines += ["", "🏢 Больше всего вызовов:"]
+        lines += [f"  {place}. {name or f'Объект #{object_id}'} - {count}"
+                  for place, object_id, name, count in report['objects']]
+
+    if report['hours']:
+        lines += ["", "🕐 Самые загруженные часы:"]
+        lines += [f"  {hour:02d}:00-{hour:02d}:59 - {count} ({share:.0%})"
+                  for hour, count, share in report['hours'][:5]]
+
+    if report['by_crew']:
+        lines += ["", "🚓 Экипажи (среднее время от вызова):"] + _crew_lines(report, crews_limit)
+
+    if not report['dispatches'] and not report['by_crew']:
+        lines += ["", "За этот период вызовов не было."]
+    return '\n'.join(lines)
+
+
+def format_csv(report):
+    """Тот же отчёт одной таблицей CSV (раздел, ключ, название, показатели)"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['section', 'key', 'name', 'metric', 'count', 'avg_s', 'p50_le_s', 'p90_le_s', 'share'])
+    for crew_id, metric, count, avg, p50, p90 in report['total']:
+        writer.writerow(['response', 'all', 'Все экипажи', metric, count, round(avg, 1), p50, p90, ''])
+    for crew_id, metric, count, avg, p50, p90 in report['by_crew']:
+        writer.writerow(['response', crew_id, report['crews'].get(crew_id, ''), metric, count,
+                         round(avg, 1), p50, p90, ''])
+    for place, object_id, name, count in report['objects']:
+        writer.writerow(['object', object_id, name or '', 'dispatches', count, '', '', '', ''])
+    for hour, count, share in report['hours']:
+        writer.writerow(['hour', hour, f"{hour:02d}:00", 'dispatches', count, '', '', '', round(share, 4)])
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Отчёт по вызовам ГБР')
+    parser.add_argument('--days', type=int, default=REPORT_DAYS, help='за сколько последних дней')
+    parser.add_argument('--csv', help='записать отчёт в CSV вместо вывода сводки')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    db.init_db()
+    report = build_report(args.days)
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8-sig', newline='') as f:
+            f.write(format_csv(report))
+        logger.info(f"Отчёт записан в {args.csv}")
+    else:
+        print(format_text(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Совместный запуск диспетчерского бота и бота ГБР в одном процессе.
+
+Оба бота работают в одном цикле событий и делят реестр экипажей,
+координаты, слой базы данных и клиент DaData, поэтому смена статуса
+в боте ГБР сразу видна диспетчеру. Раздельный запуск (python bot.py,
+python gbr_bot.py) по-прежнему поддерживается.
+"""
+import asyncio
+import logging
+
+import async_db
+import bot
+import db
+import gbr_bot
+import webhook
+
+logger = logging.getLogger(__name__)
+
+
+async def serve_all(applications):
+    """Запустить все приложения и работать до SIGINT/SIGTERM"""
+    started = []
+    try:
+        for application, config in applications:
+            server = await webhook.start_application(application, config)
+            started.append((application, server))
+        await webhook.wait_for_stop_signal()
+    finally:
+        for application, server in reversed(started):
+            try:
+                await webhook.stop_application(application, server)
+            except Exception as e:
+                logger.error(f"Ошибка остановки бота: {e}")
+
+
+def main():
+    """Запуск обоих ботов"""
+    if not bot.TELEGRAM_BOT_TOKEN or not gbr_bot.GBR_BOT_TOKEN:
+        logger.error("Для совместного запуска нужны TELEGRAM_BOT_TOKEN и GBR_BOT_TOKEN!")
+        return
+
+    if not bot.DADATA_API_KEY:
+        logger.error("DADATA_API_KEY не найден!")
+        return
+
+    try:
+        configs = webhook.config_from_env(), webhook.config_from_env('GBR_')
+    except ValueError as e:
+        logger.error(str(e))
+        return
+
+    # Готовим базу данных (WAL, поисковый индекс)
+    db.init_db()
+
+    applications = list(zip((bot.build_application(), gbr_bot.build_application()), configs))
+
+    logger.info("Запуск диспетчерского бота и бота ГБР в одном процессе...")
+    try:
+        asyncio.run(serve_all(applications))
+    finally:
+        async_db.shutdown()
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import logging
+
+from normalize import search_words
+
+logger = logging.getLogger(__name__)
+
+# Поля объекта, которые возвращает поиск (тот же порядок, что и раньше в bot.py)
+OBJECT_COLUMNS = 'o.id, o.name, o.address, o.category, o.notes, o.lat, o.lon'
+
+# Веса полей для bm25: название важнее адреса, адрес важнее заметок
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+# Минимальная длина слова, которое может искаться по триграммам
+MIN_TERM_LENGTH = 3
+
+# Обновление индекса только при изменении индексируемых полей: запись координат
+# или служебных колонок не переписывает индекс
+UPDATE_TRIGGER = '''
+CREATE TRIGGER IF NOT EXISTS objects_fts_au AFTER UPDATE OF name, address, notes ON objects BEGIN
+    INSERT INTO objects_fts(objects_fts, rowid, name, address, notes)
+    VALUES ('delete', old.id, old.name, old.address, old.notes);
+    INSERT INTO objects_fts(rowid, name, address, notes)
+    VALUES (new.id, new.name, new.address, new.notes);
+END;
+'''
+
+# Полнотекстовый индекс по objects. Триггеры держат его в синхронизации с таблицей
+SEARCH_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS objects_fts USING fts5(
+    name, address, notes,
+    content='objects', content_rowid='id',
+    tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS objects_fts_ai AFTER INSERT ON objects BEGIN
+    INSERT INTO objects_fts(rowid, name, address, notes)
+    VALUES (new.id, new.name, new.address, new.notes);
+END;
+
+CREATE TRIGGER IF NOT EXISTS objects_fts_ad AFTER DELETE ON objects BEGIN
+    INSERT INTO objects_fts(objects_fts, rowid, name, address, notes)
+    VALUES ('delete', old.id, old.name, old.address, old.notes);
+END;
+''' + UPDATE_TRIGGER
+
+
+def ensure_search_index(conn):
+    """Создать поисковый индекс, если его ещё нет"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'objects_fts'"
+    ).fetchone()
+    if exists:
+        # Индекс создан раньше с триггером на любое обновление - заменяем его
+        trigger = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'objects_fts_au'"
+        ).fetchone()
+        if trigger and 'UPDATE OF' not in trigger[0]:
+            conn.execute('BEGIN')
+            conn.execute('DROP TRIGGER objects_fts_au')
+            conn.execute(UPDATE_TRIGGER)
+            conn.commit()
+        return
+
+    conn.executescript(SEARCH_SCHEMA)
+    # Индекс создан впервые - заполняем его уже существующими объектами
+    conn.execute("INSERT INTO objects_fts(objects_fts) VALUES ('rebuild')")
+    conn.commit()
+    logger.info("Создан полнотекстовый индекс objects_fts")
+
+
+def rebuild_search_index(conn):
+    """Полностью перестроить поисковый индекс"""
+    conn.execute("INSERT INTO objects_fts(objects_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def split_query(query):
+    """Разбить запрос на слова для триграммного индекса и короткие слова"""
+    long_terms = []
+    short_terms = []
+    for word in query.split():
+        if len(word) >= MIN_TERM_LENGTH:
+            long_terms.append(word)
+        else:
+            short_terms.append(word)
+    return long_terms, short_terms
+
+
+def build_match_expression(terms):
+    """Собрать выражение MATCH: все слова обязательны, каждое в кавычках"""
+    return ' AND '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _short_filter(short_terms):
+    """Короткие слова (номер дома и т.п.) триграммы не ищут - ищем их как начало слова
+    в ключах нечёткого поиска (search_keys_fts, fuzzy_search.py).
+
+    Слова ключей нормализованы и в нижнем регистре, поэтому "ТЦ" находит
+    "тц", а запрос из одних коротких слов читает индекс, а не всю таблицу.
+    Слова, которые нормализация отбрасывает ("д", "ул"), не ищутся.
+    Ключи пересчитывает фоновая задача нечёткого поиска, поэтому новый
+    объект находится по коротким словам через FUZZY_REFRESH_INTERVAL секунд.
+    """
+    words = [word for term in short_terms for word in search_words(term)]
+    if not words:
+        return '', []
+    return (' AND o.id IN (SELECT rowid FROM search_keys_fts WHERE search_keys_fts MATCH ?)',
+            [' AND '.join(f'{build_match_expression([word])}*' for word in words)])
+
+
+def search(conn, query, limit=10):
+    """Найти объекты по названию, адресу или заметкам, лучшие совпадения первыми"""
+    long_terms, short_terms = split_query(query)
+    short_filter, short_params = _short_filter(short_terms)
+    if not long_terms and not short_params:
+        return []
+
+    if long_terms:
+        sql = (
+            f'SELECT {OBJECT_COLUMNS} FROM objects_fts f '
+            f'JOIN objects o ON o.id = f.rowid '
+            f'WHERE objects_fts MATCH ?{short_filter} '
+            f'ORDER BY bm25(objects_fts, ?, ?, ?) '
+            f'LIMIT ?'
+        )
+        params = [build_match_expression(long_terms), *short_params, *RANK_WEIGHTS, limit]
+    else:
+        sql = (
+            f'SELECT {OBJECT_COLUMNS} FROM objects o '
+            f'WHERE 1 = 1{short_filter} '
+            f'ORDER BY o.id '
+            f'LIMIT ?'
+        )
+        params = [*short_params, limit]
+
+    return conn.execute(sql, params).fetchall()
+
+
+def _page_source(query):
+    """Выборка поиска для постраничной выдачи: SELECT с колонкой rank и параметры (или None).
+
+    rank - bm25 с весами RANK_WEIGHTS (меньше - лучше); у запроса из одних
+    коротких слов ранжировать нечем, rank у всех объектов 0.
+    """
+    long_terms, short_terms = split_query(query)
+    short_filter, short_params = _short_filter(short_terms)
+    if not long_terms and not short_params:
+        return None
+    if long_terms:
+        return (f'SELECT {OBJECT_COLUMNS}, bm25(objects_fts, ?, ?, ?) AS rank '
+                f'FROM objects_fts f JOIN objects o ON o.id = f.rowid '
+                f'WHERE objects_fts MATCH ?{short_filter}',
+                [*RANK_WEIGHTS, build_match_expression(long_terms), *short_params])
+    return (f'SELECT {OBJECT_COLUMNS}, 0.0 AS rank FROM objects o WHERE 1 = 1{short_filter}',
+            short_params)
+
+
+def search_page(conn, query, cursor=None, limit=5, backward=False):
+    """Страница результатов поиска, лучшие совпадения первыми, без OFFSET.
+
+    Объекты упорядочены по (rank, id); cursor - пара (rank, id) крайнего
+    объекта соседней страницы (None - первая страница). Вперёд - объекты
+    после cursor, назад - перед ним (в прямом порядке). Строки - поля
+    OBJECT_COLUMNS и rank последней колонкой. Возвращает не больше limit + 1
+    строк: лишняя строка означает, что в эту сторону есть ещё страница.
+    """
+    source = _page_source(query)
+    if source is None:
+        return []
+    select, params = source
+    if cursor is None:
+        return conn.execute(
+            f'SELECT * FROM ({select}) ORDER BY rank, id LIMIT ?', [*params, limit + 1]
+        ).fetchall()
+    if backward:
+        rows = conn.execute(
+            f'SELECT * FROM ({select}) WHERE (rank, id) < (?, ?) ORDER BY rank DESC, id DESC LIMIT ?',
+            [*params, *cursor, limit + 1]
+        ).fetchall()
+        return rows[::-1]
+    return conn.execute(
+        f'SELECT * FROM ({select}) WHERE (rank, id) > (?, ?) ORDER BY rank, id LIMIT ?',
+        [*params, *cursor, limit + 1]
+    ).fetchall()
+
+
+def count_matches(conn, query, cap=1000):
+    """Число найденных объектов, но не больше cap (подсчёт - тоже перебор совпадений)"""
+    source = _page_source(query)
+    if source is None:
+        return 0
+    select, params = source
+    return conn.execute(
+        f'SELECT count(*) FROM ({select} LIMIT ?)', [*params, cap]
+    ).fetchone()[0]
+
+
+# Запросы, на которые ссылаются кнопки листания: в callback_data (64 байта)
+# помещается номер запроса, а не его текст
+SEARCH_QUERIES_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS search_queries (
+    id INTEGER PRIMARY KEY,
+    query TEXT NOT NULL UNIQUE,
+    total INTEGER NOT NULL,
+    used_at REAL NOT NULL
+)
+'''
+
+
+def ensure_search_queries(conn):
+    conn.execute(SEARCH_QUERIES_SCHEMA)
+
+
+def save_query(conn, query, total, now):
+    """Номер запроса для кнопок листания (тот же текст - тот же номер)"""
+    return conn.execute('''
+        INSERT INTO search_queries (query, total, used_at) VALUES (?, ?, ?)
+        ON CONFLICT(query) DO UPDATE SET total = excluded.total, used_at = excluded.used_at
+        RETURNING id
+    ''', (query, total, now)).fetchone()[0]
+
+
+def load_query(conn, token):
+    """(текст, число найденных) по номеру запроса или None"""
+    return conn.execute('SELECT query, total FROM search_queries WHERE id = ?', (token,)).fetchone()
+
+
+def purge_queries(conn, before):
+    """Удалить запросы, которыми не пользовались с before"""
+    return conn.execute('DELETE FROM search_queries WHERE used_at < ?', (before,)).rowcount
@@ -0,0 +1,233 @@
+"""Состояние диалогов пользователей (например, последний поиск).
+
+Записи живут в памяти (LRU с TTL и пределом по объёму) и раз в
+SESSION_FLUSH_INTERVAL секунд пачкой сохраняются в таблицу sessions, поэтому
+нажатие кнопки не пишет на диск, а после перезапуска бота состояние
+подгружается из базы. В записи - только идентификаторы, не строки таблиц.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+import async_db
+import db
+
+logger = logging.getLogger(__name__)
+
+# Сколько живёт неиспользуемое состояние, секунды (по умолчанию сутки)
+SESSION_TTL = int(os.getenv('SESSION_TTL', str(24 * 3600)))
+
+# Пределы памяти: записей и байт (оценка по размеру JSON)
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '10000'))
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', str(4 * 1024 * 1024)))
+
+# Как часто сохранять изменения в базу, секунды
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', '5'))
+
+# Как часто удалять из базы просроченные состояния, секунды
+SESSION_PURGE_INTERVAL = 3600
+
+# Примерные накладные расходы на запись в памяти (ключ, кортеж, узел словаря), байт
+ENTRY_OVERHEAD = 200
+
+SESSIONS_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS sessions (
+        user_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)',
+)
+
+
+def ensure_sessions_table(conn):
+    for statement in SESSIONS_SCHEMA:
+        conn.execute(statement)
+
+
+db.register_schema(ensure_sessions_table)
+
+
+def load_session(user_id, updated_after):
+    """(состояние, время) из базы или None"""
+    row = db.fetch_one(
+        'SELECT state, updated_at FROM sessions WHERE user_id = ? AND updated_at > ?',
+        (user_id, updated_after)
+    )
+    if row is None:
+        return None
+    return json.loads(row[0]), row[1]
+
+
+def save_sessions(rows, deleted, expire_before):
+    """Записать изменённые состояния, удалить сброшенные и просроченные"""
+    with db.write_transaction() as conn:
+        conn.executemany('''
+            INSERT INTO sessions (user_id, state, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        ''', rows)
+        conn.executemany('DELETE FROM sessions WHERE user_id = ?', [(user_id,) for user_id in deleted])
+        return conn.execute('DELETE FROM sessions WHERE updated_at <= ?', (expire_before,)).rowcount
+
+
+class SessionStore:
+    """LRU-кэш состояний с TTL, пределом памяти и отложенной записью в SQLite"""
+
+    def __init__(self, ttl=SESSION_TTL, max_entries=SESSION_MAX_ENTRIES, max_bytes=SESSION_MAX_BYTES,
+                 flush_interval=SESSION_FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        # user_id -> (состояние, время изменения, размер)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Изменённые, но ещё не записанные: user_id -> (JSON, время) или None (удалить)
+        self._pending = {}
+        self._task = None
+        self._purged_at = 0.0
+        # Статистика
+        self.hits = 0
+        self.loads = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def _drop(self, user_id):
+        state, updated_at, size = self._entries.pop(user_id)
+        self._bytes -= size
+
+    def _put(self, user_id, state, updated_at):
+        if user_id in self._entries:
+            self._drop(user_id)
+        size = len(json.dumps(state, ensure_ascii=False)) + ENTRY_OVERHEAD
+        self._entries[user_id] = (state, updated_at, size)
+        self._bytes += size
+        # Вытесняем самые давние; их изменения уже лежат в _pending
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    async def get(self, user_id):
+        """Состояние пользователя (копия словаря, пустой - если нет)"""
+        entry = self._entries.get(user_id)
+        now = time.time()
+        if entry is not None:
+            state, updated_at, size = entry
+            if now - updated_at < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return dict(state)
+            self._drop(user_id)
+            self.expirations += 1
+            return {}
+
+        pending = self._pending.get(user_id, False)
+        if pending is not False:
+            # Вытеснено из памяти, но ещё не записано
+            if pending is None or now - pending[1] >= self.ttl:
+                return {}
+            state, updated_at = json.loads(pending[0]), pending[1]
+        else:
+            loaded = await async_db.read(load_session, user_id, now - self.ttl)
+            if loaded is None:
+                self.misses += 1
+                return {}
+            state, updated_at = loaded
+            self.loads += 1
+        if user_id not in self._entries:
+            self._put(user_id, state, updated_at)
+        return dict(state)
+
+    async def update(self, user_id, **fields):
+        """Изменить поля состояния; поле со значением None удаляется"""
+        state = await self.get(user_id)
+        for key, value in fields.items():
+            if value is None:
+                state.pop(key, None)
+            else:
+                state[key] = value
+        now = time.time()
+        if not state:
+            await self.clear(user_id)
+            return
+        self._put(user_id, state, now)
+        self._pending[user_id] = (json.dumps(state, ensure_ascii=False), now)
+
+    async def clear(self, user_id):
+        if user_id in self._entries:
+            self._drop(user_id)
+        self._pending[user_id] = None
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией, вернуть их число"""
+        now = time.time()
+        if not self._pending and now - self._purged_at < SESSION_PURGE_INTERVAL:
+            return 0
+        self._purged_at = now
+        pending, self._pending = self._pending, {}
+        rows = [(user_id, value[0], value[1]) for user_id, value in pending.items() if value is not None]
+        deleted = [user_id for user_id, value in pending.items() if value is None]
+        try:
+            expired = await async_db.write(save_sessions, rows, deleted, now - self.ttl)
+        except Exception:
+            # Вернуть несохранённое, не затирая более свежие изменения
+            for user_id, value in pending.items():
+                self._pending.setdefault(user_id, value)
+            raise
+        self.expirations += expired
+        if pending:
+            self.flushes += 1
+            self.flushed_rows += len(pending)
+        return len(pending)
+
+    async def start(self):
+        """Сохранять изменения в фоне (при старте бота)"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую запись и сохранить всё, что осталось"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Сессии: ошибка записи: {e}")
+
+    def stats(self):
+        """Число записей, занятая память и попадания"""
+        return {
+            'entries': len(self._entries),
+            'memory_bytes': self._bytes,
+            'pending': len(self._pending),
+            'hits': self.hits,
+            'loads': self.loads,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+        }
+
+
+store = SessionStore()
@@ -0,0 +1,303 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+
+from telegram.error import BadRequest, TelegramError
+
+import async_db
+import db
+import dispatch
+from crew_registry import registry
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять журнал статусов (изменения из другого процесса), секунды
+STATUS_FEED_POLL_INTERVAL = float(os.getenv('STATUS_FEED_POLL_INTERVAL', '0.5'))
+
+# Сколько ждать после изменения, собирая следующие в одну правку табло, секунды
+STATUS_BOARD_DEBOUNCE = float(os.getenv('STATUS_BOARD_DEBOUNCE', '1'))
+
+# Не править табло чаще, чем раз в столько секунд
+STATUS_BOARD_MIN_INTERVAL = float(os.getenv('STATUS_BOARD_MIN_INTERVAL', '3'))
+
+# Сколько последних изменений показывать на табло
+STATUS_BOARD_HISTORY = 5
+
+# Сколько дней хранить журнал статусов
+STATUS_EVENTS_KEEP_DAYS = 7
+
+STATUS_LABELS = {
+    'free': '🟢 Свободен',
+    'busy': '🔴 Занят',
+    'arrived': '🏁 На месте',
+}
+
+# Журнал смены статусов пишет триггер, поэтому в него попадают изменения
+# из любого процесса и любого кода (команды, кнопки ГБР, очередь тревог)
+STATUS_FEED_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS crew_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        crew_id INTEGER NOT NULL,
+        old_status TEXT,
+        status TEXT,
+        created_at REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS gbr_crews_status_au
+    AFTER UPDATE OF status ON gbr_crews
+    WHEN old.status IS NOT new.status
+    BEGIN
+        INSERT INTO crew_events (crew_id, old_status, status, created_at)
+        VALUES (new.id, old.status, new.status, (julianday('now') - 2440587.5) * 86400.0);
+    END
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS status_board (
+        chat_id TEXT PRIMARY KEY,
+        message_id INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''',
+)
+
+
+def ensure_status_feed_tables(conn):
+    """Создать журнал статусов, его триггер и таблицу сообщений-табло"""
+    for statement in STATUS_FEED_SCHEMA:
+        conn.execute(statement)
+
+
+db.register_schema(ensure_status_feed_tables)
+
+
+def last_event_id():
+    """id последнего события в журнале (0, если журнал пуст)"""
+    return db.fetch_one('SELECT coalesce(max(id), 0) FROM crew_events')[0]
+
+
+def fetch_events(after_id, limit=500):
+    """События после after_id: (id, crew_id, old_status, status, created_at)"""
+    return db.fetch_all('''
+        SELECT id, crew_id, old_status, status, created_at FROM crew_events
+        WHERE id > ? ORDER BY id LIMIT ?
+    ''', (after_id, limit))
+
+
+def recent_events(limit=STATUS_BOARD_HISTORY):
+    """Последние события журнала, старые первыми"""
+    rows = db.fetch_all('''
+        SELECT id, crew_id, old_status, status, created_at FROM crew_events
+        ORDER BY id DESC LIMIT ?
+    ''', (limit,))
+    return rows[::-1]
+
+
+def purge_events(keep_days=STATUS_EVENTS_KEEP_DAYS):
+    """Удалить старые события журнала"""
+    return db.execute('DELETE FROM crew_events WHERE created_at < ?',
+                      (time.time() - keep_days * 86400,))
+
+
+def load_boards():
+    """Сообщения-табло: chat_id -> message_id"""
+    return dict(db.fetch_all('SELECT chat_id, message_id FROM status_board'))
+
+
+def save_board(chat_id, message_id):
+    db.execute('''
+        INSERT INTO status_board (chat_id, message_id, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET message_id = excluded.message_id, updated_at = excluded.updated_at
+    ''', (str(chat_id), message_id, time.time()))
+
+
+def render_board(history):
+    """Текст табло по текущим статусам экипажей и последним изменениям"""
+    crews = registry.all()
+    names = {crew[0]: crew[1] for crew in crews}
+
+    text = "📊 СТАТУСЫ ГБР\n\n"
+    for crew_id, name, status, telegram_id in crews:
+        text += f"{name}: {STATUS_LABELS.get(status, '⚪ Неизвестно')}\n"
+
+    if history:
+        text += "\nПоследние изменения:\n"
+        for event_id, crew_id, old_status, status, created_at in history:
+            at = datetime.fromtimestamp(created_at).strftime('%H:%M:%S')
+            label = STATUS_LABELS.get(status, '⚪ Неизвестно')
+            text += f"{at} {names.get(crew_id, f'ГБР #{crew_id}')} → {label}\n"
+
+    text += f"\nОбновлено {datetime.now().strftime('%H:%M:%S')}"
+    return text
+
+
+class StatusFeed:
+    """Живое табло статусов ГБР: одно сообщение, которое правится на месте.
+
+    Изменения читаются из журнала crew_events по возрастанию id, поэтому
+    табло видит и смену статуса в боте ГБР, запущенном отдельным процессом.
+    Изменения, пришедшие подряд, собираются в одну правку: не раньше
+    debounce секунд после первого и не чаще min_interval.
+    """
+
+    def __init__(self, chat_ids=(), poll_interval=STATUS_FEED_POLL_INTERVAL,
+                 debounce=STATUS_BOARD_DEBOUNCE, min_interval=STATUS_BOARD_MIN_INTERVAL):
+        self.chat_ids = [str(chat_id) for chat_id in chat_ids]
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.min_interval = min_interval
+        self.bot = None
+        self._cursor = 0
+        self._history = deque(maxlen=STATUS_BOARD_HISTORY)
+        # chat_id -> message_id табло
+        self._boards = {}
+        self._last_text = {}
+        self._task = None
+        self._render_task = None
+        self._wakeup = None
+        self._dirty = False
+        self._last_publish = 0.0
+        # Статистика
+        self.events = 0
+        self.edits = 0
+        self.coalesced = 0
+
+    async def start(self, bot):
+        """Начать следить за журналом (при старте бота)"""
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        purged = await async_db.write(purge_events)
+        if purged:
+            logger.info(f"Журнал статусов: удалено {purged} старых событий")
+        self._cursor = await async_db.read(last_event_id)
+        self._history.extend(await async_db.read(recent_events))
+        self._boards = await async_db.read(load_boards)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._task, self._render_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._render_task = None
+
+    def notify(self):
+        """Статус изменён в этом процессе - прочитать журнал сразу"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def show(self, chat_id):
+        """Отправить новое табло в чат; дальше правится именно оно"""
+        chat_id = str(chat_id)
+        if chat_id not in self.chat_ids:
+            self.chat_ids.append(chat_id)
+        text = await async_db.read(render_board, list(self._history))
+        await self._send_board(chat_id, text)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Табло статусов: ошибка чтения журнала: {e}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self):
+        """Прочитать новые события журнала, вернуть их количество"""
+        events = await async_db.read(fetch_events, self._cursor)
+        if not events:
+            return 0
+        self._cursor = events[-1][0]
+        self._history.extend(events)
+        self.events += len(events)
+
+        if self._dirty:
+            # Правка уже запланирована - она покажет и эти изменения
+            self.coalesced += len(events)
+        self._dirty = True
+        if self._render_task is None or self._render_task.done():
+            self._render_task = asyncio.create_task(self._render_later())
+        return len(events)
+
+    async def _render_later(self):
+        while self._dirty:
+            delay = max(self.debounce, self._last_publish + self.min_interval - time.monotonic())
+            await asyncio.sleep(delay)
+            self._dirty = False
+            try:
+                await self.publish()
+            except Exception as e:
+                logger.error(f"Табло статусов: ошибка обновления: {e}")
+
+    async def publish(self):
+        """Обновить табло во всех чатах"""
+        self._last_publish = time.monotonic()
+        text = await async_db.read(render_board, list(self._history))
+        for chat_id in self.chat_ids:
+            message_id = self._boards.get(chat_id)
+            if message_id is None:
+                await self._send_board(chat_id, text)
+            elif text != self._last_text.get(chat_id):
+                await self._edit_board(chat_id, message_id, text)
+
+    async def _send_board(self, chat_id, text):
+        await dispatch.limiter.acquire(chat_id)
+        try:
+            message = await self.bot.send_message(chat_id=chat_id, text=text)
+        except TelegramError as e:
+            logger.error(f"Табло статусов: не удалось отправить в {chat_id}: {e}")
+            return
+        self._boards[chat_id] = message.message_id
+        self._last_text[chat_id] = text
+        await async_db.write(save_board, chat_id, message.message_id)
+
+    async def _edit_board(self, chat_id, message_id, text):
+        await dispatch.limiter.acquire(chat_id)
+        try:
+            await self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                self._last_text[chat_id] = text
+                return
+            # Сообщение удалено или его больше нельзя править - отправляем новое
+            logger.warning(f"Табло статусов в {chat_id} не обновлено ({e}), отправляю новое")
+            await self._send_board(chat_id, text)
+            return
+        except TelegramError as e:
+            logger.error(f"Табло статусов: ошибка правки в {chat_id}: {e}")
+            return
+        self._last_text[chat_id] = text
+        self.edits += 1
+
+    def stats(self):
+        """Счётчики событий и правок табло"""
+        return {
+            'events': self.events,
+            'edits': self.edits,
+            'coalesced': self.coalesced,
+            'boards': len(self._boards),
+        }
+
+
+# Табло процесса; чаты задаёт бот диспетчера при старте
+feed = StatusFeed()
+
+
+def notify():
+    """Разбудить табло этого процесса после смены статуса"""
+    feed.notify()
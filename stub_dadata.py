@@ -0,0 +1,109 @@
+"""Локальная заглушка DaData для проверки геокодера без сети.
+
+Запуск: python stub_dadata.py --port 8089 --delay 0.2
+Затем: DADATA_URL=http://127.0.0.1:8089/suggest python bot.py
+
+Сбои для проверки сроков, страховки и автомата защиты геокодера:
+    python stub_dadata.py --error-rate 0.3 --slow-rate 0.1 --slow-delay 5
+    python stub_dadata.py --down        # все запросы отвечают 503
+"""
+import json
+import random
+import asyncio
+import argparse
+import logging
+
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+# Координаты, которые заглушка возвращает на любой адрес
+DEFAULT_LAT = 55.754058
+DEFAULT_LON = 37.62049
+
+
+class StubDaData:
+    """Минимальный HTTP-сервер, отвечающий как API подсказок DaData"""
+
+    def __init__(self, delay=0.0, addresses=None, error_rate=0.0, error_status=503,
+                 slow_rate=0.0, slow_delay=5.0, seed=None):
+        # Задержка ответа, секунды
+        self.delay = delay
+        # Известные адреса: запрос -> (lat, lon); если None - отвечаем на любой
+        self.addresses = addresses
+        # Сбои: доля ответов с ошибкой error_status и доля медленных ответов.
+        # Поля можно менять на ходу, имитируя деградацию и восстановление
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self._random = random.Random(seed)
+        self.requests = 0
+        self.failed = 0
+        self.slowed = 0
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Запустить сервер, вернуть фактический порт"""
+        self._server = HttpServer({'*': self._handle})
+        return await self._server.start(host, port)
+
+    async def stop(self):
+        if self._server is not None:
+            await self._server.stop()
+            self._server = None
+
+    def make_response(self, query):
+        """Тело ответа DaData на запрос"""
+        if self.addresses is None:
+            coords = (DEFAULT_LAT, DEFAULT_LON)
+        else:
+            coords = self.addresses.get(query)
+        if coords is None:
+            return {'suggestions': []}
+        return {'suggestions': [{
+            'value': query,
+            'data': {'geo_lat': str(coords[0]), 'geo_lon': str(coords[1])}
+        }]}
+
+    async def _handle(self, method, headers, body):
+        self.requests += 1
+        delay = self.delay
+        if self.slow_rate and self._random.random() < self.slow_rate:
+            self.slowed += 1
+            delay += self.slow_delay
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.failed += 1
+            return self.error_status, b'{"error": "stub failure"}', 'application/json'
+
+        try:
+            query = json.loads(body or b'{}').get('query', '')
+        except ValueError:
+            return 400, b'{"error": "bad json"}', 'application/json'
+        payload = json.dumps(self.make_response(query), ensure_ascii=False)
+        return 200, payload.encode(), 'application/json'
+
+
+async def _serve(port, delay, error_rate, slow_rate, slow_delay):
+    stub = StubDaData(delay=delay, error_rate=error_rate, slow_rate=slow_rate, slow_delay=slow_delay)
+    port = await stub.start(port=port)
+    print(f"Заглушка DaData слушает http://127.0.0.1:{port}/")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальная заглушка DaData')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--delay', type=float, default=0.0, help='задержка ответа, секунды')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='доля медленных ответов')
+    parser.add_argument('--slow-delay', type=float, default=5.0, help='задержка медленного ответа, секунды')
+    parser.add_argument('--down', action='store_true', help='отвечать 503 на все запросы')
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args.port, args.delay, 1.0 if args.down else args.error_rate,
+                           args.slow_rate, args.slow_delay))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,83 @@
+"""Проверки выбора ближайших экипажей (crew_locations.py) без базы.
+
+Запуск: python -m pytest test_crew_locations.py
+"""
+import time
+
+import crew_locations
+from crew_locations import CrewLocations, rank_crews
+
+# Точка вызова и смещения экипажей к северу от неё (0.01° широты ~ 1.1 км)
+LAT, LON = 55.75, 37.62
+
+
+def locations_with(offsets):
+    """Координаты экипажей: crew_id -> смещение по широте от точки вызова"""
+    locations = CrewLocations()
+    for crew_id, offset in offsets.items():
+        locations.update(crew_id, LAT + offset, LON)
+    return locations
+
+
+def crew(crew_id, status='free'):
+    return crew_id, f'ГБР-{crew_id}', status, str(100 + crew_id)
+
+
+def ids(ranked):
+    return [row[0] for row, distance in ranked]
+
+
+def test_iter_nearest_yields_crews_by_distance():
+    # Ближний экипаж в дальней по номеру ячейке, дальний - через много пустых ячеек
+    locations = locations_with({1: 0.5, 2: 0.003, 3: -0.02, 4: 0.0105})
+    nearest = list(locations.iter_nearest(LAT, LON))
+
+    assert [crew_id for distance, crew_id in nearest] == [2, 4, 3, 1]
+    distances = [distance for distance, crew_id in nearest]
+    assert distances == sorted(distances)
+    assert 55 < distances[-1] < 56
+
+
+def test_iter_nearest_skips_stale_positions(monkeypatch):
+    locations = CrewLocations()
+    locations.update(1, LAT + 0.001, LON, at=time.time() - 3600)
+    locations.update(2, LAT + 0.1, LON)
+    monkeypatch.setattr(crew_locations, 'LOCATION_MAX_AGE', 900)
+
+    assert [crew_id for distance, crew_id in locations.iter_nearest(LAT, LON)] == [2]
+
+
+def test_moved_crew_leaves_its_old_cell():
+    locations = locations_with({1: 0.001})
+    locations.update(1, LAT + 0.3, LON)
+
+    assert [crew_id for distance, crew_id in locations.iter_nearest(LAT, LON)] == [1]
+    assert len(locations._grid) == 1
+
+
+def test_rank_crews_puts_free_nearest_first():
+    crews = [crew(1), crew(2, 'busy'), crew(3), crew(4), crew(5, 'busy')]
+    # Экипаж 4 без координат
+    locations = locations_with({1: 0.05, 2: 0.001, 3: 0.002, 5: 0.03})
+
+    ranked = rank_crews(crews, locations, LAT, LON)
+    assert ids(ranked) == [3, 1, 2, 5, 4]
+    assert ranked[-1][1] is None
+
+
+def test_rank_crews_stops_at_limit_of_free_crews():
+    crews = [crew(1), crew(2, 'busy'), crew(3), crew(4)]
+    locations = locations_with({1: 0.05, 2: 0.001, 3: 0.002, 4: 0.2})
+
+    assert ids(rank_crews(crews, locations, LAT, LON, limit=2)) == [3, 1]
+    # Свободных не хватает - занятые и экипажи без координат добирают список
+    assert ids(rank_crews(crews[:2], locations, LAT, LON, limit=3)) == [1, 2]
+
+
+def test_rank_crews_without_object_coordinates_puts_free_first():
+    crews = [crew(1, 'busy'), crew(2, 'busy'), crew(3), crew(4, 'busy'), crew(5)]
+    locations = locations_with({1: 0.001})
+
+    ranked = rank_crews(crews, locations, None, None, limit=3)
+    assert ids(ranked) == [3, 5, 1]
+    assert all(distance is None for row, distance in ranked)
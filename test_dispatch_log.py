@@ -0,0 +1,168 @@
+"""Проверки журнала вызовов (dispatch_log.py) и отчёта по его свёрткам (report.py).
+
+Запуск: python -m pytest test_dispatch_log.py
+"""
+import time
+from datetime import date, datetime
+
+import db
+import dispatch_log
+import outbox
+import report
+
+
+def crew_ids():
+    return [row[0] for row in db.fetch_all('SELECT id FROM gbr_crews ORDER BY id')]
+
+
+def open_dispatch(crew_id):
+    return db.fetch_one(
+        'SELECT dispatch_id, object_id, dispatched_at, busy_at, arrived_at FROM dispatch_open WHERE crew_id = ?',
+        (crew_id,))
+
+
+def delivered(row):
+    return row, {'ok': True, 'permanent': False}
+
+
+def test_enqueue_opens_dispatch_in_same_transaction(database):
+    crew_id = crew_ids()[0]
+    outbox.enqueue('alarm-1', '101', 'Тревога', crew_id=crew_id, object_id=7)
+
+    dispatch_id, object_id, dispatched_at, busy_at, _ = open_dispatch(crew_id)
+    assert object_id == 7 and busy_at is None
+    assert db.fetch_one('SELECT kind, crew_id, object_id FROM dispatch_events WHERE id = ?',
+                        (dispatch_id,)) == ('dispatch', crew_id, 7)
+    assert db.fetch_one('SELECT created_at FROM outbox WHERE idempotency_key = ?',
+                        ('alarm-1',)) == (dispatched_at,)
+
+    # Повтор ключа не создаёт второго вызова
+    outbox.enqueue('alarm-1', '101', 'Тревога', crew_id=crew_id, object_id=7)
+    assert db.fetch_one("SELECT count(*) FROM dispatch_events WHERE kind = 'dispatch'") == (1,)
+
+
+def test_delivery_busy_is_logged_with_outbox_results(database):
+    crew_id = crew_ids()[0]
+    outbox.enqueue('alarm-2', '102', 'Тревога', crew_id=crew_id, object_id=7)
+    outbox.complete_batch([delivered(row) for row in outbox.claim_batch()])
+
+    assert db.fetch_one('SELECT status FROM gbr_crews WHERE id = ?', (crew_id,)) == ('busy',)
+    assert open_dispatch(crew_id)[3] is not None
+    assert dispatch_log.response_stats('crew', str(crew_id))['accept']['count'] == 1
+
+    # Ручной busy того же вызова - повтор, в итоги не идёт
+    dispatch_log.write_events([(time.time(), 'busy', crew_id, None)])
+    assert dispatch_log.response_stats()['accept']['count'] == 1
+
+
+def test_status_flushed_later_by_other_process_is_attached(database):
+    """Статусы из буфера другого процесса приходят после вызова, записанного очередью"""
+    crew_id = crew_ids()[0]
+    outbox.enqueue('alarm-3', '103', 'Тревога', crew_id=crew_id, object_id=7)
+    dispatch_id, _, dispatched_at, _, _ = open_dispatch(crew_id)
+
+    # Пачка другого процесса: статусы перемешаны по времени
+    dispatch_log.write_events([
+        (dispatched_at + 600, 'free', crew_id, None),
+        (dispatched_at + 300, 'arrived', crew_id, None),
+    ])
+
+    assert db.fetch_all(
+        "SELECT kind, dispatch_id, object_id FROM dispatch_events WHERE kind != 'dispatch' ORDER BY id"
+    ) == [('arrived', dispatch_id, 7), ('free', dispatch_id, 7)]
+    assert open_dispatch(crew_id) is None
+    stats = dispatch_log.response_stats()
+    assert stats['arrival']['count'] == 1 and stats['arrival']['avg'] == 300
+    assert stats['handling']['max'] == 600
+
+
+def test_status_pressed_before_dispatch_is_not_attached(database):
+    crew_id = crew_ids()[0]
+    outbox.enqueue('alarm-4', '104', 'Тревога', crew_id=crew_id, object_id=7)
+    dispatched_at = open_dispatch(crew_id)[2]
+
+    # Статус нажат до вызова, а его пачка записана позже
+    dispatch_log.write_events([(dispatched_at - 5, 'arrived', crew_id, None)])
+
+    assert db.fetch_one("SELECT dispatch_id FROM dispatch_events WHERE kind = 'arrived'") == (None,)
+    assert open_dispatch(crew_id)[4] is None
+    assert 'arrival' not in dispatch_log.response_stats()
+
+
+def test_response_stats_aggregates(database):
+    first, second = crew_ids()[:2]
+    base = datetime(2026, 10, 14, 10, 0).timestamp()
+    events = []
+    for crew_id, offset, accept, arrival in ((first, 0, 20, 100), (second, 10, 50, 400)):
+        events += [
+            (base + offset, 'dispatch', crew_id, 7),
+            (base + offset + accept, 'busy', crew_id, None),
+            (base + offset + arrival, 'arrived', crew_id, None),
+        ]
+    dispatch_log.write_events(events)
+
+    accept = dispatch_log.response_stats()['accept']
+    assert (accept['count'], accept['avg'], accept['min'], accept['max']) == (2, 35, 20, 50)
+    assert accept['p50'] == 30 and accept['p90'] == 60
+    arrival = dispatch_log.response_stats('crew', str(second))['arrival']
+    assert (arrival['count'], arrival['max'], arrival['p90']) == (1, 400, 420)
+    shift = dispatch_log.shift_key(base)
+    assert dispatch_log.response_stats('shift', shift)['arrival']['count'] == 2
+
+
+def call(crew_id, object_id, moment, arrival):
+    """Вызов экипажа на объект в момент moment и прибытие через arrival секунд"""
+    dispatched_at = moment.timestamp()
+    return [
+        (dispatched_at, 'dispatch', crew_id, object_id),
+        (dispatched_at + arrival, 'arrived', crew_id, None),
+        (dispatched_at + arrival + 60, 'free', crew_id, None),
+    ]
+
+
+def rollups():
+    return {table: db.fetch_all(f'SELECT * FROM {table} ORDER BY 1, 2')
+            for table in ('dispatch_hourly', 'object_daily', 'object_monthly', 'response_daily', 'response_monthly')}
+
+
+def write_calls(crew_id):
+    # Август до периода, края периода по дням и целые месяцы
+    dispatch_log.write_events(
+        call(crew_id, 3, datetime(2026, 8, 1, 9), 100)
+        + call(crew_id, 3, datetime(2026, 8, 25, 9), 100)
+        + call(crew_id, 5, datetime(2026, 9, 10, 9), 200)
+        + call(crew_id, 5, datetime(2026, 10, 5, 14), 500)
+        + call(crew_id, 5, datetime(2026, 10, 18, 14), 500)
+    )
+
+
+def test_report_reads_monthly_and_daily_rollups(database):
+    crew_id = crew_ids()[0]
+    write_calls(crew_id)
+    today = date(2026, 10, 18)
+    first_day, last_day, first_hour, last_hour = report.report_period(60, today)
+
+    assert report.split_period(first_day, last_day, today) == (
+        ('2026-09', '2026-10'), [('2026-08-20', '2026-08-31')])
+    assert report.response_times(first_day, last_day, today=today) == [
+        (crew_id, 'arrival', 4, 325, 300, 600),
+        (crew_id, 'handling', 4, 385, 300, 600),
+    ]
+    assert [row[0] for row in report.response_times(first_day, last_day, by_crew=False, today=today)] == [0, 0]
+    assert [(place, object_id, count) for place, object_id, name, count
+            in report.top_objects(first_day, last_day, today=today)] == [(1, 5, 3), (2, 3, 1)]
+    hours = report.busiest_hours(first_hour, last_hour)
+    assert [(hour, count) for hour, count, share in hours] == [(9, 2), (14, 2)]
+    assert sum(share for hour, count, share in hours) == 1
+
+    built = report.build_report(60, today)
+    assert built['dispatches'] == 4
+    assert 'Вызовов: 4' in report.format_text(built)
+
+
+def test_rebuilt_rollups_match_incremental_ones(database):
+    write_calls(crew_ids()[0])
+    incremental = rollups()
+    with db.write_transaction() as conn:
+        dispatch_log.rebuild_rollups(conn)
+    assert rollups() == incremental
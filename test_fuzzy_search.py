@@ -0,0 +1,56 @@
+"""Проверки нечёткого поиска (fuzzy_search.py) на временной базе.
+
+Запуск: python -m pytest test_fuzzy_search.py
+"""
+import db
+import fuzzy_search
+
+
+def add_objects(objects):
+    """Добавить объекты (название, адрес) и пересчитать ключи поиска"""
+    with db.write_transaction() as conn:
+        conn.executemany("INSERT INTO objects (name, address, category) VALUES (?, ?, 'test')", objects)
+    fuzzy_search.refresh_all()
+
+
+def found(query, candidates=fuzzy_search.FUZZY_CANDIDATES, limit=3):
+    engine = fuzzy_search.FuzzySearch(candidates)
+    return [(row[1], row[2]) for row in engine.search(db.get_reader(), query, limit)]
+
+
+def test_typo_in_street_name(database):
+    add_objects([
+        ('Аптека', 'ул. Ленина, 15'),
+        ('Дом 5', 'ул. Ленина, 12'),
+        ('Магазин', 'ул. Ленина, 5'),
+    ])
+    assert found('ленена 5')[0] == ('Магазин', 'ул. Ленина, 5')
+
+
+def test_two_typos_in_long_word(database):
+    add_objects([('Школа', 'ул. Советская, 1')])
+    assert found('совецкая') == [('Школа', 'ул. Советская, 1')]
+
+
+def test_closer_typo_tier_is_taken_before_limit(database):
+    # Раньше по номеру - много объектов с двумя опечатками от запроса
+    add_objects([(f'Дом {number}', 'пос. Гагарино') for number in range(6)])
+    add_objects([('Библиотека', 'ул. Гагарина, 3')])
+
+    assert found('гагарена', candidates=3, limit=1) == [('Библиотека', 'ул. Гагарина, 3')]
+
+
+def test_name_match_is_kept_among_many_candidates(database):
+    # Раньше по номеру - склады, у которых 5 только в адресе
+    add_objects([('Склад', f'ул. Мира, 5 корп. {number}') for number in range(6)])
+    add_objects([('Склад №5', 'ул. Мира, 40')])
+
+    assert found('склад 5', candidates=3)[0] == ('Склад №5', 'ул. Мира, 40')
+
+
+def test_exact_matches_are_not_mixed_with_typos(database):
+    add_objects([('Кафе', 'пос. Ленино'), ('Кафе', 'ул. Ленина, 2')])
+    engine = fuzzy_search.FuzzySearch()
+    rows = engine.search(db.get_reader(), 'кафе ленина', 1)
+
+    assert [(row[1], row[2]) for row in rows] == [('Кафе', 'ул. Ленина, 2')]
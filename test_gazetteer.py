@@ -0,0 +1,45 @@
+"""Проверки локального справочника адресов (gazetteer.py).
+
+Запуск: python -m pytest test_gazetteer.py
+"""
+import db
+import gazetteer
+
+
+def add_object(address, lat, lon):
+    db.execute('INSERT INTO objects (name, address, category, notes, lat, lon) VALUES (?, ?, ?, ?, ?, ?)',
+               ('Тест', address, 'магазин', '', lat, lon))
+    gazetteer.refresh_all()
+
+
+def test_city_before_street_is_dropped():
+    assert gazetteer.lookup_keys('Москва Ленина 5') == ['москва ленина 5', 'ленина 5']
+    assert gazetteer.lookup_keys('Санкт-Петербург Невский пр. 10') == [
+        'санкт-петербург невский пр-кт 10', 'невский пр-кт 10']
+    assert gazetteer.lookup_keys('г. Москва, ул. Ленина, д. 5') == ['ленина 5']
+
+
+def test_street_qualifiers_are_kept():
+    assert gazetteer.lookup_keys('Большая Садовая 5') == ['большая садовая 5']
+    assert gazetteer.lookup_keys('ул. 1-я Тверская-Ямская, 5') == ['1-я тверская-ямская 5']
+    assert gazetteer.lookup_keys('Нижняя Красносельская 5') == ['нижняя красносельская 5']
+    assert gazetteer.lookup_keys('Москва Большая Садовая 5') == [
+        'москва большая садовая 5', 'большая садовая 5']
+
+
+def test_city_alone_is_not_a_street():
+    assert gazetteer.lookup_keys('Москва 5') == ['москва 5']
+
+
+def test_extra_localities():
+    assert ('химки',) in gazetteer.locality_names('Химки, Мытищи')
+    assert ('мытищи',) in gazetteer.locality_names('Химки, Мытищи')
+
+
+def test_lookup_does_not_match_another_street(database):
+    add_object('ул. Садовая, 5', 55.1, 37.1)
+    assert gazetteer.lookup('Садовая 5')['lat'] == 55.1
+    assert gazetteer.lookup('Москва Садовая 5')['lat'] == 55.1
+    # Только укороченный ключ совпал бы - адрес уходит в DaData
+    assert gazetteer.lookup('Большая Садовая 5') is None
+    assert gazetteer.lookup('Москва Большая Садовая 5') is None
@@ -0,0 +1,101 @@
+"""Проверки фонового геокодирования (geocode_worker.py) на временной базе.
+
+Запуск: python -m pytest test_geocode_worker.py
+"""
+import asyncio
+import json
+
+import httpx
+
+import db
+import geocoder
+import geocode_worker
+from geocode_cache import GeocodeCache
+
+
+def make_worker(handler):
+    """Воркер с клиентом DaData, запросы которого обрабатывает handler(query)"""
+    async def transport(request):
+        return handler(json.loads(request.content)['query'])
+
+    client = geocoder.DaDataGeocoder('test-key', url='http://dadata.test/suggest', hedge=False)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(transport))
+    client._slots = asyncio.Semaphore(client.max_in_flight)
+    return geocode_worker.GeocodeWorker(client, GeocodeCache(), rate=0, city='')
+
+
+def answering(found):
+    """Обработчик запросов: адреса из found (адрес -> (lat, lon)) найдены, остальные - нет"""
+    def answer(query):
+        if query not in found:
+            return httpx.Response(200, json={'suggestions': []})
+        lat, lon = found[query]
+        return httpx.Response(200, json={'suggestions': [
+            {'value': query, 'data': {'geo_lat': str(lat), 'geo_lon': str(lon)}}]})
+    return answer
+
+
+def first_objects(count):
+    return db.fetch_all('SELECT id, address FROM objects ORDER BY id LIMIT ?', (count,))
+
+
+def run_batch(worker, batch):
+    async def run():
+        try:
+            await worker.process_batch(batch)
+        finally:
+            await worker.client.close()
+    asyncio.run(run())
+
+
+def attempts():
+    return dict(db.fetch_all('SELECT object_id, status FROM geocode_attempts'))
+
+
+def test_batch_saves_coordinates_and_misses(database):
+    batch = first_objects(3)
+    (first_id, first), (second_id, second), (third_id, _) = batch
+    worker = make_worker(answering({first: (55.71, 37.61), second: (55.72, 37.62)}))
+    run_batch(worker, batch)
+
+    assert db.fetch_one('SELECT lat, lon FROM objects WHERE id = ?', (first_id,)) == (55.71, 37.61)
+    assert db.fetch_one('SELECT lat, lon FROM objects WHERE id = ?', (second_id,)) == (55.72, 37.62)
+    assert attempts() == {first_id: 'ok', second_id: 'ok', third_id: 'not_found'}
+    assert (worker.resolved, worker.not_found, worker.failed) == (2, 1, 0)
+
+
+def test_misses_are_not_recorded_when_dadata_failed(database):
+    batch = first_objects(3)
+    (first_id, first), (second_id, second), (third_id, _) = batch
+    answer = answering({first: (55.71, 37.61)})
+
+    def handler(query):
+        if query == second:
+            return httpx.Response(503, text='unavailable')
+        return answer(query)
+
+    worker = make_worker(handler)
+    run_batch(worker, batch)
+
+    # Промах мог быть следствием сбоя - его повторит следующий проход
+    assert attempts() == {first_id: 'ok'}
+    assert (worker.resolved, worker.not_found, worker.failed) == (1, 0, 2)
+
+
+def test_cached_addresses_are_not_requested(database):
+    batch = first_objects(2)
+    cache = GeocodeCache()
+    cache.put_many([(address, {'lat': 55.7, 'lon': 37.6, 'address': address}) for _, address in batch])
+    requested = []
+
+    def handler(query):
+        requested.append(query)
+        return httpx.Response(200, json={'suggestions': []})
+
+    worker = make_worker(handler)
+    worker.cache = cache
+    run_batch(worker, batch)
+
+    assert requested == []
+    assert worker.cache_hits == 2
+    assert worker.resolved == 2
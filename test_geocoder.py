@@ -0,0 +1,266 @@
+"""Проверки асинхронного клиента DaData (geocoder.py) без сети.
+
+Запуск: python -m pytest test_geocoder.py
+"""
+import asyncio
+import json
+
+import httpx
+
+import geocoder
+
+
+def make_geocoder(handler, **kwargs):
+    """Клиент DaData, запросы которого обрабатывает handler(request) вместо сети"""
+    client = geocoder.DaDataGeocoder('test-key', url='http://dadata.test/suggest', **kwargs)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client._slots = asyncio.Semaphore(client.max_in_flight)
+    return client
+
+
+def suggestion(query, lat=55.75, lon=37.62):
+    return {'suggestions': [{'value': query, 'data': {'geo_lat': str(lat), 'geo_lon': str(lon)}}]}
+
+
+def test_parse_suggestion():
+    assert geocoder.parse_suggestion(suggestion('Москва', 55.1, 37.2)) == {
+        'lat': 55.1, 'lon': 37.2, 'address': 'Москва'}
+    assert geocoder.parse_suggestion({'suggestions': []}) is None
+    assert geocoder.parse_suggestion({'suggestions': [{'value': 'Москва', 'data': {}}]}) is None
+
+
+def test_same_address_is_requested_once():
+    queries = []
+
+    async def handler(request):
+        queries.append(json.loads(request.content)['query'])
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=suggestion('Москва, ул. Ленина, 1'))
+
+    async def run():
+        client = make_geocoder(handler, hedge=False)
+        try:
+            return client, await asyncio.gather(
+                client.geocode('Москва, ул. Ленина, 1'),
+                client.geocode('  москва,  УЛ. Ленина, 1 '),
+            )
+        finally:
+            await client.close()
+
+    client, results = asyncio.run(run())
+    assert len(queries) == 1
+    assert results[0] == results[1] == {'lat': 55.75, 'lon': 37.62, 'address': 'Москва, ул. Ленина, 1'}
+    assert client.merged == 1
+
+
+def test_not_found_and_errors_are_told_apart():
+    async def handler(request):
+        query = json.loads(request.content)['query']
+        if query == 'нет такого':
+            return httpx.Response(200, json={'suggestions': []})
+        return httpx.Response(503, text='unavailable')
+
+    async def run():
+        client = make_geocoder(handler, hedge=False)
+        try:
+            return client, await client.lookup('нет такого'), await client.lookup('сбой')
+        finally:
+            await client.close()
+
+    client, not_found, failed = asyncio.run(run())
+    assert not_found == (None, True)
+    assert failed == (None, False)
+    assert client.errors == 1
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = geocoder.CircuitBreaker(failures=3, cooldown=30, clock=FakeClock())
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+    assert breaker.retry_in() == 30
+    assert breaker.opens == 1 and breaker.rejected == 1
+
+
+def test_breaker_lets_one_probe_through_and_closes_on_success():
+    clock = FakeClock()
+    breaker = geocoder.CircuitBreaker(failures=1, cooldown=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 31
+
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    # Пока пробный запрос в полёте, остальные отклоняются
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+    assert breaker.consecutive_failures == 0
+
+
+def test_breaker_reopens_when_probe_fails():
+    clock = FakeClock()
+    breaker = geocoder.CircuitBreaker(failures=1, cooldown=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 31
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert breaker.opens == 2
+    assert not breaker.allow()
+    assert breaker.retry_in() == 30
+
+
+def test_breaker_retries_lost_probe_after_cooldown():
+    clock = FakeClock()
+    breaker = geocoder.CircuitBreaker(failures=1, cooldown=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 31
+    assert breaker.allow()
+
+    # Пробный запрос пропал без ответа
+    clock.now = 45
+    assert not breaker.allow()
+    clock.now = 62
+    assert breaker.allow()
+
+
+def test_open_breaker_short_circuits_lookup():
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=suggestion('Москва'))
+
+    async def run():
+        breaker = geocoder.CircuitBreaker(failures=1, cooldown=30)
+        breaker.record_failure()
+        client = make_geocoder(handler, breaker=breaker)
+        try:
+            return client, await client.lookup('Москва')
+        finally:
+            await client.close()
+
+    client, result = asyncio.run(run())
+    assert result == (None, False)
+    assert requests == []
+    assert client.short_circuits == 1
+    assert not client.available()
+
+
+def delayed_handler(delays, cancelled):
+    """Обработчик: n-й запрос отвечает через delays[n] секунд (None - ошибкой 503)"""
+    calls = []
+
+    async def handler(request):
+        number = len(calls)
+        calls.append(number)
+        delay = delays[number]
+        if delay is None:
+            return httpx.Response(503, text='unavailable')
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(number)
+            raise
+        return httpx.Response(200, json=suggestion(f'ответ {number}'))
+
+    return handler, calls
+
+
+def hedging_geocoder(handler, budget):
+    """Клиент, которому доля страховок (HEDGE_MAX_SHARE) уже позволяет страховать"""
+    client = make_geocoder(handler, budget=budget)
+    # Будто бы 10 прошлых запросов: без истории первый запрос не страхуется
+    client.requests = 10
+    return client
+
+
+def run_lookup(handler, budget):
+    """Поиск адреса с бюджетом budget; дождаться запросов, оставшихся в полёте"""
+    async def run():
+        client = hedging_geocoder(handler, budget)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            result = await client.lookup('Москва, ул. Ленина, 1')
+            elapsed = loop.time() - started
+            # Дать отменённой страховке завершиться
+            await asyncio.sleep(0.05)
+            await asyncio.gather(*client._in_flight.values(), return_exceptions=True)
+            return client, result, elapsed
+        finally:
+            await client.close()
+    return asyncio.run(run())
+
+
+def test_hedge_wins_when_first_request_is_slow():
+    cancelled = []
+    handler, calls = delayed_handler([1.0, 0.0], cancelled)
+    # Ответов для p95 ещё нет - страховка через половину бюджета (0.25 с)
+    client, result, elapsed = run_lookup(handler, budget=0.5)
+
+    assert result == ({'lat': 55.75, 'lon': 37.62, 'address': 'ответ 1'}, True)
+    assert elapsed < 0.5
+    assert (client.hedges, client.hedge_wins) == (1, 1)
+    assert calls == [0, 1]
+
+
+def test_unfinished_hedge_is_cancelled_when_first_request_answers():
+    cancelled = []
+    handler, calls = delayed_handler([0.4, 5.0], cancelled)
+    client, result, elapsed = run_lookup(handler, budget=0.6)
+
+    assert result == ({'lat': 55.75, 'lon': 37.62, 'address': 'ответ 0'}, True)
+    assert (client.hedges, client.hedge_wins) == (1, 0)
+    assert cancelled == [1]
+
+
+def test_hedge_is_sent_at_once_after_failure():
+    cancelled = []
+    handler, calls = delayed_handler([None, 0.0], cancelled)
+    client, result, elapsed = run_lookup(handler, budget=2.0)
+
+    assert result[1] is True
+    # Страховка не ждала половины бюджета
+    assert elapsed < 0.5
+    assert client.hedges == 1
+
+
+def test_lookup_gives_up_after_budget():
+    cancelled = []
+    handler, calls = delayed_handler([5.0, 5.0], cancelled)
+
+    async def run():
+        client = hedging_geocoder(handler, 0.3)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            result = await client.lookup('Москва')
+            elapsed = loop.time() - started
+            await asyncio.sleep(0.05)
+            # Первый запрос общий для всех ждущих и продолжается, страховка - нет
+            return client, result, elapsed, list(cancelled)
+        finally:
+            await client.close()
+
+    client, result, elapsed, cancelled_by_lookup = asyncio.run(run())
+    assert result == (None, False)
+    assert elapsed < 0.5
+    assert client.timeouts == 1
+    assert client.hedges == 1
+    assert cancelled_by_lookup == [1]
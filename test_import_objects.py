@@ -0,0 +1,112 @@
+"""Проверки импорта справочника (import_objects.py) на временной базе.
+
+Запуск: python -m pytest test_import_objects.py
+"""
+import csv
+
+import pytest
+
+import db
+import import_objects
+# Триггеры очередей пересчёта ключей на objects, как в работающем боте
+import fuzzy_search  # noqa: F401
+import gazetteer  # noqa: F401
+
+HEADER = ['Номер договора', 'Название', 'Адрес', 'Широта', 'Долгота']
+
+
+def write_csv(path, rows, header=HEADER):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+def run_import(path, **kwargs):
+    kwargs.setdefault('progress', lambda message: None)
+    return import_objects.import_file(path, **kwargs)
+
+
+def imported(external_id):
+    return db.fetch_one('SELECT name, address, lat, lon FROM objects WHERE external_id = ?', (external_id,))
+
+
+def test_rows_are_upserted_by_external_id(database, tmp_path):
+    path = write_csv(tmp_path / 'first.csv', [
+        ['Д-1', 'Аптека', 'ул. Мира, 1', '55,7', '37,6'],
+        ['Д-2', 'Склад', 'ул. Мира, 2', '', ''],
+    ])
+    stats = run_import(path)
+    assert (stats['inserted'], stats['updated']) == (2, 0)
+
+    path = write_csv(tmp_path / 'second.csv', [
+        ['Д-1', 'Аптека №1', 'ул. Мира, 1', '55,7', '37,6'],
+        ['Д-2', 'Склад', 'ул. Мира, 2', '', ''],
+        ['Д-3', 'Кафе', 'ул. Мира, 3', '', ''],
+    ])
+    stats = run_import(path)
+    assert (stats['inserted'], stats['updated'], stats['unchanged']) == (1, 1, 1)
+    assert imported('Д-1') == ('Аптека №1', 'ул. Мира, 1', 55.7, 37.6)
+    assert db.fetch_one("SELECT count(*) FROM objects WHERE external_id LIKE 'Д-%'") == (3,)
+
+
+def test_objects_added_earlier_are_updated_not_duplicated(database, tmp_path):
+    with db.write_transaction() as conn:
+        conn.executemany('INSERT INTO objects (name, address) VALUES (?, ?)', [
+            ('Гараж', 'ул. Лесная, 7'), ('Гараж', 'ул. Лесная, 7')])
+    before = db.fetch_one('SELECT count(*) FROM objects')[0]
+
+    path = write_csv(tmp_path / 'objects.csv', [['', 'ГАРАЖ', 'улица Лесная, 7', '55.1', '37.1']])
+    stats = run_import(path, batch_size=7)
+
+    assert stats['updated'] == 1
+    assert db.fetch_one('SELECT count(*) FROM objects')[0] == before
+    # Ключ достался первому из дубликатов, второй остался без ключа
+    first, second = db.fetch_all("SELECT name, external_id, lat FROM objects WHERE id > ? ORDER BY id", (before - 2,))
+    assert first == ('ГАРАЖ', 'гараж|лесная 7', 55.1)
+    assert second == ('Гараж', None, None)
+
+
+def test_rejected_rows_are_written_to_file(database, tmp_path):
+    path = write_csv(tmp_path / 'objects.csv', [
+        ['Д-1', 'Аптека', 'ул. Мира, 1', '55.7', '37.6'],
+        ['Д-2', '', 'ул. Мира, 2', '', ''],
+        ['Д-3', 'Кафе', 'ул. Мира, 3', '155', '37.6'],
+        ['Д-4', 'Кафе', 'ул. Мира, 4', '55.7', ''],
+    ])
+    rejects = tmp_path / 'rejects.csv'
+    stats = run_import(path, rejects_path=str(rejects))
+
+    assert (stats['inserted'], stats['rejected']) == (1, 3)
+    with open(rejects, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert [(row[0], row[2]) for row in rows] == [('3', 'Д-2'), ('4', 'Д-3'), ('5', 'Д-4')]
+    assert 'пустое поле name' in rows[0][1]
+
+
+def test_interrupted_import_continues_from_checkpoint(database, tmp_path):
+    rows = [[f'Д-{number}', f'Объект {number}', f'ул. Мира, {number}', '', ''] for number in range(1, 11)]
+    rows[1][1] = ''
+    rows[7][1] = ''
+    path = write_csv(tmp_path / 'objects.csv', rows)
+    rejects = tmp_path / 'rejects.csv'
+
+    def interrupt(message):
+        if 'строк' in message:
+            raise KeyboardInterrupt
+
+    # Первая пачка (4 строки) записана вместе с контрольной точкой, затем импорт прерван
+    with pytest.raises(KeyboardInterrupt):
+        run_import(path, batch_size=3, rejects_path=str(rejects), progress=interrupt)
+    assert db.fetch_one("SELECT count(*) FROM objects WHERE external_id LIKE 'Д-%'") == (3,)
+
+    stats = run_import(path, batch_size=3, rejects_path=str(rejects))
+    assert stats['skipped'] == 4
+    assert (stats['rows'], stats['inserted'], stats['rejected']) == (6, 5, 1)
+    assert db.fetch_one("SELECT count(*) FROM objects WHERE external_id LIKE 'Д-%'") == (8,)
+    with open(rejects, newline='', encoding='utf-8') as f:
+        assert [row[2] for row in csv.reader(f)] == ['Д-2', 'Д-8']
+
+    # Файл импортирован до конца - повторный запуск ничего не делает
+    assert run_import(path)['rows'] == 0
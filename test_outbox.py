@@ -0,0 +1,115 @@
+"""Проверки очереди исходящих тревог (outbox.py) на временной базе.
+
+Запуск: python -m pytest test_outbox.py
+"""
+import asyncio
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+import db
+import outbox
+
+
+class FakeBot:
+    """Бот, который отвечает на send_message по заданному сценарию"""
+
+    def __init__(self, errors=None):
+        # chat_id -> список исключений для очередных отправок в этот чат
+        self.errors = errors or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def outbox_row(key):
+    return db.fetch_one(
+        'SELECT status, attempts, next_attempt_at, last_error FROM outbox WHERE idempotency_key = ?', (key,))
+
+
+def run_with_worker(bot, scenario):
+    """Выполнить scenario(worker) с запущенной доставкой"""
+    async def run():
+        worker = outbox.OutboxWorker(poll_interval=0.05)
+        await worker.start(bot)
+        try:
+            return await scenario(worker)
+        finally:
+            await worker.stop()
+    return asyncio.run(run())
+
+
+def test_repeated_key_returns_stored_status(database):
+    bot = FakeBot()
+
+    async def scenario(worker):
+        first = await worker.send('alarm-1', '101', 'Тревога', wait=5)
+        second = await worker.send('alarm-1', '101', 'Тревога', wait=5)
+        return first, second
+
+    first, second = run_with_worker(bot, scenario)
+    assert first['ok'] and not first.get('duplicate')
+    assert second['duplicate'] and second['ok'] and second['status'] == 'sent'
+    assert bot.sent == [('101', 'Тревога')]
+
+
+def test_queued_duplicate_is_not_reported_as_sent(database):
+    async def run():
+        # Доставка не запущена - сообщение остаётся в очереди
+        worker = outbox.OutboxWorker()
+        await worker.send('alarm-2', '102', 'Тревога')
+        return await worker.send('alarm-2', '102', 'Тревога')
+
+    result = asyncio.run(run())
+    assert result['duplicate'] and not result['ok']
+    assert result['status'] == 'pending'
+
+
+def test_failed_key_is_enqueued_again(database):
+    bot = FakeBot({'103': [BadRequest('Chat not found')]})
+
+    async def scenario(worker):
+        first = await worker.send('alarm-3', '103', 'Тревога', wait=5)
+        second = await worker.send('alarm-3', '103', 'Тревога', wait=5)
+        return first, second
+
+    first, second = run_with_worker(bot, scenario)
+    assert not first['ok'] and first['permanent']
+    assert second['ok'] and not second.get('duplicate')
+    assert outbox_row('alarm-3')[:2] == ('sent', 1)
+
+
+def test_throttled_chat_is_rescheduled_without_holding_the_batch(database):
+    bot = FakeBot({'104': [RetryAfter(30)]})
+
+    async def scenario(worker):
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            worker.send('alarm-4', '104', 'Тревога', wait=1),
+            worker.send('alarm-5', '105', 'Тревога', wait=1),
+        )
+        return results, time.perf_counter() - started
+
+    (throttled, delivered), elapsed = run_with_worker(bot, scenario)
+    assert delivered['ok']
+    assert throttled is None
+    assert elapsed < 2
+    status, attempts, next_attempt_at, last_error = outbox_row('alarm-4')
+    # 429 не засчитывается как попытка и переносит отправку на retry_after
+    assert (status, attempts) == ('pending', 0)
+    assert next_attempt_at > time.time() + 25
+
+
+def test_stale_sending_row_is_claimed_again(database, monkeypatch):
+    outbox.enqueue('alarm-6', '106', 'Тревога')
+    monkeypatch.setattr(outbox, 'OUTBOX_SENDING_TIMEOUT', 60)
+    assert len(outbox.claim_batch()) == 1
+    # Итоги пачки не записаны - до истечения срока сообщение не берётся повторно
+    assert outbox.claim_batch() == []
+
+    db.execute("UPDATE outbox SET next_attempt_at = ? WHERE idempotency_key = 'alarm-6'", (time.time() - 1,))
+    assert len(outbox.claim_batch()) == 1
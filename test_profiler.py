@@ -0,0 +1,65 @@
+"""Проверки установки профилирования по сигналу (profiler.py).
+
+Запуск: python -m pytest test_profiler.py
+"""
+import asyncio
+import signal
+
+import pytest
+from telegram.ext import Application, CommandHandler
+
+import profiler
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='нет SIGUSR1')
+
+
+async def dispatcher_command(update, context):
+    pass
+
+
+async def crew_command(update, context):
+    pass
+
+
+def make_application(callback):
+    application = Application.builder().token('123456:TEST').build()
+    application.add_handler(CommandHandler('test', callback))
+    return application
+
+
+def test_signal_handler_is_installed_once_for_both_bots():
+    dispatcher, crews = make_application(dispatcher_command), make_application(crew_command)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        installed = []
+        add_signal_handler = loop.add_signal_handler
+
+        def counting(sig, callback, *args):
+            installed.append(sig)
+            add_signal_handler(sig, callback, *args)
+
+        loop.add_signal_handler = counting
+        try:
+            profiler.install_signal_handler(dispatcher)
+            profiler.install_signal_handler(crews)
+            profiler.install_signal_handler(crews)
+            return installed, profiler.running_handler_codes()
+        finally:
+            loop.remove_signal_handler(signal.SIGUSR1)
+
+    installed, codes = asyncio.run(run())
+    assert installed == [signal.SIGUSR1]
+    assert sorted(codes.values()) == ['crew_command', 'dispatcher_command']
+
+
+def test_new_loop_gets_its_own_signal_handler():
+    async def run(application):
+        profiler.install_signal_handler(application)
+        try:
+            return profiler.running_handler_codes()
+        finally:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+
+    assert list(asyncio.run(run(make_application(dispatcher_command))).values()) == ['dispatcher_command']
+    assert list(asyncio.run(run(make_application(crew_command))).values()) == ['crew_command']
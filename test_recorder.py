@@ -0,0 +1,54 @@
+"""Проверки обезличивания записанных обновлений (recorder.py).
+
+Запуск: python -m pytest test_recorder.py
+"""
+import json
+
+import recorder
+
+DISPATCHER_ID = 555
+
+
+def contact_update(user_id=777):
+    return {
+        'update_id': 1,
+        'message': {
+            'message_id': 10,
+            'date': 0,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Иван', 'username': 'ivan'},
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Иван'},
+            'contact': {'phone_number': '+79001234567', 'first_name': 'Пётр', 'last_name': 'Петров',
+                        'user_id': 888, 'vcard': 'BEGIN:VCARD'},
+        },
+    }
+
+
+def recorded(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line)['update'] for line in f]
+
+
+def test_shared_contact_is_anonymized(tmp_path):
+    path = tmp_path / 'updates.jsonl'
+    writer = recorder.UpdateRecorder(str(path), 'dispatcher', DISPATCHER_ID, salt='test')
+    writer.write(contact_update())
+    writer.close()
+
+    (update,) = recorded(path)
+    contact = update['message']['contact']
+    assert contact == {'first_name': 'Пользователь', 'user_id': contact['user_id']}
+    assert contact['user_id'] != 888
+    assert 'Пётр' not in json.dumps(update, ensure_ascii=False)
+
+
+def test_both_bots_without_salt_share_pseudonyms(tmp_path):
+    paths = tmp_path / 'dispatcher.jsonl', tmp_path / 'crews.jsonl'
+    writers = [recorder.UpdateRecorder(str(path), name, DISPATCHER_ID, salt='')
+               for path, name in zip(paths, ('dispatcher', 'crews'))]
+    for writer in writers:
+        writer.write(contact_update())
+        writer.close()
+
+    first, second = (recorded(path)[0]['message'] for path in paths)
+    assert first['from']['id'] == second['from']['id'] != 777
+    assert first['contact']['user_id'] == second['contact']['user_id']
@@ -0,0 +1,109 @@
+"""Проверки постраничного поиска (search_index.py) и кнопок листания в bot.py.
+
+Запуск: python -m pytest test_search_index.py
+"""
+import db
+import fuzzy_search
+import search_index
+import bot
+
+
+def add_objects(objects):
+    with db.write_transaction() as conn:
+        conn.executemany("INSERT INTO objects (name, address, category) VALUES (?, ?, 'test')", objects)
+
+
+def many_pharmacies():
+    """Аптеки с разной оценкой bm25: лучше всех - объекты с поздними id"""
+    add_objects([(f'Аптека {number}', f'ул. Мира, {number}, павильон у рынка и остановки')
+                 for number in range(1, 13)])
+    add_objects([('Аптека', 'ул. Аптечная, 1')])
+
+
+def all_rows(query):
+    return search_index.search_page(db.get_reader(), query, None, 1000)
+
+
+def walk(query, limit):
+    """Все страницы вперёд по курсору, затем назад от последней"""
+    conn = db.get_reader()
+    pages = []
+    rows = search_index.search_page(conn, query, None, limit)
+    while True:
+        pages.append(rows[:limit])
+        if len(rows) <= limit:
+            break
+        last = rows[limit - 1]
+        rows = search_index.search_page(conn, query, (last[-1], last[0]), limit)
+
+    back = [pages[-1]]
+    while len(back) < len(pages):
+        first = back[-1][0]
+        back.append(search_index.search_page(conn, query, (first[-1], first[0]), limit, backward=True)[-limit:])
+    return pages, back[::-1]
+
+
+def test_first_page_is_ranked(database):
+    many_pharmacies()
+    rows = all_rows('аптека')
+    ranks = [row[-1] for row in rows]
+    assert ranks == sorted(ranks)
+    # Лучшее совпадение - не самый ранний объект
+    assert rows[0][1:3] == ('Аптека', 'ул. Аптечная, 1')
+    assert search_index.search_page(db.get_reader(), 'аптека', None, 3)[:3] == rows[:3]
+
+
+def test_pages_follow_rank_forward_and_backward(database):
+    many_pharmacies()
+    expected = [row[0] for row in all_rows('аптека')]
+
+    forward, backward = walk('аптека', 4)
+    assert [row[0] for page in forward for row in page] == expected
+    assert [[row[0] for row in page] for page in backward] == [[row[0] for row in page] for page in forward]
+
+
+def test_short_words_only_query_pages_by_id(database):
+    add_objects([(f'ТЦ {number}', f'пр. Мира, д. {number}') for number in (5, 15, 25, 35)])
+    fuzzy_search.refresh_all()
+    pages, backward = walk('тц', 2)
+    ids = [row[0] for page in pages for row in page]
+    assert len(ids) == 4 and ids == sorted(ids)
+    assert backward == pages
+
+
+def test_short_words_ignore_case(database):
+    add_objects([('ТЦ Мега', 'ул. Мира, 5'), ('Тир', 'ул. Мира, 15')])
+    fuzzy_search.refresh_all()
+    conn = db.get_reader()
+
+    assert [row[1] for row in search_index.search(conn, 'Тц')] == ['ТЦ Мега']
+    assert [row[1] for row in search_index.search(conn, 'мира 5')] == ['ТЦ Мега']
+    # Слова, которые нормализация отбрасывает, не превращают запрос в выборку всех объектов
+    assert search_index.search(conn, 'д') == []
+
+
+def test_short_words_only_query_reads_the_index(database):
+    select, params = search_index._page_source('тц 5')
+    plan = ' '.join(row[3] for row in db.get_reader().execute(f'EXPLAIN QUERY PLAN {select}', params))
+    assert 'SCAN o' not in plan
+    assert 'search_keys_fts' in plan
+
+
+def test_page_buttons_carry_rank_cursor(database):
+    many_pharmacies()
+    rows = search_index.search_page(db.get_reader(), 'аптека', None, bot.SEARCH_PAGE_SIZE)
+    text, markup = bot.build_results_page(rows, 13, 1, token=7)
+
+    (next_button,) = markup.inline_keyboard[-1]
+    last = rows[bot.SEARCH_PAGE_SIZE - 1]
+    assert next_button.callback_data == f"page_7_2_n_{last[-1]!r}_{last[0]}"
+    assert len(next_button.callback_data.encode()) <= 64
+
+    _, token, page, direction, rank, cursor = next_button.callback_data.split('_')
+    following = bot.search_page('аптека', (float(rank), int(cursor)))
+    assert following[0] == all_rows('аптека')[bot.SEARCH_PAGE_SIZE]
+
+    text, markup = bot.build_results_page(following, 13, 2, token=7)
+    previous_button = markup.inline_keyboard[-1][0]
+    first = following[0]
+    assert previous_button.callback_data == f"page_7_1_p_{first[-1]!r}_{first[0]}"
@@ -0,0 +1,72 @@
+"""Проверки режима webhook (webhook.py): secret token и настройки.
+
+Запуск: python -m pytest test_webhook.py
+"""
+import asyncio
+import json
+
+import pytest
+from telegram.ext import Application
+
+import webhook
+from bench import UpdateFactory
+
+SECRET = 'test-secret'
+
+
+def make_server():
+    application = Application.builder().token('123456:TEST').build()
+    return application, webhook.WebhookServer(application, '/telegram', SECRET)
+
+
+def post(server, headers):
+    body = json.dumps(UpdateFactory(1).message('/start')).encode()
+    return asyncio.run(server._handle_update('POST', headers, body))
+
+
+def test_request_without_secret_is_rejected():
+    application, server = make_server()
+    status, _, _ = post(server, {})
+    assert status == 403
+    assert server.rejected == 1
+    assert application.update_queue.empty()
+
+
+def test_request_with_wrong_secret_is_rejected():
+    application, server = make_server()
+    status, _, _ = post(server, {webhook.SECRET_HEADER: 'wrong'})
+    assert status == 403
+    assert application.update_queue.empty()
+
+
+def test_request_with_secret_is_accepted():
+    application, server = make_server()
+    status, _, _ = post(server, {webhook.SECRET_HEADER: SECRET})
+    assert status == 200
+    assert server.accepted == 1
+    assert application.update_queue.qsize() == 1
+
+
+def test_server_requires_secret():
+    application = Application.builder().token('123456:TEST').build()
+    with pytest.raises(ValueError):
+        webhook.WebhookServer(application, '/telegram', None)
+
+
+def test_config_generates_secret_for_registered_webhook(monkeypatch):
+    monkeypatch.setenv('WEBHOOK_PORT', '8443')
+    monkeypatch.setenv('WEBHOOK_URL', 'https://bot.example.com')
+    monkeypatch.delenv('WEBHOOK_SECRET', raising=False)
+    first, second = webhook.config_from_env(), webhook.config_from_env()
+    assert first.secret and second.secret and first.secret != second.secret
+
+
+def test_config_without_url_needs_secret(monkeypatch):
+    monkeypatch.setenv('GBR_WEBHOOK_PORT', '8444')
+    monkeypatch.delenv('GBR_WEBHOOK_URL', raising=False)
+    monkeypatch.delenv('GBR_WEBHOOK_SECRET', raising=False)
+    with pytest.raises(ValueError):
+        webhook.config_from_env('GBR_')
+
+    monkeypatch.setenv('GBR_WEBHOOK_SECRET', SECRET)
+    assert webhook.config_from_env('GBR_').secret == SECRET
@@ -0,0 +1,245 @@
+"""Режим webhook для ботов: встроенный HTTP-сервер вместо long polling.
+
+Проверка локально - отправить записанные обновления (по одному JSON в строке):
+    python webhook.py http://127.0.0.1:8443/telegram updates.jsonl --secret SECRET
+"""
+import os
+import hmac
+import json
+import time
+import signal
+import asyncio
+import logging
+import secrets
+import argparse
+from collections import namedtuple
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram передаёт secret_token
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+WebhookConfig = namedtuple('WebhookConfig', 'url listen port path secret')
+
+
+def config_from_env(prefix=''):
+    """Настройки webhook из переменных окружения {prefix}WEBHOOK_*.
+
+    Режим включён, если задан {prefix}WEBHOOK_PORT; {prefix}WEBHOOK_URL
+    (публичный адрес) нужен, чтобы зарегистрировать webhook в Telegram.
+    Если порт не задан - None, бот работает через polling.
+
+    Без {prefix}WEBHOOK_SECRET кто угодно мог бы присылать боту обновления:
+    если бот сам регистрирует webhook (задан URL), secret генерируется
+    и передаётся Telegram, иначе - ValueError.
+    """
+    port = os.getenv(f'{prefix}WEBHOOK_PORT')
+    if not port:
+        return None
+    url = os.getenv(f'{prefix}WEBHOOK_URL')
+    secret = os.getenv(f'{prefix}WEBHOOK_SECRET')
+    if not secret:
+        if not url:
+            raise ValueError(f"Для webhook без {prefix}WEBHOOK_URL нужен {prefix}WEBHOOK_SECRET")
+        secret = secrets.token_urlsafe(32)
+        logger.info(f"{prefix}WEBHOOK_SECRET не задан - сгенерирован на время работы")
+    return WebhookConfig(
+        url=url,
+        listen=os.getenv(f'{prefix}WEBHOOK_LISTEN', '127.0.0.1'),
+        port=int(port),
+        path=os.getenv(f'{prefix}WEBHOOK_PATH', '/telegram'),
+        secret=secret,
+    )
+
+
+class WebhookServer:
+    """Принимает обновления от Telegram и передаёт их в Application.
+
+    Замеряет задержку от получения обновления до запуска обработчиков.
+    Запросы без верного secret token отклоняются (403).
+    """
+
+    def __init__(self, application, path, secret):
+        if not secret:
+            raise ValueError("Webhook без secret token принимал бы обновления от кого угодно")
+        self.application = application
+        self.path = path
+        self.secret = secret
+        self._http = HttpServer({path: self._handle_update})
+        # update_id -> время получения
+        self._received = {}
+        self.accepted = 0
+        self.rejected = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_count = 0
+
+        # Самая первая группа обработчиков - только замер задержки
+        application.add_handler(TypeHandler(Update, self._measure), group=-100)
+
+    async def start(self, listen='127.0.0.1', port=0):
+        """Запустить HTTP-сервер, вернуть фактический порт"""
+        return await self._http.start(listen, port)
+
+    async def stop(self):
+        await self._http.stop()
+
+    async def _handle_update(self, method, headers, body):
+        if method != 'POST':
+            return 405, b'', 'text/plain'
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, ''), self.secret):
+            self.rejected += 1
+            logger.warning("Webhook: запрос с неверным secret token отклонён")
+            return 403, b'', 'text/plain'
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except ValueError:
+            return 400, b'', 'text/plain'
+        if update is None:
+            return 400, b'', 'text/plain'
+
+        self._received[update.update_id] = time.perf_counter()
+        self.accepted += 1
+        await self.application.update_queue.put(update)
+        return 200, b'', 'text/plain'
+
+    async def _measure(self, update, context):
+        received = self._received.pop(update.update_id, None)
+        if received is None:
+            return
+        latency = time.perf_counter() - received
+        self.latency_total += latency
+        self.latency_count += 1
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def stats(self):
+        """Счётчики webhook и задержка до обработчиков"""
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'update_to_handler_avg_ms': (
+                self.latency_total / self.latency_count * 1000) if self.latency_count else 0.0,
+            'update_to_handler_max_ms': self.latency_max * 1000,
+        }
+
+
+async def start_application(application, config):
+    """Запустить Application: webhook, если config задан, иначе polling.
+
+    Возвращает WebhookServer (или None для polling) для stop_application.
+    """
+    server = WebhookServer(application, config.path, config.secret) if config else None
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    if server is None:
+        await application.updater.start_polling()
+        return None
+
+    port = await server.start(config.listen, config.port)
+    if config.url:
+        await application.bot.set_webhook(
+            url=config.url.rstrip('/') + config.path,
+            secret_token=config.secret,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    logger.info(f"Webhook слушает http://{config.listen}:{port}{config.path}")
+    return server
+
+
+async def stop_application(application, server):
+    """Остановить Application, запущенное start_application"""
+    if server is not None:
+        await server.stop()
+        logger.info(f"Webhook остановлен: {server.stats()}")
+    elif application.updater and application.updater.running:
+        await application.updater.stop()
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+async def wait_for_stop_signal():
+    """Дождаться SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await stop_event.wait()
+
+
+async def serve(application, config):
+    """Запустить бота в режиме webhook и работать до SIGINT/SIGTERM"""
+    server = await start_application(application, config)
+    try:
+        await wait_for_stop_signal()
+    finally:
+        await stop_application(application, server)
+
+
+def run(application, config):
+    """Webhook, если он настроен, иначе обычный long polling"""
+    if config is None:
+        application.run_polling()
+    else:
+        asyncio.run(serve(application, config))
+
+
+def post_updates(url, path, secret=None):
+    """Отправить записанные обновления на webhook и показать время ответа"""
+    import http.client
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80)
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+
+    timings = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            # Запись recorder.py: обновление - в поле update
+            record = json.loads(line)
+            body = json.dumps(record.get('update', record), ensure_ascii=False).encode('utf-8')
+            started = time.perf_counter()
+            conn.request('POST', parts.path or '/', body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status != 200:
+                print(f"Ответ {response.status} на обновление: {line[:80]}")
+    conn.close()
+
+    if timings:
+        timings.sort()
+        print(f"Отправлено {len(timings)} обновлений, "
+              f"среднее {sum(timings) / len(timings):.2f} мс, "
+              f"p50 {timings[len(timings) // 2]:.2f} мс, макс {timings[-1]:.2f} мс")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Отправка записанных обновлений на webhook')
+    parser.add_argument('url', help='адрес webhook, например http://127.0.0.1:8443/telegram')
+    parser.add_argument('updates', help='файл с обновлениями (JSON в строке)')
+    parser.add_argument('--secret', help='secret token webhook')
+    args = parser.parse_args()
+    post_updates(args.url, args.updates, args.secret)